@@ -0,0 +1,58 @@
+import os
+from common import measure, parse_args, report
+from bench_bitstream import trace
+
+from stego import StegoTranscoder, ARRANGEMENT_PROBING, ARRANGEMENT_FISHER_YATES, get_arrangement_cache
+from legacy import shuffled_arrangement_list
+
+# Height, width and channels of the covers in images/
+COVER_SHAPE = (1316, 960, 3)
+MESSAGE_SIZES = [256, 1024, 4096, 16384]
+# Probing is quadratic in the payload size, so skip it for the largest payloads
+PROBING_LIMIT = 4096
+
+def run(repeat: int) -> list[dict]:
+    key = os.urandom(32)
+    height, width, channels = COVER_SHAPE
+    rows = []
+
+    for size in MESSAGE_SIZES:
+        # Unkeyed sockets (no encryption) use the sequential arrangement
+        for name, version, rearrange_key in [("unkeyed", ARRANGEMENT_FISHER_YATES, None),
+                                             ("probing", ARRANGEMENT_PROBING, key),
+                                             ("fisher_yates", ARRANGEMENT_FISHER_YATES, key)]:
+            if version == ARRANGEMENT_PROBING and size > PROBING_LIMIT:
+                continue
+            transcoder = StegoTranscoder(rearrange_key=rearrange_key, arrangement_version=version)
+            result = measure(lambda: transcoder._generate_pixel_arrangement(height, width, channels, size * 8), repeat)
+
+            # Peak memory while consuming the arrangement chunk by chunk, as encode/decode do
+            consume = lambda: sum(len(chunk) for chunk in transcoder._iter_pixel_arrangement(height, width, channels, size * 8))
+            peak_kb, _ = trace(consume)
+            rows.append({"algorithm": name, "msg_bytes": size, "time_s": result["min_s"], "peak_KB": peak_kb})
+
+        # Materialized list, as before chunked generation
+        num = transcoder._pixels_needed(size * 8, channels)
+        start = transcoder._pixels_needed(transcoder._header_size, channels)
+        legacy = lambda: shuffled_arrangement_list(start, height * width, num, transcoder._generate_csprng(size * 8))
+        result = measure(legacy, repeat)
+        peak_kb, _ = trace(legacy)
+        rows.append({"algorithm": "fisher_yates_list", "msg_bytes": size, "time_s": result["min_s"], "peak_KB": peak_kb})
+
+        # Repeated payload length to the same peer, served from the arrangement cache
+        cached = StegoTranscoder(rearrange_key=key, cache_arrangements=True)
+        get_arrangement_cache().clear()
+        consume(), cached._generate_pixel_arrangement(height, width, channels, size * 8)
+        consume = lambda: sum(len(chunk) for chunk in cached._iter_pixel_arrangement(height, width, channels, size * 8))
+        result = measure(consume, repeat)
+        peak_kb, _ = trace(consume)
+        rows.append({"algorithm": "fisher_yates_cached", "msg_bytes": size, "time_s": result["min_s"], "peak_KB": peak_kb})
+
+    return rows
+
+def main():
+    args = parse_args("Pixel arrangement generators, keyed and unkeyed")
+    report("pixel_arrangement", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import os
+import time
+import tracemalloc
+from common import parse_args, report
+
+from bitstream import BitStream
+from stego import EMBED_CHUNK_PIXELS
+from legacy import LoopStegoTranscoder, bits_to_bytes, unpackbits_to_symbols, unpackbits_from_symbols
+
+MESSAGE_SIZES = [4096, 65536, 2**20]
+CHAN_DENSITY = 2
+CHANNELS = 3
+# Bit lists take 8 pointers per message byte, so keep them to the smaller sizes
+LIST_LIMIT = 65536
+
+# Runs fn once under tracemalloc. Returns its peak traced memory in KB and its duration
+def trace(fn) -> tuple[float, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024, elapsed
+
+def run(repeat: int) -> list[dict]:
+    legacy = LoopStegoTranscoder(chan_density=CHAN_DENSITY)
+    rows = []
+
+    for size in MESSAGE_SIZES:
+        message = os.urandom(size)
+        symbols = BitStream(message).symbols(CHAN_DENSITY, CHANNELS)
+        bits = legacy._bytes_to_bitstring(message) if size <= LIST_LIMIT else None
+
+        cases = [
+            ("encode", "bit_list", lambda: legacy._bytes_to_bitstring(message)),
+            ("encode", "unpackbits", lambda: unpackbits_to_symbols(message, CHAN_DENSITY, CHANNELS)),
+            ("encode", "bitstream", lambda: BitStream(message).symbols(CHAN_DENSITY, CHANNELS)),
+            # As finish_cover consumes it, one embedding chunk at a time
+            ("encode", "bitstream_chunked", lambda: sum(1 for _ in BitStream(message).iter_symbols(
+                CHAN_DENSITY, EMBED_CHUNK_PIXELS * CHANNELS, CHANNELS))),
+            ("decode", "bit_list", lambda: bits_to_bytes(bits)),
+            ("decode", "unpackbits", lambda: unpackbits_from_symbols(symbols, CHAN_DENSITY, size * 8)),
+            ("decode", "bitstream", lambda: BitStream.pack(symbols, CHAN_DENSITY, size * 8)),
+        ]
+        for op, path, fn in cases:
+            if path == "bit_list" and bits is None:
+                continue
+            samples = [trace(fn) for _ in range(repeat)]
+            peak_kb = min(peak for peak, _ in samples)
+            rows.append({"op": op, "path": path, "msg_bytes": size, "peak_KB": peak_kb,
+                         "peak_per_msg_byte": peak_kb * 1024 / size, "time_s": min(t for _, t in samples)})
+
+    return rows
+
+def main():
+    args = parse_args("Memory and time to turn payloads into channel symbols and back")
+    report("bitstream", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
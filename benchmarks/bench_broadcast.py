@@ -0,0 +1,62 @@
+import os
+import socket
+import threading
+from common import IMAGE_DIR, measure, parse_args, report
+
+from stego import StegoTranscoder
+from stegsocket import StegoSocket, HEADER_SIZE, BYTE_ORDER
+
+CHANNEL_SIZES = [1, 5, 20, 50]
+MESSAGE = b'{"messages": ["alice> hello everyone", "bob> hi alice"]}'
+
+# Builds a socket with random per-peer keys, standing in for a completed key exchange
+def keyed_socket(sock: socket.socket) -> StegoSocket:
+    stego_sock = StegoSocket(IMAGE_DIR, sock)
+    stego_sock._use_encryption = True
+    stego_sock._derived_key = os.urandom(32)
+    stego_sock._transcoder = StegoTranscoder(rearrange_key=os.urandom(32))
+    return stego_sock
+
+# Reads and discards frames so the sender never blocks on a full socket buffer
+def drain(sock: socket.socket):
+    while True:
+        header = sock.recv(HEADER_SIZE, socket.MSG_WAITALL)
+        if len(header) < HEADER_SIZE:
+            return
+        remaining = int.from_bytes(header, BYTE_ORDER)
+        while remaining > 0:
+            data = sock.recv(min(remaining, 1 << 20))
+            if not data:
+                return
+            remaining -= len(data)
+
+def run(repeat: int) -> list[dict]:
+    rows = []
+
+    for size in CHANNEL_SIZES:
+        pairs = [socket.socketpair() for _ in range(size)]
+        members = [keyed_socket(relay_end) for relay_end, _ in pairs]
+        for _, client_end in pairs:
+            threading.Thread(target=drain, args=(client_end,), daemon=True).start()
+
+        per_peer = measure(lambda: [member.send(MESSAGE) for member in members], repeat)
+        shared = measure(lambda: StegoSocket.broadcast(members, MESSAGE), repeat)
+        rows.append({
+            "members": size,
+            "per_peer_s": per_peer["min_s"],
+            "broadcast_s": shared["min_s"],
+            "speedup": per_peer["min_s"] / shared["min_s"],
+        })
+
+        for relay_end, client_end in pairs:
+            relay_end.close()
+            client_end.close()
+
+    return rows
+
+def main():
+    args = parse_args("Relay broadcast latency vs. channel size")
+    report("broadcast", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
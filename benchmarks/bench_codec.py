@@ -0,0 +1,41 @@
+import os
+from common import IMAGE_DIR, measure, parse_args, report
+
+from stego import StegoTranscoder, available_codecs
+from covercache import CoverCache
+
+MESSAGE = os.urandom(32 * 1024)
+
+def run(repeat: int) -> list[dict]:
+    covers = CoverCache()
+    paths = sorted(os.path.join(IMAGE_DIR, f) for f in os.listdir(IMAGE_DIR))
+    key = os.urandom(32)
+
+    rows = []
+    for codec in available_codecs():
+        transcoder = StegoTranscoder(rearrange_key=key, codec=codec)
+        for path in paths:
+            cover = covers.get(path)
+            prepared = transcoder.prepare_cover(cover, len(MESSAGE))
+            encoded = transcoder.finish_cover(prepared, MESSAGE)
+            assert transcoder.decode(encoded) == MESSAGE
+
+            encode = measure(lambda: transcoder.finish_cover(prepared, MESSAGE), repeat)
+            decode = measure(lambda: transcoder.decode(encoded), repeat)
+            rows.append({
+                "codec": codec,
+                "cover": os.path.basename(path),
+                "encode_s": encode["min_s"],
+                "decode_s": decode["min_s"],
+                "bytes": len(encoded),
+                "vs_raw": len(encoded) / cover.nbytes,
+            })
+
+    return rows
+
+def main():
+    args = parse_args("Encode time, decode time and encoded size per output codec")
+    report("codec", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
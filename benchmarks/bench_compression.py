@@ -0,0 +1,83 @@
+import json
+import random
+import socket
+import tempfile
+import threading
+from common import measure, parse_args, report
+from bench_density import make_repo
+
+from stegsocket import StegoSocket
+from compression import available_compression
+
+# Relay rounds of this many chat lines, wrapped the way the relay broadcasts them
+LINE_COUNTS = [1, 8, 64, 512, 2048]
+USERS = ["alice", "bob", "carol", "dave", "erin"]
+WORDS = ("the and you that this for are with have what not but was just ok sure thanks "
+         "tomorrow meeting link send check later think good sounds maybe know sorry back").split()
+
+def relay_message(lines: int, rng: random.Random) -> bytes:
+    messages = [rng.choice(USERS) + "> " + " ".join(rng.choices(WORDS, k=rng.randint(2, 12))) for _ in range(lines)]
+    return json.dumps({"messages": messages}).encode("utf-8")
+
+def run(repeat: int) -> list[dict]:
+    with tempfile.TemporaryDirectory() as repo:
+        # Covers of several sizes, so smaller payloads can move to smaller covers
+        make_repo(repo)
+        return _run(repo, repeat)
+
+# Connects an encrypted client/server pair offering only method (None for no compression), so
+# framing, compression and cipher are whatever the handshake settles on
+def connect(repo: str, method: str | None) -> tuple:
+    compression = [method] if method is not None else []
+    server_end, client_end = socket.socketpair()
+    box = {}
+    accept = threading.Thread(target=lambda: box.setdefault("server", StegoSocket(repo, server_end, True, True, compression=compression)))
+    accept.start()
+    client = StegoSocket(repo, client_end, encryption=True, compression=compression)
+    accept.join()
+    return client, box["server"]
+
+def _run(repo: str, repeat: int) -> list[dict]:
+    rng = random.Random(0)
+    messages = [relay_message(lines, rng) for lines in LINE_COUNTS]
+
+    rows = []
+    for method in [None] + available_compression():
+        client, server = connect(repo, method)
+        for lines, message in zip(LINE_COUNTS, messages):
+            row = {
+                "method": method or "none",
+                "lines": lines,
+                "msg_bytes": len(message),
+                "payload_bytes": None,
+                "wire_bytes": None,
+                "compress_s": None,
+                "e2e_s": None,
+            }
+
+            # Without compression the larger rounds cannot even be framed
+            try:
+                framed = client._frame(message)
+            except ValueError:
+                rows.append(row)
+                continue
+            row["payload_bytes"] = len(client._encrypt(client._compress(framed)))
+            row["compress_s"] = measure(lambda: client._compress(framed), repeat)["min_s"]
+
+            # Or fit no cover at all
+            encoded = client._seal(framed)
+            if encoded is not None:
+                assert list(server._unframe(server._open(encoded))) == [message]
+                row["wire_bytes"] = len(encoded)
+                row["e2e_s"] = measure(lambda: list(server._unframe(server._open(client._seal(framed)))), repeat)["min_s"]
+            rows.append(row)
+        client.close()
+        server.close()
+    return rows
+
+def main():
+    args = parse_args("Payload and wire bytes and seal-to-open latency per compression method")
+    report("compression", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
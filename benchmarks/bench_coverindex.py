@@ -0,0 +1,57 @@
+import os
+import random
+import tempfile
+import numpy as np
+from PIL import Image
+from common import measure, parse_args, report
+
+from stego import StegoTranscoder
+from coverindex import CoverIndex
+
+REPO_SIZES = [10, 100, 1000]
+LOOKUPS = 10000
+MESSAGE = os.urandom(64)
+
+# Writes n random-noise PNG covers with side lengths between 16 and 512 pixels
+def make_repo(path: str, n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    for i in range(n):
+        side = int(rng.integers(16, 513))
+        Image.fromarray(rng.integers(0, 256, (side, side, 3), dtype=np.uint8)).save(os.path.join(path, f"{i}.png"))
+
+def run(repeat: int) -> list[dict]:
+    transcoder = StegoTranscoder()
+    rows = []
+
+    for n in REPO_SIZES:
+        with tempfile.TemporaryDirectory() as repo:
+            make_repo(repo, n)
+            build = measure(lambda: CoverIndex(repo), repeat)
+            index = CoverIndex(repo)
+            rescan = measure(index.refresh, repeat)
+
+            sizes = [random.randrange(1, 2**15) for _ in range(LOOKUPS)]
+            lookup = measure(lambda: [index.smallest_fitting(size, 2) for size in sizes], repeat)
+
+            # Bytes on the wire for a short message: smallest fit vs. the old round robin
+            fitted = len(transcoder.encode_buffer(MESSAGE, index.smallest_fitting(len(MESSAGE), 2)))
+            sample = sorted(os.listdir(repo))[:min(n, 20)]
+            round_robin = np.mean([len(transcoder.encode_buffer(MESSAGE, os.path.join(repo, f))) for f in sample])
+
+            rows.append({
+                "covers": n,
+                "build_s": build["min_s"],
+                "rescan_s": rescan["min_s"],
+                "lookup_us": lookup["min_s"] / LOOKUPS * 1e6,
+                "fitted_bytes": fitted,
+                "round_robin_bytes": round_robin,
+            })
+
+    return rows
+
+def main():
+    args = parse_args("Cover index lookup cost and encoded size vs. round robin")
+    report("coverindex", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
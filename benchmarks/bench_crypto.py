@@ -0,0 +1,64 @@
+import os
+import socket
+from common import IMAGE_DIR, measure, parse_args, report
+
+from stegsocket import StegoSession
+from aead import AeadChannel, CIPHERS, CIPHER_CBC
+
+PAYLOAD_SIZES = [64, 1024, 16384, 65000]
+ITERATIONS = 200
+
+# Sending and receiving sessions sharing a key, as after a handshake agreeing on cipher
+def session_pair(cipher: str) -> tuple:
+    key = os.urandom(32)
+    sender, receiver = StegoSession(IMAGE_DIR, encryption=True), StegoSession(IMAGE_DIR, encryption=True)
+    for session, server in ((sender, False), (receiver, True)):
+        session._derived_key = key
+        session._aead = AeadChannel(cipher, key, server) if cipher != CIPHER_CBC else None
+    return sender, receiver
+
+# Decrypts every payload, counting the ones rejected
+def open_all(receiver: StegoSession, sealed: list[bytes]) -> int:
+    rejected = 0
+    for payload in sealed:
+        try:
+            receiver._decrypt(payload)
+        except (socket.error, ValueError):
+            rejected += 1
+    return rejected
+
+def run(repeat: int) -> list[dict]:
+    rows = []
+    # CBC first, so rows line up with results from before AEAD was added
+    for cipher in [CIPHER_CBC] + [cipher for cipher in CIPHERS if cipher != CIPHER_CBC]:
+        for size in PAYLOAD_SIZES:
+            payload = os.urandom(size)
+            sender, receiver = session_pair(cipher)
+            sealed = [sender._encrypt(payload) for _ in range(ITERATIONS)]
+            assert receiver._decrypt(sealed[0]) == payload
+
+            # AEAD receivers refuse counters they have seen, so each timed run gets a fresh one
+            def open_fresh(payloads: list[bytes]) -> int:
+                receiver._aead = AeadChannel(cipher, receiver._derived_key, True) if cipher != CIPHER_CBC else None
+                return open_all(receiver, payloads)
+
+            # Flipping the last byte breaks the tag. CBC only notices if the padding breaks
+            tampered = [payload[:-1] + bytes([payload[-1] ^ 1]) for payload in sealed]
+            encrypt = measure(lambda: [sender._encrypt(payload) for _ in range(ITERATIONS)], repeat)
+            rows.append({
+                "cipher": cipher,
+                "payload_bytes": size,
+                "overhead_bytes": len(sealed[0]) - size,
+                "encrypt_s": encrypt["min_s"] / ITERATIONS,
+                "decrypt_s": measure(lambda: open_fresh(sealed), repeat)["min_s"] / ITERATIONS,
+                "reject_s": measure(lambda: open_fresh(tampered), repeat)["min_s"] / ITERATIONS,
+                "rejected": open_fresh(tampered) / ITERATIONS,
+            })
+    return rows
+
+def main():
+    args = parse_args("Payload encryption framing cost per message and cipher")
+    report("crypto", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+from PIL import Image
+from common import IMAGE_DIR, measure, parse_args, report
+
+from stego import StegoTranscoder, DENSITIES
+from stegsocket import StegoSession
+
+# Covers are the repository image scaled to these fractions, so that a denser encoding can
+# drop to a smaller cover
+COVER_SCALES = [0.1, 0.2, 0.4, 0.7, 1.0]
+PAYLOAD_SIZES = [256, 4096, 16384, 49152]
+
+def make_repo(path: str):
+    source = Image.open(os.path.join(IMAGE_DIR, sorted(os.listdir(IMAGE_DIR))[0]))
+    for scale in COVER_SCALES:
+        cover = source.resize((int(source.width * scale), int(source.height * scale)))
+        cover.save(os.path.join(path, f"{scale}.png"))
+    source.close()
+
+def run(repeat: int) -> list[dict]:
+    key = os.urandom(32)
+    rows = []
+    with tempfile.TemporaryDirectory() as repo:
+        make_repo(repo)
+
+        # Fixed densities, as without negotiation, and the adaptive choice of density and cover
+        session = StegoSession(repo)
+        session._densities = DENSITIES
+        session._transcoder = StegoTranscoder(rearrange_key=key, signal_density=True)
+        cases = [(f"fixed_{density}", density) for density in DENSITIES] + [("adaptive", None)]
+
+        for size in PAYLOAD_SIZES:
+            payload = os.urandom(size)
+            for name, density in cases:
+                if density is None:
+                    transcoder, cover = session._choose_cover(size)
+                else:
+                    transcoder = StegoTranscoder(density, key)
+                    path = session._cover_index.smallest_fitting(size, density)
+                    cover = session._covers.get(path) if path is not None else None
+                if cover is None:
+                    continue
+
+                encoded = transcoder.encode_buffer(payload, cover)
+                assert session._transcoder.decode(encoded) == payload if density is None else True
+                encode = measure(lambda: transcoder.encode_buffer(payload, cover), repeat)
+                decode = measure(lambda: transcoder.decode(encoded), repeat)
+                rows.append({
+                    "policy": name,
+                    "msg_bytes": size,
+                    "density": transcoder._chan_density,
+                    "cover": f"{cover.shape[1]}x{cover.shape[0]}",
+                    "wire_bytes": len(encoded),
+                    "encode_s": encode["min_s"],
+                    "decode_s": decode["min_s"],
+                })
+    return rows
+
+def main():
+    args = parse_args("Bytes on the wire and encode time per channel density")
+    report("density", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import socket
+import threading
+from common import IMAGE_DIR, measure, parse_args, report
+
+from stegsocket import StegoSocket
+
+BURST = 50
+MESSAGE = b"alice> see you at the usual place at eight"
+CASES = [
+    ("unbatched", {"linger_s": 0}),
+    ("linger_5ms", {"linger_s": 0.005, "batch_bytes": 1024}),
+    ("linger_5ms_4k", {"linger_s": 0.005, "batch_bytes": 4096}),
+]
+
+# Connects an encrypted client/server pair over a socketpair
+def connect(client_options: dict) -> tuple:
+    server_end, client_end = socket.socketpair()
+    box = {}
+    accept = threading.Thread(target=lambda: box.setdefault("server", StegoSocket(IMAGE_DIR, server_end, True, True)))
+    accept.start()
+    client = StegoSocket(IMAGE_DIR, client_end, encryption=True, **client_options)
+    accept.join()
+    return client, box["server"]
+
+# Sends a burst of chat lines and waits until the server has received all of them
+def burst(client: StegoSocket, server: StegoSocket):
+    received = []
+    reader = threading.Thread(target=lambda: [received.append(server.recv()) for _ in range(BURST)])
+    reader.start()
+    for _ in range(BURST):
+        client.send(MESSAGE)
+    client.flush()
+    reader.join()
+    assert received == [MESSAGE] * BURST
+
+def run(repeat: int) -> list[dict]:
+    rows = []
+    for name, options in CASES:
+        client, server = connect(options)
+        result = measure(lambda: burst(client, server), repeat)
+        rows.append({"case": name, "messages": BURST, "burst_s": result["min_s"], "msgs_per_s": BURST / result["min_s"]})
+        client.close()
+        server.close()
+
+    return rows
+
+def main():
+    args = parse_args("Throughput of small-message bursts with and without send batching")
+    report("framing", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import socket
+import threading
+from common import IMAGE_DIR, parse_args, report
+
+from stegsocket import StegoSocket, LatencyRecorder, load_dh_parameters, FFDHE2048, KEX_DH, KEX_X25519, TicketCache
+
+HANDSHAKES = 20
+
+# Runs one encrypted handshake over a socketpair and returns the client's socket
+def handshake(server_options: dict, client_options: dict) -> StegoSocket:
+    server_end, client_end = socket.socketpair()
+    server = threading.Thread(target=StegoSocket, args=(IMAGE_DIR, server_end, True, True), kwargs=server_options)
+    server.start()
+    client = StegoSocket(IMAGE_DIR, client_end, encryption=True, **client_options)
+    server.join()
+    return client
+
+def run(repeat: int) -> list[dict]:
+    ffdhe = load_dh_parameters(FFDHE2048)
+    cases = [
+        ("x25519", {"key_exchanges": [KEX_X25519]}),
+        ("dh_ffdhe2048", {"key_exchanges": [KEX_DH], "dh_parameters": ffdhe}),
+    ]
+
+    rows = []
+    for name, options in cases:
+        recorder = LatencyRecorder()
+        for _ in range(HANDSHAKES * repeat):
+            client = handshake(options, options)
+            recorder.record(client._handshake_seconds)
+            client.close()
+        p = recorder.percentiles()
+        rows.append({"kex": name, "handshakes": recorder.count, "p50_s": p[50], "p90_s": p[90], "p99_s": p[99]})
+
+    # Full handshake followed by resumptions, each presenting the ticket from the previous connection
+    for name, options in cases:
+        recorder = LatencyRecorder()
+        server_options = dict(options, ticket_cache=TicketCache())
+        client = handshake(server_options, options)
+        session = client.session
+        client.close()
+        for _ in range(HANDSHAKES * repeat):
+            client = handshake(server_options, dict(options, session=session))
+            assert client.resumed
+            recorder.record(client._handshake_seconds)
+            session = client.session
+            client.close()
+        p = recorder.percentiles()
+        rows.append({"kex": name + "_resumed", "handshakes": recorder.count, "p50_s": p[50], "p90_s": p[90], "p99_s": p[99]})
+
+    return rows
+
+def main():
+    args = parse_args("Key exchange latency per method")
+    report("handshake", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
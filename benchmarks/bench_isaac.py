@@ -0,0 +1,33 @@
+from common import measure, parse_args, report
+
+from isaac import Isaac, KNOWN_ANSWER
+from legacy import LegacyIsaac
+
+WORDS = 1 << 18
+
+def run(repeat: int) -> list[dict]:
+
+    # Every variant must reproduce the reference output before being timed
+    for rng_class in [Isaac, LegacyIsaac]:
+        assert list(rng_class().rand_block(len(KNOWN_ANSWER))) == KNOWN_ANSWER, rng_class.__name__ + " failed known-answer test"
+
+    cases = [
+        ("legacy_rand", LegacyIsaac, lambda rng: [rng.rand() for _ in range(WORDS)]),
+        ("rand", Isaac, lambda rng: [rng.rand() for _ in range(WORDS)]),
+        ("rand_block", Isaac, lambda rng: rng.rand_block(WORDS)),
+    ]
+
+    rows = []
+    for name, rng_class, generate in cases:
+        rng = rng_class()
+        result = measure(lambda: generate(rng), repeat)
+        rows.append({"method": name, "words": WORDS, "time_s": result["min_s"], "words_per_s": WORDS / result["min_s"]})
+
+    return rows
+
+def main():
+    args = parse_args("Isaac CSPRNG word generation throughput")
+    report("isaac", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
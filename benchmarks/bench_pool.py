@@ -0,0 +1,45 @@
+import os
+from common import IMAGE_DIR, measure, parse_args, report
+
+from stego import StegoTranscoder
+from stegopool import StegoWorkerPool
+from covercache import get_cover_cache
+
+COVER = os.path.join(IMAGE_DIR, "image.png")
+PEERS = 8
+WORKER_COUNTS = [1, 2, 4]
+PAYLOAD = os.urandom(512)
+
+def run(repeat: int) -> list[dict]:
+    cover = get_cover_cache(IMAGE_DIR).get(COVER)
+    transcoders = [StegoTranscoder(rearrange_key=os.urandom(32)) for _ in range(PEERS)]
+    prepared = transcoders[0].prepare_cover(cover, len(PAYLOAD))
+    rows = []
+
+    inline = measure(lambda: [t.finish_cover(prepared, PAYLOAD) for t in transcoders], repeat)
+    rows.append({"workers": 0, "peers": PEERS, "time_s": inline["min_s"], "mean_utilization": 0.0})
+
+    for workers in WORKER_COUNTS:
+        pool = StegoWorkerPool(workers)
+        jobs = [(t, PAYLOAD) for t in transcoders]
+        # Warm up so process start-up is not timed
+        [f.result() for f in pool.finish_many(prepared, jobs)]
+
+        result = measure(lambda: [f.result() for f in pool.finish_many(prepared, jobs)], repeat)
+        stats = pool.utilization().values()
+        rows.append({
+            "workers": workers,
+            "peers": PEERS,
+            "time_s": result["min_s"],
+            "mean_utilization": sum(s["utilization"] for s in stats) / max(len(stats), 1),
+        })
+        pool.shutdown()
+
+    return rows
+
+def main():
+    args = parse_args("Stego encoding in the calling process vs. a worker pool")
+    report("worker_pool", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import os
+import socket
+import threading
+from common import IMAGE_DIR, measure, parse_args, report
+
+from stegsocket import StegoSocket, HEADER_SIZE, BYTE_ORDER
+
+FRAME_SIZES = [1 * 2**20, 4 * 2**20, 16 * 2**20]
+BUFFER_SIZES = [4096, 65536, 2**20]
+FRAMES = 8
+
+# Receive loop as it was before recv_into: a new bytes object per 4 KB read, then a copy
+def legacy_recv_sized(sock: socket.socket) -> bytes:
+    def recv_n_bytes(n: int) -> bytes:
+        byte_buf = bytearray()
+        while len(byte_buf) < n:
+            data = sock.recv(min(4096, n - len(byte_buf)))
+            if not data:
+                raise socket.error("connection closed by peer")
+            byte_buf.extend(data)
+        return bytes(byte_buf)
+    return recv_n_bytes(int.from_bytes(recv_n_bytes(HEADER_SIZE), BYTE_ORDER, signed=False))
+
+def send_frames(sock: socket.socket, frame: bytes, count: int):
+    for _ in range(count):
+        sock.sendall(len(frame).to_bytes(HEADER_SIZE, BYTE_ORDER, signed=False))
+        sock.sendall(frame)
+
+# Times receiving FRAMES frames of frame_size bytes with receive_one
+def receive_frames(frame_size: int, receive_one, sock_pair) -> None:
+    sender_end, receiver_end = sock_pair
+    sender = threading.Thread(target=send_frames, args=(sender_end, os.urandom(frame_size), FRAMES))
+    sender.start()
+    for _ in range(FRAMES):
+        receive_one()
+    sender.join()
+
+def run(repeat: int) -> list[dict]:
+    rows = []
+    for frame_size in FRAME_SIZES:
+        sender_end, receiver_end = socket.socketpair()
+        legacy = measure(lambda: receive_frames(frame_size, lambda: legacy_recv_sized(receiver_end), (sender_end, receiver_end)), repeat)
+        row = {"frame_MB": frame_size / 2**20, "legacy_MB_s": frame_size * FRAMES / legacy["min_s"] / 2**20}
+
+        for buffer_size in BUFFER_SIZES:
+            # Every StegoSocket leaves the socket non-blocking, so restore it for the next one
+            receiver_end.setblocking(True)
+            stego_sock = StegoSocket(IMAGE_DIR, receiver_end, recv_buffer_size=buffer_size)
+            result = measure(lambda: receive_frames(frame_size, stego_sock._recv_frame, (sender_end, receiver_end)), repeat)
+            row[f"recv_into_{buffer_size // 1024}k_MB_s"] = frame_size * FRAMES / result["min_s"] / 2**20
+
+        # Incremental parser, reading only what is available each time the socket is readable.
+        # Frames are released as a consumer would once decoded, so body buffers are reused
+        receiver_end.setblocking(True)
+        stego_sock = StegoSocket(IMAGE_DIR, receiver_end)
+        receive_one = lambda: stego_sock._parser.release(stego_sock._wait_frame())
+        result = measure(lambda: receive_frames(frame_size, receive_one, (sender_end, receiver_end)), repeat)
+        row["parser_MB_s"] = frame_size * FRAMES / result["min_s"] / 2**20
+        rows.append(row)
+
+        sender_end.close()
+        receiver_end.close()
+
+    return rows
+
+def main():
+    args = parse_args("Raw frame receive throughput over a socketpair")
+    report("recv", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import tempfile
+import threading
+import numpy as np
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from common import ROOT_DIR, parse_args, report
+
+sys.path.append(os.path.join(ROOT_DIR, "relay"))
+import constants
+from aiorelay import AsyncRelay
+from stegsocket import StegoSocket
+
+CLIENT_COUNTS = [2, 5, 10]
+COVER_SIDE = 256
+COVERS = 4
+CHANNEL = "bench"
+RECV_TIMEOUT_S = 120
+
+# Small covers keep a load test about relay scheduling rather than PNG compression
+def make_repo(path: str):
+    rng = np.random.default_rng(0)
+    for i in range(COVERS):
+        pixels = rng.integers(0, 256, (COVER_SIDE, COVER_SIDE, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(os.path.join(path, f"{i}.png"))
+
+# Runs an AsyncRelay on an ephemeral localhost port in a background thread
+def start_relay(image_repo: str) -> int:
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    relay = AsyncRelay(image_repo, ThreadPoolExecutor(os.cpu_count()))
+    threading.Thread(target=lambda: asyncio.run(relay.serve("127.0.0.1", port)), daemon=True).start()
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return port
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise RuntimeError("relay did not start")
+
+def join(image_repo: str, port: int) -> StegoSocket:
+    sock = socket.create_connection(("127.0.0.1", port))
+    stego_sock = StegoSocket(image_repo, sock, encryption=True)
+    stego_sock.send(json.dumps({constants.CHANNEL_PARAM: CHANNEL}).encode(constants.CHAR_ENCODING))
+    return stego_sock
+
+# Reads relayed rounds until every expected message has arrived, recording when it did
+def collect(stego_sock: StegoSocket, expected: set, arrivals: list):
+    deadline = time.monotonic() + RECV_TIMEOUT_S
+    while expected and time.monotonic() < deadline:
+        raw = stego_sock.recv()
+        if raw is None:
+            continue
+        for message in json.loads(raw.decode(constants.CHAR_ENCODING))[constants.MESSAGES_PARAM]:
+            if message in expected:
+                expected.discard(message)
+                arrivals.append(time.perf_counter())
+
+# Every client sends one message, and the round ends when every client has all of them
+def load_round(image_repo: str, port: int, clients: int) -> dict:
+    socks = [join(image_repo, port) for _ in range(clients)]
+    time.sleep(0.5)
+
+    messages = [f"client{i}> hello {os.urandom(4).hex()}" for i in range(clients)]
+    arrivals = [[] for _ in range(clients)]
+    readers = [threading.Thread(target=collect, args=(sock, set(messages), arrivals[i])) for i, sock in enumerate(socks)]
+    for reader in readers:
+        reader.start()
+
+    start = time.perf_counter()
+    for sock, message in zip(socks, messages):
+        sock.send(message.encode(constants.CHAR_ENCODING))
+    for reader in readers:
+        reader.join()
+
+    latencies = sorted(t - start for times in arrivals for t in times)
+    for sock in socks:
+        sock.close()
+    delivered = len(latencies)
+    return {
+        "clients": clients,
+        "delivered": delivered,
+        "expected": clients * clients,
+        "p50_s": latencies[delivered // 2] if latencies else None,
+        "max_s": latencies[-1] if latencies else None,
+        "deliveries_per_s": delivered / latencies[-1] if latencies else 0.0,
+    }
+
+def run(repeat: int) -> list[dict]:
+    rows = []
+    with tempfile.TemporaryDirectory() as image_repo:
+        make_repo(image_repo)
+        port = start_relay(image_repo)
+        for clients in CLIENT_COUNTS:
+            # Keep the fastest of repeat rounds
+            results = [load_round(image_repo, port, clients) for _ in range(repeat)]
+            rows.append(min(results, key=lambda row: row["max_s"] or float("inf")))
+    return rows
+
+def main():
+    args = parse_args("Multi-client load on a localhost asyncio relay")
+    report("relay", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import os
+import threading
+from common import measure, parse_args, report
+from bench_framing import connect
+
+MESSAGE_SIZES = [64, 4096, 32768]
+MESSAGES = 3
+
+# Sends MESSAGES messages and waits for the server to receive them
+def exchange(client, server, message: bytes):
+    received = []
+    reader = threading.Thread(target=lambda: [received.append(server.recv()) for _ in range(MESSAGES)])
+    reader.start()
+    for _ in range(MESSAGES):
+        client.send(message)
+    reader.join()
+    assert received == [message] * MESSAGES
+
+def run(repeat: int) -> list[dict]:
+    client, server = connect({})
+    rows = []
+    for size in MESSAGE_SIZES:
+        message = os.urandom(size)
+        result = measure(lambda: exchange(client, server, message), repeat)
+        rows.append({"msg_bytes": size, "per_message_s": result["min_s"] / MESSAGES})
+    client.close()
+    server.close()
+    return rows
+
+def main():
+    args = parse_args("Encrypted end-to-end send/recv over a socketpair")
+    report("socket", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+from common import IMAGE_DIR, measure, parse_args, report
+
+from stego import StegoTranscoder, ARRANGEMENT_PROBING
+from legacy import LoopStegoTranscoder
+
+COVER = os.path.join(IMAGE_DIR, "image.png")
+MESSAGE_SIZES = [64, 1024, 8192, 32768]
+# The loop transcoder's keyed arrangement is quadratic, so keep its keyed cases small
+KEYED_LOOP_LIMIT = 1024
+
+def run(repeat: int) -> list[dict]:
+    with tempfile.TemporaryDirectory() as out_dir:
+        return _run(out_dir, repeat)
+
+def _run(out_dir: str, repeat: int) -> list[dict]:
+    rows = []
+
+    for keyed in [False, True]:
+        key = os.urandom(32) if keyed else None
+        for size in MESSAGE_SIZES:
+            message = os.urandom(size)
+            # The loop transcoder only implements the probing arrangement
+            engines = [("numpy", StegoTranscoder(rearrange_key=key, arrangement_version=ARRANGEMENT_PROBING))]
+            if not keyed or size <= KEYED_LOOP_LIMIT:
+                engines.append(("loop", LoopStegoTranscoder(rearrange_key=key)))
+
+            for name, transcoder in engines:
+                out_path = os.path.join(out_dir, name + ".png")
+                enc = measure(lambda: transcoder.encode(message, COVER, out_path), repeat)
+                dec = measure(lambda: transcoder.decode(out_path), repeat)
+                rows.append({
+                    "engine": name,
+                    "keyed": keyed,
+                    "msg_bytes": size,
+                    "encode_s": enc["min_s"],
+                    "decode_s": dec["min_s"],
+                })
+
+            # Both engines must produce images the other can read
+            if len(engines) == 2:
+                for name, transcoder in engines:
+                    other = engines[1] if name == "numpy" else engines[0]
+                    out_path = os.path.join(out_dir, name + ".png")
+                    assert other[1].decode(out_path) == message, "engines disagree on " + name + " output"
+
+    return rows
+
+def main():
+    args = parse_args("NumPy stego engine vs. per-pixel loop implementation")
+    report("stego_engine", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
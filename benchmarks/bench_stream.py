@@ -0,0 +1,39 @@
+import os
+import threading
+from common import measure, parse_args, report
+from bench_framing import connect
+
+SIZES = [256 * 1024, 1024 * 1024]
+
+# Receives one stream and checks its length without keeping the data
+def consume(server, expected: int):
+    received = sum(len(chunk) for chunk in server.recv_stream())
+    assert received == expected
+
+def transfer(client, server, send, data: bytes):
+    reader = threading.Thread(target=consume, args=(server, len(data)))
+    reader.start()
+    send(data)
+    reader.join()
+
+def run(repeat: int) -> list[dict]:
+    client, server = connect({})
+    rows = []
+    for size in SIZES:
+        data = os.urandom(size)
+        result = measure(lambda: transfer(client, server, client.send_stream, data), repeat)
+        rows.append({
+            "bytes": size,
+            "stream_s": result["min_s"],
+            "MB_per_s": size / result["min_s"] / 2**20,
+        })
+    client.close()
+    server.close()
+    return rows
+
+def main():
+    args = parse_args("Streaming a payload across covers")
+    report("stream", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import numpy as np
+from common import measure, parse_args, report
+
+from stego import StegoTranscoder
+
+COVER_SIDES = [256, 512, 1024, 2048]
+DENSITIES = [1, 2, 3, 4]
+# Fraction of each cover's capacity filled by the message
+FILL = 0.5
+
+def run(repeat: int) -> list[dict]:
+    rng = np.random.default_rng(0)
+    key = rng.bytes(32)
+    rows = []
+
+    for side in COVER_SIDES:
+        cover = rng.integers(0, 256, (side, side, 3), dtype=np.uint8)
+        for density in DENSITIES:
+            transcoder = StegoTranscoder(chan_density=density, rearrange_key=key)
+            message = rng.bytes(int(transcoder.capacity(side, side, 3) * FILL))
+            encoded = transcoder.encode_buffer(message, cover)
+            assert transcoder.decode(encoded) == message
+
+            encode = measure(lambda: transcoder.encode_buffer(message, cover), repeat)
+            decode = measure(lambda: transcoder.decode(encoded), repeat)
+            rows.append({
+                "cover_px": side * side,
+                "density": density,
+                "msg_bytes": len(message),
+                "encode_s": encode["min_s"],
+                "decode_s": decode["min_s"],
+            })
+    return rows
+
+def main():
+    args = parse_args("Keyed encode/decode across cover sizes and channel densities")
+    report("transcoder", run(args.repeat), args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+IMAGE_DIR = os.path.join(ROOT_DIR, "images")
+
+sys.path.append(os.path.join(ROOT_DIR, "network"))
+sys.path.append(ROOT_DIR)
+
+# Runs fn repeat times and returns timing statistics in seconds
+def measure(fn, repeat: int = 5) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {"min_s": min(samples), "mean_s": sum(samples) / len(samples), "repeat": repeat}
+
+def parse_args(description: str) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case")
+    parser.add_argument("--json", help="write results to this file as JSON")
+    return parser.parse_args()
+
+# Prints result rows as a table and optionally dumps them as JSON
+def report(name: str, rows: list[dict], json_path: str | None = None):
+    print("== " + name + " ==")
+    if rows:
+        columns = list(rows[0].keys())
+        print("  ".join(f"{c:>14}" for c in columns))
+        for row in rows:
+            print("  ".join(f"{_fmt(row.get(c)):>14}" for c in columns))
+
+    if json_path is not None:
+        with open(json_path, "w") as f:
+            json.dump({"benchmark": name, "results": rows}, f, indent=2)
+
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value)
@@ -0,0 +1,281 @@
+from isaac import Isaac
+from PIL import Image
+import numpy as np
+import math
+
+# Pixel-at-a-time transcoder kept as a reference for benchmarks and interoperability checks
+class LoopStegoTranscoder:
+    def __init__(self, chan_density: int = 2, rearrange_key: bytes = None):
+        self._header_size = 16
+        self._chan_density = chan_density
+        self._key = rearrange_key
+
+    # Message should be a 'bytes' object
+    def encode(self, message: bytes, in_img_path: str, out_img_path: str) -> bool:
+        # Load image, calculate image size
+        img = Image.open(in_img_path)
+        pixels = img.load()
+        width, height = img.size
+        channel_n = len(pixels[0,0])
+
+        # Check if image sufficient size for message
+        encodable_bits = width * height * channel_n * self._chan_density 
+        msg_bits = self._bytes_to_bitstring(message)
+        header_bits = self._int_to_bitstring(int(len(msg_bits) / 8), self._header_size)
+
+        if len(msg_bits) + len(header_bits) > encodable_bits:
+            return False
+        
+        # Encode header in image
+        i = 0
+        cur_bit_n = 0
+        finished_encoding = False
+        while i < height and not finished_encoding:
+            j = 0
+            while j < width and not finished_encoding:
+                channels = list(pixels[i, j])
+                k = 0
+                while k < channel_n:
+                    l = 0
+                    channels[k] &= (0b11111111 << self._chan_density)
+                    while l < self._chan_density and cur_bit_n < self._header_size:
+                        channels[k] += (header_bits[cur_bit_n] << l)
+                        cur_bit_n += 1
+                        l += 1
+                    k += 1
+                pixels[i, j] = tuple(channels)
+
+                finished_encoding = (cur_bit_n >= self._header_size)
+                j += 1
+            i += 1
+
+        # Encode message in image
+        pixel_order = self._generate_pixel_arrangement(height, width, channel_n, len(msg_bits))
+        cur_bit_n = 0
+        pixel_n = 0
+        finished_encoding = False
+        while pixel_n < len(pixel_order) and not finished_encoding:
+            i, j = pixel_order[pixel_n][0], pixel_order[pixel_n][1]
+            channels = list(pixels[i, j])
+            k = 0
+            while k < channel_n: 
+                l = 0
+                channels[k] &= (0b11111111 << self._chan_density)
+                while l < self._chan_density and cur_bit_n < len(msg_bits):
+                    channels[k] += (msg_bits[cur_bit_n] << l) 
+                    cur_bit_n += 1
+                    l += 1
+                k += 1
+            pixels[i, j] = tuple(channels)
+
+            finished_encoding = (cur_bit_n >= len(msg_bits))
+            pixel_n += 1
+        
+        # Save image
+        img.save(out_img_path)
+        img.close()
+        return True
+    
+    def decode(self, in_img_path: str) -> bytes:
+        # Open image file
+        img = Image.open(in_img_path)
+        pixels = img.load()
+        width, height = img.size
+        channel_n = len(pixels[0,0])
+
+        # Extract message from image
+        msg_bytes = []
+        read_bits = 0
+        size_header = 0
+        i = 0
+
+        # Extract message header
+        i = 0
+        while i < height and read_bits < self._header_size:
+            j = 0
+            while j < width and read_bits < self._header_size:
+                channels = pixels[i, j] 
+                k = 0
+                while k < channel_n and read_bits < self._header_size:
+                    l = 0
+                    while l < self._chan_density and read_bits < self._header_size:
+                        bit = (channels[k] >> l) & 1
+                        size_header += (bit << read_bits)
+                        read_bits += 1
+                        l += 1
+                    k += 1
+                j += 1
+            i += 1
+
+
+        # Extract message
+        pixel_order = self._generate_pixel_arrangement(height, width, channel_n, size_header * 8)
+        read_bits = 0
+        cur_byte = 0
+        cur_byte_idx = 0
+        pixel_n = 0
+        finished_decoding = False
+        while pixel_n < len(pixel_order) and not finished_decoding:
+            i, j = pixel_order[pixel_n][0], pixel_order[pixel_n][1]
+            channels = pixels[i, j]
+            k = 0
+            while k < channel_n: 
+                l = 0
+                while l < self._chan_density and read_bits < size_header * 8:
+                    bit = (channels[k] >> l) & 1
+                    cur_byte += (bit << cur_byte_idx)
+                    cur_byte_idx += 1
+
+                    if cur_byte_idx >= 8:
+                        msg_bytes.append(cur_byte)
+                        cur_byte_idx = 0
+                        cur_byte = 0
+                    read_bits += 1
+                    l += 1
+                k += 1
+            finished_decoding = (read_bits >= size_header * 8)
+            pixel_n += 1
+        img.close()
+        
+        # Convert byte list into bytes object 
+        return bytes(msg_bytes)
+
+    def _bytes_to_bitstring(self, msg: bytes) -> list[int]:
+        bitstring = []
+        for byte in msg:
+            bitstring += self._int_to_bitstring(int(byte), 8)
+        return bitstring
+
+    def _int_to_bitstring(self, num: int, bitstring_len: int) -> list[int]:
+        if num.bit_length() > bitstring_len: 
+            return None
+        
+        bit_s = bin(num).split('b')[1][::-1]
+        bits = [0 for i in range(bitstring_len)]
+        for i in range(len(bit_s)):
+            if bit_s[i] == '1':
+                bits[i] = 1
+        return bits
+    
+    # Generates pixel indices for encoding/decoding. Uses self.key for pixel rearrangement if provided
+    def _generate_pixel_arrangement(self, width: int, height: int, channels: int, m_len: int) -> list[tuple]:
+        header_pixels = int(math.ceil(self._header_size / (self._chan_density * channels)))
+        starting_row = header_pixels // width
+        starting_col = header_pixels % width
+
+        total_pixels = int(math.ceil((m_len * 8) / (self._chan_density * channels))) 
+        arrangement = []
+        if self._key is not None:
+            start_num = (starting_row * width) + starting_col
+            end_num = width * height
+
+            rng = self._generate_csprng(m_len)
+            distincts = self._generate_n_distinct(start_num, end_num, total_pixels, rng)
+
+            for num in distincts:
+                row = num // width
+                col = num % width
+                arrangement.append((row, col))
+        else:
+            i, j = starting_row, starting_col
+            while i < height and len(arrangement) < total_pixels:
+                while j < width and len(arrangement) < total_pixels:
+                    arrangement.append((i, j))
+                    j += 1
+                i += 1
+                j = 0
+        return arrangement
+    
+    # Derives 256 32-bit integers as seed vector for Isaac CSPRNG from the input key and message length
+    def _generate_csprng(self, m_len: int) -> Isaac:
+        seed_vec = []
+        k_idx = 0
+        while len(seed_vec) < 256:
+            seed_vec.append(((self._key[k_idx] + len(seed_vec))**m_len) % 2**32)
+            k_idx = (k_idx + 1) % len(self._key)
+        
+        rng = Isaac(seed_vec)
+        return rng
+
+    # Generates n numbers between start and end, none of which are the same
+    def _generate_n_distinct(self, start: int, end: int, num: int, rng: Isaac) -> list[int]:
+        numbers = []
+        while len(numbers) < num:
+            value = int((rng.rand(end)/end) * (end - start) + start) 
+            while value in numbers:
+                value = (value + 1) % end
+                if value < start: 
+                    value = start
+            numbers.append(value)
+        return numbers
+
+
+
+# Isaac with the original per-word modulo round function, for PRNG throughput comparisons
+class LegacyIsaac(Isaac):
+    def __isaac__(self):
+        mod = 2 ** 32
+        self.cc += 1
+        self.bb += self.cc
+        self.bb &= 0xFFFFFFFF
+
+        for i in range(256):
+            x = self.mm[i]
+            switch = i % 4
+            xorwith = None
+            if switch == 0:
+                xorwith = (self.aa << 13) % mod
+            elif switch == 1:
+                xorwith = self.aa >> 6
+            elif switch == 2:
+                xorwith = (self.aa << 2) % mod
+            elif switch == 3:
+                xorwith = self.aa >> 16
+            else:
+                raise Exception("math is broken")
+            self.aa = self.aa ^ xorwith
+            self.aa = (self.mm[(i + 128) % 256] + self.aa) % mod
+            y = self.mm[i] = (self.mm[(x >> 2) % 256] + self.aa + self.bb) % mod
+            self.randrsl[i] = self.bb = (self.mm[(y >> 10) % 256] + x) % mod
+
+# Assembles little-endian bits into bytes one bit at a time, as LoopStegoTranscoder.decode does
+def bits_to_bytes(bits: list[int]) -> bytes:
+    msg_bytes = []
+    cur_byte = 0
+    cur_byte_idx = 0
+    for bit in bits:
+        cur_byte += (bit << cur_byte_idx)
+        cur_byte_idx += 1
+        if cur_byte_idx >= 8:
+            msg_bytes.append(cur_byte)
+            cur_byte_idx = 0
+            cur_byte = 0
+    return bytes(msg_bytes)
+
+# Symbol conversion as it was before BitStream: one byte per bit via unpackbits, then summed
+# into symbols
+def unpackbits_to_symbols(data: bytes, chan_density: int, channel_n: int):
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder='little')
+    bits_per_pixel = chan_density * channel_n
+    bits = np.pad(bits, (0, -len(bits) % bits_per_pixel))
+
+    weights = (1 << np.arange(chan_density)).astype(np.uint8)
+    symbols = (bits.reshape(-1, chan_density) * weights).sum(axis=1, dtype=np.uint8)
+    return symbols.reshape(-1, channel_n)
+
+def unpackbits_from_symbols(symbols, chan_density: int, n_bits: int) -> bytes:
+    shifts = np.arange(chan_density, dtype=np.uint8)
+    bits = (symbols.reshape(-1, 1) >> shifts) & 1
+    return np.packbits(bits.reshape(-1)[:n_bits], bitorder='little').tobytes()
+
+# Keyed Fisher-Yates arrangement as it was before chunked generation: a Python list of ints,
+# turned into an int64 array afterwards
+def shuffled_arrangement_list(start: int, end: int, num: int, rng: Isaac) -> np.ndarray:
+    span = end - start
+    draws = rng.rand_block(num) % (span - np.arange(num, dtype=np.int64))
+    swapped = {}
+    numbers = []
+    for i, j in enumerate((draws + np.arange(num)).tolist()):
+        numbers.append(start + swapped.get(j, j))
+        swapped[j] = swapped.get(i, i)
+    return np.array(numbers, dtype=np.int64)
@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import importlib
+import subprocess
+from common import ROOT_DIR, report
+
+# Suites in run order: module bench_<name>.py, each exposing run(repeat) -> rows
+SUITES = [
+    "isaac", "arrangement", "bitstream", "density", "transcoder", "stego", "codec", "compression", "crypto", "handshake", "socket", "recv",
+    "framing", "stream", "coverindex", "broadcast", "pool", "relay",
+]
+# Columns ending in this are durations, where a larger value is a regression
+TIME_SUFFIX = "_s"
+THROUGHPUT_MARKERS = ("per_s", "MB_s")
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the benchmark suites and record machine-readable results")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case")
+    parser.add_argument("--only", help="comma separated suites to run (default: all)")
+    parser.add_argument("--skip", help="comma separated suites to leave out")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="results file from an earlier run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown fraction reported as a regression")
+    return parser.parse_args()
+
+# Where and on what the results were produced, so runs can be told apart later
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+
+    versions = {}
+    for package in ["numpy", "PIL", "cryptography"]:
+        try:
+            versions[package] = importlib.import_module(package).__version__
+        except ImportError:
+            versions[package] = None
+
+    return {
+        "commit": commit or None,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": versions,
+    }
+
+def is_duration(column: str) -> bool:
+    return column.endswith(TIME_SUFFIX) and not any(marker in column for marker in THROUGHPUT_MARKERS)
+
+# Compares duration columns row by row against a previous run of the same suites. Returns
+# one entry per case that got slower by more than threshold
+def regressions(results: dict, baseline: dict, threshold: float) -> list[dict]:
+    found = []
+    for suite, current in results["suites"].items():
+        previous = baseline.get("suites", {}).get(suite)
+        if previous is None:
+            continue
+        for index, (row, old_row) in enumerate(zip(current["rows"], previous["rows"])):
+            for column, value in row.items():
+                old_value = old_row.get(column)
+                if not is_duration(column) or not isinstance(value, float) or not isinstance(old_value, float) or old_value <= 0:
+                    continue
+                if value > old_value * (1 + threshold):
+                    found.append({"suite": suite, "row": index, "column": column,
+                                  "before": old_value, "after": value, "ratio": value / old_value})
+    return found
+
+def main():
+    args = parse_args()
+    selected = args.only.split(",") if args.only else SUITES
+    skipped = set(args.skip.split(",")) if args.skip else set()
+
+    results = {"environment": environment(), "repeat": args.repeat, "suites": {}}
+    for suite in selected:
+        if suite in skipped:
+            continue
+        module = importlib.import_module("bench_" + suite)
+        start = time.perf_counter()
+        rows = module.run(args.repeat)
+        results["suites"][suite] = {"elapsed_s": time.perf_counter() - start, "rows": rows}
+        report(suite, rows)
+        sys.stdout.flush()
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            found = regressions(results, json.load(f), args.threshold)
+        report("regressions", found)
+        if found:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ sys.path.append("..")
 import json
 import socket
 import constants
-from network.stegsocket import StegoSocket
+from stegsocket import StegoSocket
 from flask import Flask, request, jsonify
 
 app = Flask(__name__)
@@ -17,9 +17,14 @@ DEFAULT_RELAY_PORT = 56565
 active_connection = None
 image_repo = "../images"
 
+# Resumption tickets from the last connection to each relay, keyed by (host, port)
+relay_sessions = {}
+
 # Route to connect to server+channel
 @app.route("/connect")
 def connect():
+    global active_connection
+
     # Close current connection
     if active_connection is not None:
         active_connection.close()
@@ -41,7 +46,8 @@ def connect():
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.connect((host, port))
     sock.timeout(constants.SOCK_TIMEOUT)
-    active_connection = StegoSocket(image_repo, sock) 
+    active_connection = StegoSocket(image_repo, sock, encryption=True, session=relay_sessions.get((host, port)))
+    relay_sessions[(host, port)] = active_connection.session
 
     handshake_msg = json.dumps({constants.CHANNEL_PARAM: channel_name})
     try:
@@ -0,0 +1,96 @@
+import threading
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+
+# Payload ciphers in order of preference. The server's order decides, and peers that do not
+# list any use CIPHER_CBC, the original unauthenticated AES-CBC + PKCS7 framing
+CIPHER_AES_GCM = "aes-256-gcm"
+CIPHER_CHACHA20 = "chacha20-poly1305"
+CIPHER_CBC = "aes-256-cbc"
+CIPHERS = [CIPHER_AES_GCM, CIPHER_CHACHA20, CIPHER_CBC]
+AEAD_CIPHERS = {CIPHER_AES_GCM: AESGCM, CIPHER_CHACHA20: ChaCha20Poly1305}
+
+# Nonces are a direction prefix followed by the sender's message counter. Only the counter is
+# sent; the receiver knows the prefix from which side of the handshake it is on
+NONCE_SIZE = 12
+COUNTER_SIZE = 8
+TAG_SIZE = 16
+OVERHEAD = COUNTER_SIZE + TAG_SIZE
+DIRECTION_CLIENT = b'\x00\x00\x00\x00'
+DIRECTION_SERVER = b'\x00\x00\x00\x01'
+BYTE_ORDER = 'little'
+ASSOCIATED_DATA = b'payload'
+
+# Counters accepted behind the highest one seen, since payloads sealed in parallel (like
+# stream chunks) may be sent in a different order than their counters were taken
+REPLAY_WINDOW = 64
+
+# Sliding window of received counters, rejecting any counter seen before or too far behind
+class ReplayWindow:
+    def __init__(self, size: int = REPLAY_WINDOW):
+        self._size = size
+        self._highest = -1
+        self._seen = 0
+        self._lock = threading.Lock()
+
+    def check(self, counter: int) -> bool:
+        with self._lock:
+            return self._is_fresh(counter)
+
+    # Records counter as seen. Returns False if it was already recorded meanwhile
+    def accept(self, counter: int) -> bool:
+        with self._lock:
+            if not self._is_fresh(counter):
+                return False
+            if counter > self._highest:
+                shift = counter - self._highest
+                self._seen = (self._seen << shift | 1) & ((1 << self._size) - 1) if shift < self._size else 1
+                self._highest = counter
+            else:
+                self._seen |= 1 << (self._highest - counter)
+            return True
+
+    # Callers must hold self._lock
+    def _is_fresh(self, counter: int) -> bool:
+        if counter > self._highest:
+            return True
+        behind = self._highest - counter
+        return behind < self._size and not self._seen >> behind & 1
+
+# One side's authenticated encryption of payloads for a session. The cipher context is built
+# once; nonces come from a counter, so nothing is drawn from the OS per message. Payloads
+# that fail authentication or replay an earlier counter are rejected by open() before the
+# caller spends anything on decompressing or parsing them
+class AeadChannel:
+    def __init__(self, cipher: str, key: bytes, server: bool):
+        self._aead = AEAD_CIPHERS[cipher](key)
+        self._send_prefix, self._recv_prefix = (DIRECTION_SERVER, DIRECTION_CLIENT) if server else (DIRECTION_CLIENT, DIRECTION_SERVER)
+        self._send_counter = 0
+        self._send_lock = threading.Lock()
+        self._replay = ReplayWindow()
+
+    # Returns counter + ciphertext + tag
+    def seal(self, plaintext: bytes) -> bytes:
+        with self._send_lock:
+            counter = self._send_counter
+            self._send_counter += 1
+        counter_bytes = counter.to_bytes(COUNTER_SIZE, BYTE_ORDER)
+        return counter_bytes + self._aead.encrypt(self._send_prefix + counter_bytes, plaintext, ASSOCIATED_DATA)
+
+    # Raises ValueError for tampered, truncated or replayed payloads
+    def open(self, sealed: bytes) -> bytes:
+        if len(sealed) < OVERHEAD:
+            raise ValueError("payload too short")
+        counter_bytes = bytes(sealed[:COUNTER_SIZE])
+        counter = int.from_bytes(counter_bytes, BYTE_ORDER)
+
+        # Replays are refused without decrypting, but only authentic payloads move the window
+        if not self._replay.check(counter):
+            raise ValueError("replayed payload")
+        try:
+            plaintext = self._aead.decrypt(self._recv_prefix + counter_bytes, bytes(sealed[COUNTER_SIZE:]), ASSOCIATED_DATA)
+        except InvalidTag:
+            raise ValueError("payload failed authentication")
+        if not self._replay.accept(counter):
+            raise ValueError("replayed payload")
+        return plaintext
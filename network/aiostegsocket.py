@@ -0,0 +1,126 @@
+import time
+import asyncio
+from concurrent.futures import Executor
+from frameparser import FrameParser
+from stegsocket import StegoSession, RECV, HEADER_SIZE, BYTE_ORDER, BUFFER_SIZE, BYTES_SENT, BYTES_RECEIVED, SEND_SECONDS, RECV_SECONDS
+
+# Returned in place of StopIteration, which asyncio futures refuse to carry
+HANDSHAKE_DONE = object()
+
+def _advance(steps, value: bytes | None = None):
+    try:
+        return steps.send(value)
+    except StopIteration:
+        return HANDSHAKE_DONE
+
+# asyncio counterpart of StegoSocket. Network I/O runs on the event loop while the handshake
+# and all stego/crypto work run in an executor, so a slow peer or a large image never stalls
+# other connections. Like a socket timeout on StegoSocket, timeout bounds the handshake and
+# each wait for the peer to take what was sent, raising asyncio.TimeoutError. It has no
+# recv_stream, so it never offers streaming
+class AsyncStegoSocket(StegoSession):
+    def __init__(self, image_repo: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 encryption: bool = False, executor: Executor | None = None, timeout: float | None = None,
+                 **options):
+        super().__init__(image_repo, encryption, streaming=False, **options)
+        self._reader = reader
+        self._writer = writer
+        self._executor = executor
+        self._timeout = timeout
+        self._pending = iter(())
+        self._parser = FrameParser(HEADER_SIZE, BYTE_ORDER, self._max_frame_size, BUFFER_SIZE)
+
+    # Creates a socket and completes the key exchange if encryption is enabled
+    @classmethod
+    async def create(cls, image_repo: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                     encryption: bool = False, is_server: bool = False, executor: Executor | None = None,
+                     timeout: float | None = None, **options):
+        stego_sock = cls(image_repo, reader, writer, encryption, executor, timeout, **options)
+        if encryption:
+            await asyncio.wait_for(stego_sock._key_exchange(is_server), timeout)
+        return stego_sock
+
+    # Returns False if the message could not be encoded, like one too large to frame
+    async def send(self, message: bytes) -> bool:
+        start = time.perf_counter()
+        try:
+            payload = self._frame(message)
+        except ValueError:
+            return False
+        encoded_img = await self._run(self._seal, payload)
+        if encoded_img is None:
+            return False
+
+        await self.send_encoded(encoded_img)
+        SEND_SECONDS.observe(time.perf_counter() - start)
+        return True
+
+    # Sends an image already produced for this socket, e.g. by _seal_broadcast
+    async def send_encoded(self, encoded_img: bytes):
+        self._writer.write(len(encoded_img).to_bytes(HEADER_SIZE, BYTE_ORDER, signed=False))
+        self._writer.write(encoded_img)
+        await asyncio.wait_for(self._writer.drain(), self._timeout)
+        BYTES_SENT.inc(HEADER_SIZE + len(encoded_img))
+
+    # Encodes message for every socket in one executor job. Returns (socket, encoded image)
+    # pairs, with None as the image for sockets whose cover was too small
+    @staticmethod
+    async def seal_broadcast(stego_socks: list, message: bytes, executor: Executor | None = None) -> list[tuple]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, StegoSession._seal_broadcast, stego_socks, message)
+
+    # Waits for the next message. Raises ConnectionError if the peer disconnects
+    async def recv(self) -> bytes:
+        while True:
+            message = next(self._pending, None)
+            if message is not None:
+                return message
+            frame = await self._recv_frame()
+            start = time.perf_counter()
+            # Decoding copies the image out of the frame, so its buffer goes back to the parser after
+            try:
+                self._pending = self._unframe(await self._run(self._open, frame))
+            finally:
+                self._parser.release(frame)
+            RECV_SECONDS.observe(time.perf_counter() - start)
+
+    # Drops the connection without flushing what the peer has not taken yet
+    def abort(self):
+        self._writer.transport.abort()
+
+    async def close(self):
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    # Drives the shared handshake, resuming it in the executor since it does the DH math
+    async def _key_exchange(self, server: bool):
+        steps = self._handshake(server)
+        request = await self._run(_advance, steps)
+        while request is not HANDSHAKE_DONE:
+            if request is RECV:
+                request = await self._run(_advance, steps, await self._recv_sized())
+            else:
+                await self.send_encoded(request)
+                request = await self._run(_advance, steps)
+
+    async def _recv_sized(self) -> bytes:
+        frame = await self._recv_frame()
+        payload = bytes(frame)
+        self._parser.release(frame)
+        return payload
+
+    # Feeds the parser whatever the stream has until a whole frame is in
+    async def _recv_frame(self) -> memoryview:
+        while not self._parser.frames:
+            data = await self._reader.read(BUFFER_SIZE)
+            if not data:
+                raise ConnectionError("connection closed by peer")
+            BYTES_RECEIVED.inc(len(data))
+            self._parser.feed(data)
+        return self._parser.frames.popleft()
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
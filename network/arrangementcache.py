@@ -0,0 +1,85 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from metrics import callback_metric
+
+DEFAULT_BUDGET_BYTES = 16 * 2**20
+
+# Process-wide store of keyed pixel arrangements, evicting least recently used ones once they
+# exceed the memory budget. Entries are keyed by everything the arrangement depends on (key,
+# algorithm, density, cover shape and payload length), so repeated payloads of one length to
+# one peer, like stream chunks, skip regenerating it. Cached arrays are read-only
+class ArrangementCache:
+    def __init__(self, budget_bytes: int = DEFAULT_BUDGET_BYTES):
+        self._budget = budget_bytes
+        self._entries = OrderedDict()
+        self._used_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._budget > 0
+
+    def get(self, key: tuple) -> np.ndarray | None:
+        with self._lock:
+            arrangement = self._entries.get(key)
+            if arrangement is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return arrangement
+
+    def put(self, key: tuple, arrangement: np.ndarray):
+        arrangement.flags.writeable = False
+        with self._lock:
+            if key in self._entries or arrangement.nbytes > self._budget:
+                return
+            self._entries[key] = arrangement
+            self._used_bytes += arrangement.nbytes
+            self._evict()
+
+    def set_budget(self, budget_bytes: int):
+        with self._lock:
+            self._budget = budget_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._used_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "used_bytes": self._used_bytes,
+                "budget_bytes": self._budget,
+            }
+
+    def _evict(self):
+        while self._used_bytes > self._budget and self._entries:
+            _, arrangement = self._entries.popitem(last=False)
+            self._used_bytes -= arrangement.nbytes
+            self.evictions += 1
+
+_cache = ArrangementCache()
+
+def get_arrangement_cache() -> ArrangementCache:
+    return _cache
+
+callback_metric("stego_arrangement_cache_hits_total", "Keyed pixel arrangements served from the cache", "counter",
+                lambda: {(): _cache.stats()["hits"]})
+callback_metric("stego_arrangement_cache_misses_total", "Keyed pixel arrangements generated on a cache miss", "counter",
+                lambda: {(): _cache.stats()["misses"]})
+callback_metric("stego_arrangement_cache_evictions_total", "Arrangements evicted to stay within the cache budget", "counter",
+                lambda: {(): _cache.stats()["evictions"]})
+callback_metric("stego_arrangement_cache_bytes", "Arrangement data held by the cache", "gauge",
+                lambda: {(): _cache.stats()["used_bytes"]})
@@ -0,0 +1,65 @@
+import numpy as np
+
+# Little-endian bit stream over a byte buffer, read chan_density bits (one symbol) at a time.
+# Densities dividing 8 split every byte into whole symbols with in-place shifts, so the only
+# array sized by the message is the symbols themselves. Other densities gather each symbol
+# from the two bytes it can straddle
+class BitStream:
+    def __init__(self, data: bytes):
+        self._data = np.frombuffer(data, dtype=np.uint8)
+        self.n_bits = len(self._data) * 8
+
+    # All symbols, zero padded to a multiple of pad_to
+    def symbols(self, density: int, pad_to: int = 1) -> np.ndarray:
+        return _split(self._data, density, pad_to)
+
+    # Yields the symbols chunk_symbols at a time (the last chunk zero padded to a multiple of
+    # pad_to) without ever holding all of them. chunk_symbols * density must fill whole bytes
+    def iter_symbols(self, density: int, chunk_symbols: int, pad_to: int = 1):
+        if chunk_symbols * density % 8 != 0:
+            raise ValueError("chunks must hold a whole number of bytes")
+        chunk_bytes = chunk_symbols * density // 8
+        for start in range(0, len(self._data), chunk_bytes):
+            yield _split(self._data[start:start + chunk_bytes], density, pad_to)
+
+    # Inverse of symbols(): the first n_bits bits carried by symbols, as bytes
+    @staticmethod
+    def pack(symbols: np.ndarray, density: int, n_bits: int) -> bytes:
+        n_bytes = -(-n_bits // 8)
+        symbols = symbols.reshape(-1)
+        if 8 % density == 0:
+            per_byte = 8 // density
+            grid = symbols[:n_bytes * per_byte].reshape(-1, per_byte)
+            out = grid[:, 0].copy()
+            for k in range(1, per_byte):
+                out |= grid[:, k] << np.uint8(k * density)
+            return out.tobytes()
+
+        n_symbols = -(-n_bits // density)
+        shifts = np.arange(density, dtype=np.uint8)
+        bits = (symbols[:n_symbols].reshape(-1, 1) >> shifts) & 1
+        return np.packbits(bits.reshape(-1)[:n_bytes * 8], bitorder='little').tobytes()
+
+def _split(data: np.ndarray, density: int, pad_to: int) -> np.ndarray:
+    n_symbols = -(-len(data) * 8 // density)
+    n_symbols += -n_symbols % pad_to
+    out = np.zeros(n_symbols, dtype=np.uint8)
+    mask = np.uint8((1 << density) - 1)
+
+    if 8 % density == 0:
+        per_byte = 8 // density
+        grid = out[:len(data) * per_byte].reshape(-1, per_byte)
+        for k in range(per_byte):
+            column = grid[:, k]
+            np.right_shift(data, np.uint8(k * density), out=column)
+            np.bitwise_and(column, mask, out=column)
+        return out
+
+    # Symbol i covers bits i*density onwards, within the 16-bit window at byte (i*density)//8
+    padded = np.zeros(len(data) + 2, dtype=np.uint16)
+    padded[:len(data)] = data
+    positions = np.arange(-(-len(data) * 8 // density), dtype=np.int64) * density
+    low = positions >> 3
+    window = padded[low] | (padded[low + 1] << np.uint16(8))
+    out[:len(positions)] = (window >> (positions & 7).astype(np.uint16)) & mask
+    return out
@@ -0,0 +1,101 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# First byte of every payload once compression is negotiated. Payloads that would not shrink,
+# like encrypted or already compressed data, are stored as they are behind FLAG_STORED
+FLAG_STORED = 0
+FLAG_COMPRESSED = 1
+
+# Preset dictionary both peers prime their compressor with, so that even a single short chat
+# message finds earlier matches for its JSON syntax and common words. Built from samples of
+# relay traffic, with the most frequent strings last where they are cheapest to reference.
+# Peers must use identical bytes, so any change needs new method names
+PRESET_DICTIONARY = "".join([
+    "https://www.github.com/ .png .jpg .pdf ",
+    "could you send me the link, let me know when you can check it later. ",
+    "sorry I was away, back now, brb gtg btw idk np ok okay sure lol haha :) ",
+    "what do you think about this? that sounds good to me, see you tomorrow. ",
+    "I'm not sure, I don't know, I think so, yes, no, maybe, thank you, thanks! ",
+    "good morning, good night, hello everyone, hi all, how are you doing today? ",
+    " the and you that this for are with have what not but was just ",
+    '{"channel": "general"}',
+    '", "alice> hi", "bob> hey", "carol> ',
+    '{"messages": ["',
+]).encode("utf-8")
+
+# Compression methods in order of preference. The server's order decides
+COMPRESSION_ZSTD = "zstd-dict1"
+COMPRESSION_ZLIB = "zlib-dict1"
+COMPRESSION_METHODS = [COMPRESSION_ZLIB, COMPRESSION_ZSTD]
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Raw deflate streams: the zlib header, dictionary id and checksum would add 10 bytes to every
+# message, and the payload is authenticated by its encryption rather than a checksum
+ZLIB_WBITS = -zlib.MAX_WBITS
+
+_zstd_dictionary = None
+
+# Methods usable in this process. zstd needs the optional zstandard package
+def available_compression() -> list[str]:
+    return [method for method in COMPRESSION_METHODS if method != COMPRESSION_ZSTD or zstandard is not None]
+
+def _get_zstd_dictionary():
+    global _zstd_dictionary
+    if _zstd_dictionary is None:
+        _zstd_dictionary = zstandard.ZstdCompressionDict(PRESET_DICTIONARY, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        _zstd_dictionary.precompute_compress(level=ZSTD_LEVEL)
+    return _zstd_dictionary
+
+# Compresses payloads with one negotiated method. Compressor state is created per payload,
+# so one instance may be used from several threads at once. Decompression stops at
+# max_size bytes, so a small payload cannot expand into an arbitrarily large one
+class PayloadCompressor:
+    def __init__(self, method: str, max_size: int):
+        if method not in available_compression():
+            raise ValueError(f"unsupported compression method {method}")
+        self.method = method
+        self._max_size = max_size
+
+    def compress(self, payload: bytes) -> bytes:
+        if self.method == COMPRESSION_ZSTD:
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=_get_zstd_dictionary(), write_dict_id=False)
+            compressed = compressor.compress(payload)
+        else:
+            compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, ZLIB_WBITS, zdict=PRESET_DICTIONARY)
+            compressed = compressor.compress(payload) + compressor.flush()
+
+        if len(compressed) < len(payload):
+            return bytes([FLAG_COMPRESSED]) + compressed
+        return bytes([FLAG_STORED]) + payload
+
+    # Raises ValueError for malformed payloads and ones expanding beyond max_size
+    def decompress(self, payload) -> bytes:
+        if len(payload) == 0:
+            raise ValueError("empty payload")
+        flag, data = payload[0], memoryview(payload)[1:]
+        if flag == FLAG_STORED:
+            return bytes(data)
+        if flag != FLAG_COMPRESSED:
+            raise ValueError(f"unknown compression flag {flag}")
+
+        try:
+            if self.method == COMPRESSION_ZSTD:
+                # max_output_size only applies to frames that do not declare their size
+                if zstandard.frame_content_size(data) > self._max_size:
+                    raise ValueError(f"payload larger than {self._max_size} bytes")
+                decompressor = zstandard.ZstdDecompressor(dict_data=_get_zstd_dictionary())
+                return decompressor.decompress(data, max_output_size=self._max_size)
+
+            decompressor = zlib.decompressobj(ZLIB_WBITS, zdict=PRESET_DICTIONARY)
+            plain = decompressor.decompress(data, self._max_size)
+        except (zlib.error, getattr(zstandard, "ZstdError", zlib.error)) as e:
+            raise ValueError("malformed compressed payload") from e
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise ValueError(f"payload truncated or larger than {self._max_size} bytes")
+        return plain
@@ -0,0 +1,113 @@
+import os
+import threading
+import numpy as np
+from PIL import Image
+from collections import OrderedDict
+from metrics import callback_metric
+
+DEFAULT_BUDGET_BYTES = 256 * 2**20
+
+# Process-wide store of decoded cover images, evicting least recently used covers once the
+# decoded pixel data exceeds the memory budget. Cached arrays are read-only; encoders copy
+# them before embedding so the master is never modified
+class CoverCache:
+    def __init__(self, budget_bytes: int = DEFAULT_BUDGET_BYTES):
+        self._budget = budget_bytes
+        self._entries = OrderedDict()
+        self._used_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Returns the decoded pixels of the cover at path, decoding it on a miss or when the
+    # file has been modified since it was cached
+    def get(self, path: str) -> np.ndarray:
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == mtime:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Decode outside the lock so other sockets can keep hitting the cache
+        img = Image.open(path)
+        pixels = np.array(img, dtype=np.uint8)
+        img.close()
+        pixels.flags.writeable = False
+
+        with self._lock:
+            self._remove(path)
+            if pixels.nbytes <= self._budget:
+                self._entries[path] = (mtime, pixels)
+                self._used_bytes += pixels.nbytes
+                self._evict()
+        return pixels
+
+    def set_budget(self, budget_bytes: int):
+        with self._lock:
+            self._budget = budget_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._used_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "used_bytes": self._used_bytes,
+                "budget_bytes": self._budget,
+            }
+
+    # Callers must hold self._lock
+    def _remove(self, path: str):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._used_bytes -= entry[1].nbytes
+
+    def _evict(self):
+        while self._used_bytes > self._budget and self._entries:
+            _, (_, pixels) = self._entries.popitem(last=False)
+            self._used_bytes -= pixels.nbytes
+            self.evictions += 1
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+# Returns the cache shared by every socket using image_repo, creating it if needed. Passing
+# budget_bytes resizes an existing cache
+def get_cover_cache(image_repo: str, budget_bytes: int | None = None) -> CoverCache:
+    repo_key = os.path.realpath(image_repo)
+    with _caches_lock:
+        cache = _caches.get(repo_key)
+        if cache is None:
+            cache = CoverCache(budget_bytes if budget_bytes is not None else DEFAULT_BUDGET_BYTES)
+            _caches[repo_key] = cache
+        elif budget_bytes is not None:
+            cache.set_budget(budget_bytes)
+    return cache
+
+# One statistic of every cover cache, by repository
+def _stat_by_repo(name: str) -> dict:
+    with _caches_lock:
+        caches = list(_caches.items())
+    return {(repo,): cache.stats()[name] for repo, cache in caches}
+
+callback_metric("stego_cover_cache_hits_total", "Cover lookups served from the decoded cover cache", "counter",
+                lambda: _stat_by_repo("hits"), ("repo",))
+callback_metric("stego_cover_cache_misses_total", "Cover lookups that decoded the cover file", "counter",
+                lambda: _stat_by_repo("misses"), ("repo",))
+callback_metric("stego_cover_cache_evictions_total", "Covers evicted to stay within the cache budget", "counter",
+                lambda: _stat_by_repo("evictions"), ("repo",))
+callback_metric("stego_cover_cache_bytes", "Decoded pixel data held by the cover cache", "gauge",
+                lambda: _stat_by_repo("used_bytes"), ("repo",))
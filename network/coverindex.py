@@ -0,0 +1,117 @@
+import os
+import time
+import bisect
+import threading
+from PIL import Image
+from stego import StegoTranscoder
+
+# Minimum seconds between directory rescans triggered by lookups
+REFRESH_INTERVAL_S = 5.0
+
+# Dimensions of every usable cover in an image repository, with per-density lists of covers
+# sorted by capacity so the smallest cover fitting a payload is found by binary search.
+# Only image headers are read; pixel data stays with the CoverCache
+class CoverIndex:
+    def __init__(self, image_repo: str):
+        self._image_repo = image_repo
+        self._covers = {}
+        self._by_density = {}
+        self._last_refresh = 0.0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    # Returns the path of the smallest cover holding payload_len bytes at chan_density, or
+    # None if no cover is large enough. signal_density accounts for the density marker
+    def smallest_fitting(self, payload_len: int, chan_density: int, signal_density: bool = False) -> str | None:
+        if time.monotonic() - self._last_refresh > REFRESH_INTERVAL_S:
+            self.refresh()
+
+        path = self._lookup(payload_len, chan_density, signal_density)
+        if path is None and self.refresh():
+            # A cover may have been added since the last scan
+            path = self._lookup(payload_len, chan_density, signal_density)
+        return path
+
+    # Capacity of the largest cover at chan_density, 0 if the repository has no usable covers
+    def largest_capacity(self, chan_density: int, signal_density: bool = False) -> int:
+        with self._lock:
+            capacities, _ = self._ranked(chan_density, signal_density)
+        return capacities[-1] if capacities else 0
+
+    # Channel values (width * height * channels) of an indexed cover, 0 if unknown
+    def cover_size(self, path: str) -> int:
+        with self._lock:
+            entry = self._covers.get(path)
+        if entry is None or entry[1] is None:
+            return 0
+        width, height, channels = entry[1]
+        return width * height * channels
+
+    # Rescans the repository, reading headers only of new or modified files. Returns True if
+    # anything changed
+    def refresh(self) -> bool:
+        seen = {}
+        for entry in os.scandir(self._image_repo):
+            if entry.is_file():
+                seen[entry.path] = entry.stat().st_mtime_ns
+
+        with self._lock:
+            known = dict(self._covers)
+        changed = {path: mtime for path, mtime in seen.items() if path not in known or known[path][0] != mtime}
+        removed = [path for path in known if path not in seen]
+
+        # Read headers outside the lock so lookups continue meanwhile
+        updates = {path: self._read_header(path, mtime) for path, mtime in changed.items()}
+
+        with self._lock:
+            self._last_refresh = time.monotonic()
+            if not updates and not removed:
+                return False
+            for path in removed:
+                self._covers.pop(path, None)
+            self._covers.update(updates)
+            self._by_density.clear()
+            return True
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(1 for entry in self._covers.values() if entry[1] is not None)
+
+    def _lookup(self, payload_len: int, chan_density: int, signal_density: bool) -> str | None:
+        with self._lock:
+            capacities, paths = self._ranked(chan_density, signal_density)
+        i = bisect.bisect_left(capacities, payload_len)
+        return paths[i] if i < len(paths) else None
+
+    # Sorted (capacities, paths) for one density, built on first use after each change.
+    # Callers must hold self._lock
+    def _ranked(self, chan_density: int, signal_density: bool) -> tuple:
+        ranked = self._by_density.get((chan_density, signal_density))
+        if ranked is None:
+            transcoder = StegoTranscoder(chan_density=chan_density, signal_density=signal_density)
+            covers = sorted((transcoder.capacity(*dims), path) for path, (_, dims) in self._covers.items() if dims is not None)
+            ranked = ([capacity for capacity, _ in covers], [path for _, path in covers])
+            self._by_density[(chan_density, signal_density)] = ranked
+        return ranked
+
+    # Returns (mtime, (width, height, channels)), with None dimensions for files PIL cannot read
+    def _read_header(self, path: str, mtime: int) -> tuple:
+        try:
+            with Image.open(path) as img:
+                return mtime, (img.width, img.height, len(img.getbands()))
+        except (OSError, ValueError):
+            return mtime, None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+# Returns the index shared by every socket using image_repo, building it if needed
+def get_cover_index(image_repo: str) -> CoverIndex:
+    repo_key = os.path.realpath(image_repo)
+    with _indexes_lock:
+        index = _indexes.get(repo_key)
+        if index is None:
+            index = CoverIndex(image_repo)
+            _indexes[repo_key] = index
+    return index
@@ -0,0 +1,101 @@
+import socket
+from collections import deque
+
+# Largest encoded image accepted from a peer. Bounds what one connection can make us allocate
+MAX_FRAME_SIZE = 64 * 2**20
+
+STATE_HEADER = 0
+STATE_BODY = 1
+
+# Released body buffers kept for reuse: one for the frame being decoded, one for the next
+POOLED_BUFFERS = 2
+
+# Resumable parser for size-prefixed wire frames (header, then that many bytes of encoded
+# image). Bytes are consumed however they are split, partial state is kept between calls and
+# whole frames are queued on .frames once complete, so nothing ever waits for the rest of a
+# frame. Driven either by reading whatever a socket has available (read_from) or by being
+# handed bytes by an event loop (feed). Frames are views of body buffers that are reused once
+# handed back with release(), so steady traffic of multi-MB images allocates nothing per frame
+class FrameParser:
+    def __init__(self, header_size: int, byte_order: str, max_frame_size: int = MAX_FRAME_SIZE,
+                 chunk_size: int = 65536):
+        self._header_size = header_size
+        self._byte_order = byte_order
+        self._max_frame_size = max_frame_size
+        self._chunk_size = chunk_size
+
+        self._state = STATE_HEADER
+        self._header = bytearray(header_size)
+        self._body = None
+        self._filled = 0
+        self._free = []
+        self.frames = deque()
+
+    # Whether a frame has been started but not completed
+    def partial(self) -> bool:
+        return self._state == STATE_BODY or self._filled > 0
+
+    # Reads what sock has available, up to the end of the next whole frame. Returns the number
+    # of bytes read. sock must be non-blocking (timeout 0): with a timeout, CPython waits for
+    # data despite MSG_DONTWAIT. Raises socket.error if the peer closed the connection and
+    # ValueError on a frame over the size limit
+    def read_from(self, sock: socket.socket) -> int:
+        received = 0
+        while not self.frames:
+            target = self._target()[:self._chunk_size]
+            try:
+                count = sock.recv_into(target, len(target), socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
+            if count == 0:
+                raise socket.error("connection closed by peer")
+            received += count
+            self._advance(count)
+        return received
+
+    # Consumes data, however much of a frame (or however many frames) it holds
+    def feed(self, data: bytes):
+        view = memoryview(data)
+        while len(view) > 0:
+            target = self._target()
+            count = min(len(target), len(view))
+            target[:count] = view[:count]
+            view = view[count:]
+            self._advance(count)
+
+    # Returns a frame's buffer for reuse. The frame must not be used afterwards
+    def release(self, frame: memoryview):
+        buffer = frame.obj
+        frame.release()
+        self._free.append(buffer)
+        if len(self._free) > POOLED_BUFFERS:
+            self._free.remove(min(self._free, key=len))
+
+    # Smallest released buffer holding size bytes, or a new one
+    def _take_buffer(self, size: int) -> bytearray:
+        fitting = [buffer for buffer in self._free if len(buffer) >= size]
+        if not fitting:
+            return bytearray(size)
+        buffer = min(fitting, key=len)
+        self._free.remove(buffer)
+        return buffer
+
+    # Where the next bytes go: the rest of the header or the rest of the body
+    def _target(self) -> memoryview:
+        if self._state == STATE_HEADER:
+            return memoryview(self._header)[self._filled:]
+        return memoryview(self._body)[self._filled:]
+
+    def _advance(self, count: int):
+        self._filled += count
+        if self._state == STATE_HEADER:
+            if self._filled < self._header_size:
+                return
+            size = int.from_bytes(self._header, self._byte_order, signed=False)
+            if size > self._max_frame_size:
+                raise ValueError(f"frame of {size} bytes exceeds the {self._max_frame_size} byte limit")
+            self._state, self._body, self._filled = STATE_BODY, memoryview(self._take_buffer(size))[:size], 0
+
+        if self._filled == len(self._body):
+            self.frames.append(self._body)
+            self._state, self._body, self._filled = STATE_HEADER, None, 0
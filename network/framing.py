@@ -0,0 +1,164 @@
+import threading
+from collections import namedtuple
+
+# Every message in a batch is prefixed with its length. The stego size header is 2 bytes,
+# so no single payload can reach 2**16 bytes, and uncompressed neither can a message. With
+# compression the limit applies to the compressed batch, so lengths get WIDE_FRAME_LENGTH_SIZE
+# bytes and larger messages are refused only if they do not compress into a cover
+FRAME_LENGTH_SIZE = 2
+WIDE_FRAME_LENGTH_SIZE = 4
+FRAME_BYTE_ORDER = 'little'
+
+DEFAULT_LINGER_S = 0.0
+DEFAULT_BATCH_BYTES = 1024
+
+# With streaming negotiated, every payload starts with a kind byte. Stream chunks then carry
+# stream id(4) + sequence number(4) + flags(1) ahead of their data
+KIND_MESSAGES = 0
+KIND_STREAM = 1
+STREAM_ID_SIZE = 4
+STREAM_SEQ_SIZE = 4
+STREAM_HEADER_SIZE = 1 + STREAM_ID_SIZE + STREAM_SEQ_SIZE + 1
+STREAM_FINAL = 0x01
+STREAM_ABORT = 0x02
+
+StreamChunk = namedtuple("StreamChunk", ["stream_id", "seq", "flags", "data"])
+
+# Packs messages into one payload of length-prefixed frames
+def pack_messages(messages: list[bytes], length_size: int = FRAME_LENGTH_SIZE) -> bytes:
+    parts = []
+    for message in messages:
+        if len(message) >= 2 ** (8 * length_size):
+            raise ValueError("message too large to frame")
+        parts.append(len(message).to_bytes(length_size, FRAME_BYTE_ORDER, signed=False))
+        parts.append(message)
+    return b''.join(parts)
+
+# Yields the messages in a packed payload one at a time, without splitting it up front
+def iter_messages(payload: bytes, length_size: int = FRAME_LENGTH_SIZE):
+    view = memoryview(payload)
+    offset = 0
+    while offset < len(view):
+        if offset + length_size > len(view):
+            raise ValueError("truncated frame header")
+        size = int.from_bytes(view[offset:offset + length_size], FRAME_BYTE_ORDER, signed=False)
+        offset += length_size
+        if offset + size > len(view):
+            raise ValueError("truncated frame")
+        yield bytes(view[offset:offset + size])
+        offset += size
+
+def pack_stream_chunk(stream_id: int, seq: int, flags: int, data: bytes) -> bytes:
+    return b''.join([
+        bytes([KIND_STREAM]),
+        stream_id.to_bytes(STREAM_ID_SIZE, FRAME_BYTE_ORDER, signed=False),
+        seq.to_bytes(STREAM_SEQ_SIZE, FRAME_BYTE_ORDER, signed=False),
+        bytes([flags]),
+        data,
+    ])
+
+def parse_stream_chunk(payload: bytes) -> StreamChunk:
+    view = memoryview(payload)
+    if len(view) < STREAM_HEADER_SIZE or view[0] != KIND_STREAM:
+        raise ValueError("malformed stream chunk")
+    offset = 1
+    stream_id = int.from_bytes(view[offset:offset + STREAM_ID_SIZE], FRAME_BYTE_ORDER, signed=False)
+    offset += STREAM_ID_SIZE
+    seq = int.from_bytes(view[offset:offset + STREAM_SEQ_SIZE], FRAME_BYTE_ORDER, signed=False)
+    offset += STREAM_SEQ_SIZE
+    return StreamChunk(stream_id, seq, view[offset], bytes(view[offset + 1:]))
+
+# Splits source into chunks of at most chunk_size bytes. source may be a bytes-like object,
+# a binary file object, or an iterable of bytes-like pieces of any size
+def iter_chunks(source, chunk_size: int):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for offset in range(0, len(view), chunk_size):
+            yield bytes(view[offset:offset + chunk_size])
+        return
+
+    if hasattr(source, "read"):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    buffered = bytearray()
+    for piece in source:
+        buffered.extend(piece)
+        while len(buffered) >= chunk_size:
+            yield bytes(buffered[:chunk_size])
+            del buffered[:chunk_size]
+    if buffered:
+        yield bytes(buffered)
+
+# Nagle-style send buffer. Messages are held until the packed batch reaches max_bytes or the
+# oldest has waited linger_s, then handed to sink together as a list. With linger_s of 0
+# every message is sent immediately. Messages lost after add() returned (a failed deferred
+# flush, or an earlier batch sent ahead of a new message) set failed and are passed to
+# on_failure. It runs with the batcher locked, so it must not call back into it
+class MessageBatcher:
+    def __init__(self, sink, linger_s: float = DEFAULT_LINGER_S, max_bytes: int = DEFAULT_BATCH_BYTES,
+                 on_failure=None):
+        self._sink = sink
+        self._linger_s = linger_s
+        self._max_bytes = max_bytes
+        self._on_failure = on_failure
+        self._messages = []
+        self._size = 0
+        self._timer = None
+        self._lock = threading.Lock()
+        self.failed = False
+
+    # Queues message. Returns False only if message itself could not be sent
+    def add(self, message: bytes) -> bool:
+        with self._lock:
+            # Send what is queued first if message would push the batch past max_bytes
+            framed_size = FRAME_LENGTH_SIZE + len(message)
+            if self._messages and self._size + framed_size > self._max_bytes:
+                self._flush()
+
+            self._messages.append(message)
+            self._size += framed_size
+            if self._linger_s <= 0 or self._size >= self._max_bytes:
+                return self._flush(reported=1)
+
+            if self._timer is None:
+                self._timer = threading.Timer(self._linger_s, self._deferred_flush)
+                self._timer.daemon = True
+                self._timer.start()
+            return True
+
+    # Sends everything queued now. Returns False if the sink failed
+    def flush(self) -> bool:
+        with self._lock:
+            return self._flush(reported=len(self._messages))
+
+    def _deferred_flush(self):
+        with self._lock:
+            self._flush()
+
+    # Sends everything queued. On failure, all but the last reported messages (whose caller
+    # learns of it from the return value) go to on_failure. Callers must hold self._lock
+    def _flush(self, reported: int = 0) -> bool:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._messages:
+            return True
+
+        messages = self._messages
+        self._messages = []
+        self._size = 0
+        try:
+            sent = self._sink(messages)
+        except (OSError, ValueError):
+            sent = False
+
+        lost = messages[:len(messages) - reported]
+        if not sent and lost:
+            self.failed = True
+            if self._on_failure is not None:
+                self._on_failure(lost)
+        return sent
@@ -6,44 +6,50 @@
             import Isaac()
             x = Isaac.Isaac(seed_vector = 32bint*256)
             y = x.rand(42) # 0<= y <= 41
+            z = x.rand_block(1024) # numpy uint32 array of the next 1024 words
 
 """
 
-mod = 2 ** 32
+import numpy as np
+
+MASK = 0xFFFFFFFF
+
+# First eight words produced from the all-zero seed, as published with the reference implementation
+KNOWN_ANSWER = [0xF650E4C8, 0xE448E96D, 0x98DB2FB4, 0xF5FAD54F, 0x433F1AFB, 0xEDEC154A, 0xD8370487, 0x46CA4F9A]
 
 
 def mix(a, b, c, d, e, f, g, h):
-    a ^= 0xFFFFFFFF & b << 11
-    d = (d + a) % mod
-    b = (b + c) % mod
+    a ^= MASK & b << 11
+    d = (d + a) & MASK
+    b = (b + c) & MASK
     b ^= 0x3FFFFFFF & (c >> 2)
-    e = (e + b) % mod
-    c = (c + d) % mod
-    c ^= 0xFFFFFFFF & d << 8
-    f = (f + c) % mod
-    d = (d + e) % mod
+    e = (e + b) & MASK
+    c = (c + d) & MASK
+    c ^= MASK & d << 8
+    f = (f + c) & MASK
+    d = (d + e) & MASK
     d ^= e >> 16
-    g = (g + d) % mod
-    e = (e + f) % mod
-    e ^= 0xFFFFFFFF & f << 10
-    h = (h + e) % mod
-    f = (f + g) % mod
+    g = (g + d) & MASK
+    e = (e + f) & MASK
+    e ^= MASK & f << 10
+    h = (h + e) & MASK
+    f = (f + g) & MASK
     f ^= 0x0FFFFFFF & (g >> 4)
-    a = (a + f) % mod
-    g = (g + h) % mod
-    g ^= 0xFFFFFFFF & h << 8
-    b = (b + g) % mod
-    h = (h + a) % mod
+    a = (a + f) & MASK
+    g = (g + h) & MASK
+    g ^= MASK & h << 8
+    b = (b + g) & MASK
+    h = (h + a) & MASK
     h ^= 0x007FFFFF & (a >> 9)
-    c = (c + h) % mod
-    a = (a + b) % mod
+    c = (c + h) & MASK
+    a = (a + b) & MASK
     return a, b, c, d, e, f, g, h
 
 
 class Isaac(object):
-    def __init__(self, seed_vector=[0] * 256):
+    def __init__(self, seed_vector=None):
         self.mm = [0] * 256
-        self.randrsl = seed_vector
+        self.randrsl = list(seed_vector) if seed_vector is not None else [0] * 256
         self.randcnt = 0
         self.aa = 0
         self.bb = 0
@@ -59,29 +65,53 @@ class Isaac(object):
         self.randcnt += 1
         return res
 
+    # Returns the next n words of the stream as a uint32 array, continuing from (and
+    # consistent with) rand(). Whole 256-word batches are copied without per-word calls
+    def rand_block(self, n):
+        out = np.empty(n, dtype=np.uint32)
+        filled = 0
+        while filled < n:
+            if self.randcnt == 256:
+                self.__isaac__()
+                self.randcnt = 0
+            take = min(256 - self.randcnt, n - filled)
+            out[filled : filled + take] = self.randrsl[self.randcnt : self.randcnt + take]
+            self.randcnt += take
+            filled += take
+        return out
+
+    # Regenerates the 256-word result batch. The four-way shift schedule of the reference
+    # algorithm is unrolled and all arithmetic wraps by masking to 32 bits
     def __isaac__(self):
-        self.cc += 1
-        self.bb += self.cc
-        self.bb &= 0xFFFFFFFF
-
-        for i in range(256):
-            x = self.mm[i]
-            switch = i % 4
-            xorwith = None
-            if switch == 0:
-                xorwith = (self.aa << 13) % mod
-            elif switch == 1:
-                xorwith = self.aa >> 6
-            elif switch == 2:
-                xorwith = (self.aa << 2) % mod
-            elif switch == 3:
-                xorwith = self.aa >> 16
-            else:
-                raise Exception("math is broken")
-            self.aa = self.aa ^ xorwith
-            self.aa = (self.mm[(i + 128) % 256] + self.aa) % mod
-            y = self.mm[i] = (self.mm[(x >> 2) % 256] + self.aa + self.bb) % mod
-            self.randrsl[i] = self.bb = (self.mm[(y >> 10) % 256] + x) % mod
+        mm = self.mm
+        randrsl = self.randrsl
+        aa = self.aa
+        self.cc = (self.cc + 1) & MASK
+        bb = (self.bb + self.cc) & MASK
+
+        for i in range(0, 256, 4):
+            x = mm[i]
+            aa = ((aa ^ (aa << 13)) & MASK) + mm[(i + 128) & 255] & MASK
+            mm[i] = y = (mm[(x >> 2) & 255] + aa + bb) & MASK
+            randrsl[i] = bb = (mm[(y >> 10) & 255] + x) & MASK
+
+            x = mm[i + 1]
+            aa = (aa ^ (aa >> 6)) + mm[(i + 129) & 255] & MASK
+            mm[i + 1] = y = (mm[(x >> 2) & 255] + aa + bb) & MASK
+            randrsl[i + 1] = bb = (mm[(y >> 10) & 255] + x) & MASK
+
+            x = mm[i + 2]
+            aa = ((aa ^ (aa << 2)) & MASK) + mm[(i + 130) & 255] & MASK
+            mm[i + 2] = y = (mm[(x >> 2) & 255] + aa + bb) & MASK
+            randrsl[i + 2] = bb = (mm[(y >> 10) & 255] + x) & MASK
+
+            x = mm[i + 3]
+            aa = (aa ^ (aa >> 16)) + mm[(i + 131) & 255] & MASK
+            mm[i + 3] = y = (mm[(x >> 2) & 255] + aa + bb) & MASK
+            randrsl[i + 3] = bb = (mm[(y >> 10) & 255] + x) & MASK
+
+        self.aa = aa
+        self.bb = bb
 
     def __randinit__(self, flag):
         a = b = c = d = e = f = g = h = 0x9E3779B9
@@ -93,14 +123,14 @@ class Isaac(object):
         i = 0
         while i < 256:
             if flag:
-                a = (a + self.randrsl[i]) % mod
-                b = (b + self.randrsl[i + 1]) % mod
-                c = (c + self.randrsl[i + 2]) % mod
-                d = (d + self.randrsl[i + 3]) % mod
-                e = (e + self.randrsl[i + 4]) % mod
-                f = (f + self.randrsl[i + 5]) % mod
-                g = (g + self.randrsl[i + 6]) % mod
-                h = (h + self.randrsl[i + 7]) % mod
+                a = (a + self.randrsl[i]) & MASK
+                b = (b + self.randrsl[i + 1]) & MASK
+                c = (c + self.randrsl[i + 2]) & MASK
+                d = (d + self.randrsl[i + 3]) & MASK
+                e = (e + self.randrsl[i + 4]) & MASK
+                f = (f + self.randrsl[i + 5]) & MASK
+                g = (g + self.randrsl[i + 6]) & MASK
+                h = (h + self.randrsl[i + 7]) & MASK
 
             a, b, c, d, e, f, g, h = mix(a, b, c, d, e, f, g, h)
             self.mm[i : i + 7 + 1] = a, b, c, d, e, f, g, h
@@ -109,38 +139,38 @@ class Isaac(object):
         if flag:
             i = 0
             while i < 256:
-                a = (a + self.mm[i]) % mod
-                b = (b + self.mm[i + 1]) % mod
-                c = (c + self.mm[i + 2]) % mod
-                d = (d + self.mm[i + 3]) % mod
-                e = (e + self.mm[i + 4]) % mod
-                f = (f + self.mm[i + 5]) % mod
-                g = (g + self.mm[i + 6]) % mod
-                h = (h + self.mm[i + 7]) % mod
-                a ^= 0xFFFFFFFF & b << 11
-                d = (d + a) % mod
-                b = (b + c) % mod
+                a = (a + self.mm[i]) & MASK
+                b = (b + self.mm[i + 1]) & MASK
+                c = (c + self.mm[i + 2]) & MASK
+                d = (d + self.mm[i + 3]) & MASK
+                e = (e + self.mm[i + 4]) & MASK
+                f = (f + self.mm[i + 5]) & MASK
+                g = (g + self.mm[i + 6]) & MASK
+                h = (h + self.mm[i + 7]) & MASK
+                a ^= MASK & b << 11
+                d = (d + a) & MASK
+                b = (b + c) & MASK
                 b ^= 0x3FFFFFFF & (c >> 2)
-                e = (e + b) % mod
-                c = (c + d) % mod
-                c ^= 0xFFFFFFFF & d << 8
-                f = (f + c) % mod
-                d = (d + e) % mod
+                e = (e + b) & MASK
+                c = (c + d) & MASK
+                c ^= MASK & d << 8
+                f = (f + c) & MASK
+                d = (d + e) & MASK
                 d ^= e >> 16
-                g = (g + d) % mod
-                e = (e + f) % mod
-                e ^= 0xFFFFFFFF & f << 10
-                h = (h + e) % mod
-                f = (f + g) % mod
+                g = (g + d) & MASK
+                e = (e + f) & MASK
+                e ^= MASK & f << 10
+                h = (h + e) & MASK
+                f = (f + g) & MASK
                 f ^= 0x0FFFFFFF & (g >> 4)
-                a = (a + f) % mod
-                g = (g + h) % mod
-                g ^= 0xFFFFFFFF & h << 8
-                b = (b + g) % mod
-                h = (h + a) % mod
+                a = (a + f) & MASK
+                g = (g + h) & MASK
+                g ^= MASK & h << 8
+                b = (b + g) & MASK
+                h = (h + a) & MASK
                 h ^= 0x007FFFFF & (a >> 9)
-                c = (c + h) % mod
-                a = (a + b) % mod
+                c = (c + h) & MASK
+                a = (a + b) & MASK
                 self.mm[i : i + 7 + 1] = a, b, c, d, e, f, g, h
                 i += 8
         self.__isaac__()
@@ -149,6 +179,7 @@ class Isaac(object):
 
 if __name__ == "__main__":
     x = Isaac()
+    assert list(Isaac().rand_block(len(KNOWN_ANSWER))) == KNOWN_ANSWER, "known-answer test failed"
     for i in range(512):
         res = x.rand(2 ** 64)
         if i > 0 and i % 8 == 0:
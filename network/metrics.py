@@ -0,0 +1,194 @@
+import time
+import bisect
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Holds every metric and whether they record at all. While disabled, recording is a single
+# attribute check, so instrumented hot paths cost next to nothing
+class Registry:
+    def __init__(self):
+        self.enabled = False
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    # Adds metric, refusing a second metric under the same name
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    # Prometheus text exposition format
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# Base for metrics keyed by a fixed tuple of label names
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels: tuple = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self._labels = labels
+        self._registry = registry
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _label_text(self, label_values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self._labels, label_values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def _items(self) -> list:
+        with self._lock:
+            return sorted(self._values.items(), key=lambda item: str(item[0]))
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, *label_values):
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{self._label_text(labels)} {value}" for labels, value in self._items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *label_values):
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self._values[label_values] = value
+
+    def remove(self, *label_values):
+        with self._lock:
+            self._values.pop(label_values, None)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS,
+                 registry: Registry = REGISTRY):
+        super().__init__(name, help, labels, registry)
+        self._buckets = buckets
+
+    def observe(self, value: float, *label_values):
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = [[0] * (len(self._buckets) + 1), 0.0, 0]
+                self._values[label_values] = entry
+            entry[0][bisect.bisect_left(self._buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, (counts, total, count) in self._items():
+            cumulative = 0
+            for bound, bucket_count in zip(self._buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = '"+Inf"' if bound == float("inf") else f'"{bound}"'
+                lines.append(f"{self.name}_bucket{self._label_text(labels, 'le=' + le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(labels)} {total}")
+            lines.append(f"{self.name}_count{self._label_text(labels)} {count}")
+        return lines
+
+# Metric read from fn whenever it is rendered, for statistics an object keeps anyway (cache
+# hits, worker utilization). fn returns {label values: value}
+class CallbackMetric(_Metric):
+    def __init__(self, name: str, help: str, kind: str, fn, labels: tuple = (), registry: Registry = REGISTRY):
+        super().__init__(name, help, labels, registry)
+        self.kind = kind
+        self._fn = fn
+
+    def samples(self) -> list[str]:
+        values = sorted(self._fn().items(), key=lambda item: str(item[0]))
+        return [f"{self.name}{self._label_text(labels)} {value}" for labels, value in values]
+
+def counter(name: str, help: str, labels: tuple = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labels))
+
+def gauge(name: str, help: str, labels: tuple = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labels))
+
+def histogram(name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+def callback_metric(name: str, help: str, kind: str, fn, labels: tuple = ()) -> CallbackMetric:
+    return REGISTRY.register(CallbackMetric(name, help, kind, fn, labels))
+
+# Decorator recording each call's duration in histogram while metrics are enabled
+def timed(histogram: Histogram):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not histogram._registry.enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+# Acquires lock, recording how long the caller waited for it
+def acquire_timed(lock, histogram: Histogram, *label_values):
+    if not histogram._registry.enabled:
+        lock.acquire()
+        return
+    start = time.perf_counter()
+    lock.acquire()
+    histogram.observe(time.perf_counter() - start, *label_values)
+
+# Serves REGISTRY.render() over HTTP from a daemon thread. Returns the server
+def serve_metrics(host: str, port: int, registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Prints REGISTRY.render() every interval_s seconds from a daemon thread
+def start_log_dump(interval_s: float, registry: Registry = REGISTRY) -> threading.Thread:
+    def dump():
+        while True:
+            time.sleep(interval_s)
+            print(registry.render(), end="")
+
+    thread = threading.Thread(target=dump, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,28 @@
+import threading
+from collections import deque
+
+DEFAULT_WINDOW = 4096
+
+# Keeps the most recent latency samples (in seconds) and reports percentiles over them
+class LatencyRecorder:
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    # Returns {percentile: seconds} using nearest-rank over the current window
+    def percentiles(self, points: tuple = (50, 90, 99)) -> dict:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {p: None for p in points}
+        return {p: samples[min(len(samples) - 1, max(0, -(-p * len(samples) // 100) - 1))] for p in points}
+
+    def summary(self) -> str:
+        parts = [f"p{p}={value * 1000:.1f}ms" for p, value in self.percentiles().items() if value is not None]
+        return f"n={self.count} " + " ".join(parts)
@@ -1,209 +1,328 @@
 from isaac import Isaac
-from PIL import Image
+from bitstream import BitStream
+from arrangementcache import get_arrangement_cache
+from metrics import histogram, timed
+from PIL import Image, features
+import numpy as np
 import math
+import zlib
+import io
+
+# Keyed pixel arrangement algorithms. Both peers must use the same one
+ARRANGEMENT_PROBING = 1       # Random draws with linear probing on collision
+ARRANGEMENT_FISHER_YATES = 2  # Partial Fisher-Yates shuffle of the pixel index space
+ARRANGEMENT_VERSION = ARRANGEMENT_FISHER_YATES
+
+# Lossless output codecs: name -> (PIL format, save options). Decoding detects the format,
+# so peers only need to agree on one the receiver's PIL build can read
+CODECS = {
+    "png": ("PNG", {}),
+    "png-fast": ("PNG", {"compress_level": 1}),
+    "png-rle": ("PNG", {"compress_level": 6, "compress_type": zlib.Z_RLE}),
+    "png-huffman": ("PNG", {"compress_level": 6, "compress_type": zlib.Z_HUFFMAN_ONLY}),
+    "png-store": ("PNG", {"compress_level": 0}),
+    "bmp": ("BMP", {}),
+    "tiff": ("TIFF", {}),
+    "tiff-deflate": ("TIFF", {"compression": "tiff_adobe_deflate"}),
+    "webp": ("WEBP", {"lossless": True, "exact": True, "method": 0, "quality": 0}),
+}
+DEFAULT_CODEC = "png"
+
+# Image modes the codecs below store losslessly; the rest store every mode. BMP drops alpha
+# and WebP turns grayscale into RGB, so covers of other modes are written with DEFAULT_CODEC,
+# which every peer reads
+CODEC_MODES = {
+    "bmp": ("L", "RGB"),
+    "webp": ("RGB", "RGBA"),
+}
+
+# Channel densities (low bits per channel carrying payload) the transcoder supports. With
+# density signalling, the density minus one is stored in the lowest bit of the first channels
+DENSITIES = [1, 2, 3, 4]
+DEFAULT_DENSITY = 2
+DENSITY_MARKER_BITS = 2
+
+# Message pixels embedded or extracted per step. Symbols, pixel indices and their temporaries
+# only ever exist one chunk at a time
+EMBED_CHUNK_PIXELS = 8192
+
+ENCODE_SECONDS = histogram("stego_encode_seconds", "Time to embed a message in a prepared cover and serialize it")
+DECODE_SECONDS = histogram("stego_decode_seconds", "Time to parse an encoded image and extract its message")
+
+# Codecs this PIL build can write and read
+def available_codecs() -> list[str]:
+    unsupported = set()
+    if not features.check("webp"):
+        unsupported.add("webp")
+    if not features.check("libtiff"):
+        unsupported.add("tiff-deflate")
+    return [name for name in CODECS if name not in unsupported]
 
 class StegoTranscoder:
-    def __init__(self, chan_density: int = 2, rearrange_key: bytes = None):
+    # With cache_arrangements, keyed arrangements are kept in the process-wide
+    # ArrangementCache instead of being generated chunk by chunk for every message. With
+    # signal_density, every image records the density it was encoded at and decoding follows
+    # it, so each message may use a different one
+    def __init__(self, chan_density: int = DEFAULT_DENSITY, rearrange_key: bytes = None,
+                 arrangement_version: int = ARRANGEMENT_VERSION, codec: str = DEFAULT_CODEC,
+                 cache_arrangements: bool = False, signal_density: bool = False):
         self._header_size = 16
         self._chan_density = chan_density
         self._key = rearrange_key
+        self._arrangement_version = arrangement_version
+        self._codec = codec
+        self._cache_arrangements = cache_arrangements
+        self._signal_density = signal_density
+
+    # Same settings at another density
+    def at_density(self, chan_density: int) -> "StegoTranscoder":
+        if chan_density == self._chan_density:
+            return self
+        return StegoTranscoder(chan_density, self._key, self._arrangement_version, self._codec,
+                               self._cache_arrangements, self._signal_density)
 
     # Message should be a 'bytes' object
     def encode(self, message: bytes, in_img_path: str, out_img_path: str) -> bool:
-        # Load image, calculate image size
-        img = Image.open(in_img_path)
-        pixels = img.load()
-        width, height = img.size
-        channel_n = len(pixels[0,0])
+        encoded = self.encode_buffer(message, in_img_path)
+        if encoded is None:
+            return False
+
+        with open(out_img_path, "wb") as f:
+            f.write(encoded)
+        return True
+
+    # Encodes message into the cover image and returns the encoded image file contents, or
+    # None if the cover is too small. The cover may be a path, a file object, image bytes or
+    # already decoded pixels, which are copied rather than modified
+    def encode_buffer(self, message: bytes, in_img) -> bytes | None:
+        img_data = self.prepare_cover(in_img, len(message))
+        if img_data is None:
+            return None
+        return self.finish_cover(img_data, message, copy=False)
+
+    # Returns a writable copy of the cover with the size header for an msg_len byte message
+    # embedded, or None if the message will not fit. The header does not depend on the
+    # rearrangement key, so one prepared cover can be finished for many peers
+    def prepare_cover(self, in_img, msg_len: int) -> np.ndarray | None:
+        # Load image into a writable (height, width, channels) buffer
+        if isinstance(in_img, np.ndarray):
+            img_data = in_img.copy()
+        else:
+            img = self._open_image(in_img)
+            img_data = np.array(img, dtype=np.uint8)
+            img.close()
+        pixels = self._as_pixels(img_data)
+        height, width, channel_n = pixels.shape
 
         # Check if image sufficient size for message
-        encodable_bits = width * height * channel_n * self._chan_density 
-        msg_bits = self._bytes_to_bitstring(message)
-        header_bits = self._int_to_bitstring(int(len(msg_bits) / 8), self._header_size)
+        if msg_len >= 2 ** self._header_size:
+            return None
 
-        if len(msg_bits) + len(header_bits) > encodable_bits:
-            return False
-        
-        # Encode header in image
-        i = 0
-        cur_bit_n = 0
-        finished_encoding = False
-        while i < height and not finished_encoding:
-            j = 0
-            while j < width and not finished_encoding:
-                channels = list(pixels[i, j])
-                k = 0
-                while k < channel_n:
-                    l = 0
-                    channels[k] &= (0b11111111 << self._chan_density)
-                    while l < self._chan_density and cur_bit_n < self._header_size:
-                        channels[k] += (header_bits[cur_bit_n] << l)
-                        cur_bit_n += 1
-                        l += 1
-                    k += 1
-                pixels[i, j] = tuple(channels)
-
-                finished_encoding = (cur_bit_n >= self._header_size)
-                j += 1
-            i += 1
+        marker_pixels = self._marker_pixels(channel_n)
+        header_pixels = self._pixels_needed(self._header_size, channel_n)
+        msg_pixels = self._pixels_needed(msg_len * 8, channel_n)
+        if marker_pixels + header_pixels + msg_pixels > width * height:
+            return None
+
+        # Encode density and header in image
+        if self._signal_density:
+            self._write_density(pixels, channel_n)
+        header = msg_len.to_bytes(self._header_size // 8, 'little')
+        header_order = np.arange(marker_pixels, marker_pixels + header_pixels)
+        self._embed(pixels, header_order, self._to_symbols(header, channel_n))
+        return img_data
+
+    # Embeds message into a cover from prepare_cover and serializes it. The prepared cover is
+    # left untouched unless copy is False
+    @timed(ENCODE_SECONDS)
+    def finish_cover(self, img_data: np.ndarray, message: bytes, copy: bool = True) -> bytes:
+        if copy:
+            img_data = img_data.copy()
+        pixels = self._as_pixels(img_data)
+        height, width, channel_n = pixels.shape
 
         # Encode message in image
-        pixel_order = self._generate_pixel_arrangement(height, width, channel_n, len(msg_bits))
-        cur_bit_n = 0
-        pixel_n = 0
-        finished_encoding = False
-        while pixel_n < len(pixel_order) and not finished_encoding:
-            i, j = pixel_order[pixel_n][0], pixel_order[pixel_n][1]
-            channels = list(pixels[i, j])
-            k = 0
-            while k < channel_n: 
-                l = 0
-                channels[k] &= (0b11111111 << self._chan_density)
-                while l < self._chan_density and cur_bit_n < len(msg_bits):
-                    channels[k] += (msg_bits[cur_bit_n] << l) 
-                    cur_bit_n += 1
-                    l += 1
-                k += 1
-            pixels[i, j] = tuple(channels)
-
-            finished_encoding = (cur_bit_n >= len(msg_bits))
-            pixel_n += 1
-        
-        # Save image
-        img.save(out_img_path)
+        pixel_orders = self._iter_pixel_arrangement(height, width, channel_n, len(message) * 8)
+        chunks = BitStream(message).iter_symbols(self._chan_density, EMBED_CHUNK_PIXELS * channel_n, channel_n)
+        for pixel_order, symbols in zip(pixel_orders, chunks):
+            self._embed(pixels, pixel_order, symbols.reshape(-1, channel_n))
+
+        # Serialize image
+        img = Image.fromarray(img_data)
+        out_format, save_options = CODECS[self._output_codec(img.mode)]
+        out_buf = io.BytesIO()
+        img.save(out_buf, format=out_format, **save_options)
+        return out_buf.getvalue()
+
+    # The negotiated codec, unless it cannot store images of this mode losslessly
+    def _output_codec(self, mode: str) -> str:
+        if mode in CODEC_MODES.get(self._codec, (mode,)):
+            return self._codec
+        return DEFAULT_CODEC
+
+    # Accepts the same image sources as encode_buffer
+    @timed(DECODE_SECONDS)
+    def decode(self, in_img) -> bytes:
+        # Open image
+        img = self._open_image(in_img)
+        pixels = self._as_pixels(np.array(img, dtype=np.uint8))
         img.close()
-        return True
-    
-    def decode(self, in_img_path: str) -> bytes:
-        # Open image file
-        img = Image.open(in_img_path)
-        pixels = img.load()
-        width, height = img.size
-        channel_n = len(pixels[0,0])
-
-        # Extract message from image
-        msg_bytes = []
-        read_bits = 0
-        size_header = 0
-        i = 0
+        if self._signal_density:
+            return self.at_density(self._read_density(pixels))._decode_pixels(pixels)
+        return self._decode_pixels(pixels)
+
+    def _decode_pixels(self, pixels: np.ndarray) -> bytes:
+        height, width, channel_n = pixels.shape
 
         # Extract message header
-        i = 0
-        while i < height and read_bits < self._header_size:
-            j = 0
-            while j < width and read_bits < self._header_size:
-                channels = pixels[i, j] 
-                k = 0
-                while k < channel_n and read_bits < self._header_size:
-                    l = 0
-                    while l < self._chan_density and read_bits < self._header_size:
-                        bit = (channels[k] >> l) & 1
-                        size_header += (bit << read_bits)
-                        read_bits += 1
-                        l += 1
-                    k += 1
-                j += 1
-            i += 1
-
-
-        # Extract message
-        pixel_order = self._generate_pixel_arrangement(height, width, channel_n, size_header * 8)
-        read_bits = 0
-        cur_byte = 0
-        cur_byte_idx = 0
-        pixel_n = 0
-        finished_decoding = False
-        while pixel_n < len(pixel_order) and not finished_decoding:
-            i, j = pixel_order[pixel_n][0], pixel_order[pixel_n][1]
-            channels = pixels[i, j]
-            k = 0
-            while k < channel_n: 
-                l = 0
-                while l < self._chan_density and read_bits < size_header * 8:
-                    bit = (channels[k] >> l) & 1
-                    cur_byte += (bit << cur_byte_idx)
-                    cur_byte_idx += 1
-
-                    if cur_byte_idx >= 8:
-                        msg_bytes.append(cur_byte)
-                        cur_byte_idx = 0
-                        cur_byte = 0
-                    read_bits += 1
-                    l += 1
-                k += 1
-            finished_decoding = (read_bits >= size_header * 8)
-            pixel_n += 1
-        img.close()
-        
-        # Convert byte list into bytes object 
-        return bytes(msg_bytes)
-
-    def _bytes_to_bitstring(self, msg: bytes) -> list[int]:
-        bitstring = []
-        for byte in msg:
-            bitstring += self._int_to_bitstring(int(byte), 8)
-        return bitstring
-
-    def _int_to_bitstring(self, num: int, bitstring_len: int) -> list[int]:
-        if num.bit_length() > bitstring_len: 
-            return None
-        
-        bit_s = bin(num).split('b')[1][::-1]
-        bits = [0 for i in range(bitstring_len)]
-        for i in range(len(bit_s)):
-            if bit_s[i] == '1':
-                bits[i] = 1
-        return bits
-    
-    # Generates pixel indices for encoding/decoding. Uses self.key for pixel rearrangement if provided
-    def _generate_pixel_arrangement(self, width: int, height: int, channels: int, m_len: int) -> list[tuple]:
-        header_pixels = int(math.ceil(self._header_size / (self._chan_density * channels)))
-        starting_row = header_pixels // width
-        starting_col = header_pixels % width
-
-        total_pixels = int(math.ceil((m_len * 8) / (self._chan_density * channels))) 
-        arrangement = []
-        if self._key is not None:
-            start_num = (starting_row * width) + starting_col
-            end_num = width * height
-
-            rng = self._generate_csprng(m_len)
-            distincts = self._generate_n_distinct(start_num, end_num, total_pixels, rng)
-
-            for num in distincts:
-                row = num // width
-                col = num % width
-                arrangement.append((row, col))
-        else:
-            i, j = starting_row, starting_col
-            while i < height and len(arrangement) < total_pixels:
-                while j < width and len(arrangement) < total_pixels:
-                    arrangement.append((i, j))
-                    j += 1
-                i += 1
-                j = 0
-        return arrangement
-    
+        marker_pixels = self._marker_pixels(channel_n)
+        header_pixels = self._pixels_needed(self._header_size, channel_n)
+        header_symbols = self._extract(pixels, np.arange(marker_pixels, marker_pixels + header_pixels))
+        size_header = int.from_bytes(self._from_symbols(header_symbols, self._header_size), 'little')
+
+        # Extract message. Chunks hold whole bytes, so each is packed as soon as it is read
+        pixel_orders = self._iter_pixel_arrangement(height, width, channel_n, size_header * 8)
+        chunk_bytes = EMBED_CHUNK_PIXELS * channel_n * self._chan_density // 8
+        parts = []
+        for i, pixel_order in enumerate(pixel_orders):
+            n_bits = min(chunk_bytes, size_header - i * chunk_bytes) * 8
+            parts.append(self._from_symbols(self._extract(pixels, pixel_order), n_bits))
+        return b''.join(parts)
+
+    def _open_image(self, source) -> Image.Image:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        return Image.open(source)
+
+    # Views image data as a (height, width, channels) array, sharing its memory
+    def _as_pixels(self, img_data: np.ndarray) -> np.ndarray:
+        return img_data.reshape(img_data.shape[0], img_data.shape[1], -1)
+
+    # Largest message, in bytes, that fits a cover of the given dimensions
+    def capacity(self, width: int, height: int, channel_n: int) -> int:
+        free_pixels = width * height - self._marker_pixels(channel_n) - self._pixels_needed(self._header_size, channel_n)
+        return max(0, min(free_pixels * self._chan_density * channel_n // 8, 2 ** self._header_size - 1))
+
+    # Pixels at the start of the image reserved for the density marker
+    def _marker_pixels(self, channel_n: int) -> int:
+        return -(-DENSITY_MARKER_BITS // channel_n) if self._signal_density else 0
+
+    def _write_density(self, pixels: np.ndarray, channel_n: int):
+        marker_pixels = self._marker_pixels(channel_n)
+        bits = np.zeros(marker_pixels * channel_n, dtype=np.uint8)
+        bits[:DENSITY_MARKER_BITS] = [(self._chan_density - 1) >> i & 1 for i in range(DENSITY_MARKER_BITS)]
+        rows, cols = self._coordinates(pixels, np.arange(marker_pixels))
+        pixels[rows, cols] = (pixels[rows, cols] & np.uint8(0xFE)) | bits.reshape(marker_pixels, channel_n)
+
+    def _read_density(self, pixels: np.ndarray) -> int:
+        rows, cols = self._coordinates(pixels, np.arange(self._marker_pixels(pixels.shape[2])))
+        bits = (pixels[rows, cols] & 1).reshape(-1)[:DENSITY_MARKER_BITS]
+        return 1 + sum(int(bit) << i for i, bit in enumerate(bits))
+
+    # Row and column arrays for flat pixel indices, which run down image columns
+    def _coordinates(self, pixels: np.ndarray, pixel_order: np.ndarray) -> tuple:
+        height = pixels.shape[0]
+        return pixel_order % height, pixel_order // height
+
+    def _pixels_needed(self, n_bits: int, channel_n: int) -> int:
+        return int(math.ceil(n_bits / (self._chan_density * channel_n)))
+
+    # Writes one row of channel symbols into the low bits of each pixel in pixel_order.
+    # Flat pixel indices run down image columns (index = col * height + row)
+    def _embed(self, pixels: np.ndarray, pixel_order: np.ndarray, symbols: np.ndarray):
+        rows, cols = self._coordinates(pixels, pixel_order)
+        clear_mask = np.uint8((0xFF << self._chan_density) & 0xFF)
+        pixels[rows, cols] = (pixels[rows, cols] & clear_mask) | symbols
+
+    def _extract(self, pixels: np.ndarray, pixel_order: np.ndarray) -> np.ndarray:
+        rows, cols = self._coordinates(pixels, pixel_order)
+        return pixels[rows, cols] & np.uint8((1 << self._chan_density) - 1)
+
+    # Splits data into chan_density-bit symbols, least significant bit first, with one
+    # row of symbols per pixel. The final pixel is zero padded
+    def _to_symbols(self, data: bytes, channel_n: int) -> np.ndarray:
+        return BitStream(data).symbols(self._chan_density, channel_n).reshape(-1, channel_n)
+
+    def _from_symbols(self, symbols: np.ndarray, n_bits: int) -> bytes:
+        return BitStream.pack(symbols, self._chan_density, n_bits)
+
+    # Generates flat pixel indices for encoding/decoding. Uses self.key for pixel rearrangement if provided
+    def _generate_pixel_arrangement(self, height: int, width: int, channels: int, m_len: int) -> np.ndarray:
+        chunks = list(self._iter_pixel_arrangement(height, width, channels, m_len))
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint32)
+
+    # Yields the arrangement EMBED_CHUNK_PIXELS indices at a time as compact uint32 arrays,
+    # generating each chunk only when the previous one has been used
+    def _iter_pixel_arrangement(self, height: int, width: int, channels: int, m_len: int):
+        start_num = self._marker_pixels(channels) + self._pixels_needed(self._header_size, channels)
+        end_num = width * height
+        total_pixels = min(self._pixels_needed(m_len, channels), end_num - start_num)
+
+        if self._key is None:
+            for start in range(start_num, start_num + total_pixels, EMBED_CHUNK_PIXELS):
+                yield np.arange(start, min(start + EMBED_CHUNK_PIXELS, start_num + total_pixels), dtype=np.uint32)
+            return
+
+        cache = get_arrangement_cache()
+        if not (self._cache_arrangements and cache.enabled):
+            yield from self._iter_keyed(start_num, end_num, total_pixels, m_len)
+            return
+
+        cache_key = (self._key, self._arrangement_version, self._chan_density, self._signal_density, height, width,
+                     channels, m_len)
+        arrangement = cache.get(cache_key)
+        if arrangement is None:
+            chunks = list(self._iter_keyed(start_num, end_num, total_pixels, m_len))
+            arrangement = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint32)
+            cache.put(cache_key, arrangement)
+        for start in range(0, len(arrangement), EMBED_CHUNK_PIXELS):
+            yield arrangement[start:start + EMBED_CHUNK_PIXELS]
+
+    def _iter_keyed(self, start: int, end: int, num: int, m_len: int):
+        rng = self._generate_csprng(m_len)
+        if self._arrangement_version == ARRANGEMENT_PROBING:
+            return self._generate_n_distinct(start, end, num, rng)
+        return self._generate_n_shuffled(start, end, num, rng)
+
     # Derives 256 32-bit integers as seed vector for Isaac CSPRNG from the input key and message length
     def _generate_csprng(self, m_len: int) -> Isaac:
         seed_vec = []
         k_idx = 0
         while len(seed_vec) < 256:
-            seed_vec.append(((self._key[k_idx] + len(seed_vec))**m_len) % 2**32)
+            seed_vec.append(pow(self._key[k_idx] + len(seed_vec), m_len, 2**32))
             k_idx = (k_idx + 1) % len(self._key)
-        
+
         rng = Isaac(seed_vec)
         return rng
 
-    # Generates n numbers between start and end, none of which are the same
-    def _generate_n_distinct(self, start: int, end: int, num: int, rng: Isaac) -> list[int]:
-        numbers = []
-        while len(numbers) < num:
-            value = int((rng.rand(end)/end) * (end - start) + start) 
-            while value in numbers:
-                value = (value + 1) % end
-                if value < start: 
-                    value = start
-            numbers.append(value)
-        return numbers
+    # Generates n numbers between start and end, none of which are the same, in chunks
+    def _generate_n_distinct(self, start: int, end: int, num: int, rng: Isaac):
+        taken = set()
+        for offset in range(0, num, EMBED_CHUNK_PIXELS):
+            count = min(EMBED_CHUNK_PIXELS, num - offset)
+            draws = (rng.rand_block(count) % end / end) * (end - start) + start
+            numbers = np.empty(count, dtype=np.uint32)
+            for i, value in enumerate(draws.astype(np.int64).tolist()):
+                while value in taken:
+                    value = (value + 1) % end
+                    if value < start:
+                        value = start
+                taken.add(value)
+                numbers[i] = value
+            yield numbers
 
+    # Generates n distinct numbers between start and end, in chunks, by running the first n
+    # steps of a Fisher-Yates shuffle. Only swapped positions are stored, so cost is O(n) in
+    # time and space
+    def _generate_n_shuffled(self, start: int, end: int, num: int, rng: Isaac):
+        span = end - start
+        swapped = {}
+        for offset in range(0, num, EMBED_CHUNK_PIXELS):
+            count = min(EMBED_CHUNK_PIXELS, num - offset)
+            steps = np.arange(offset, offset + count, dtype=np.int64)
+            draws = rng.rand_block(count) % (span - steps) + steps
+            numbers = np.empty(count, dtype=np.uint32)
+            for i, j in zip(range(offset, offset + count), draws.tolist()):
+                numbers[i - offset] = start + swapped.get(j, j)
+                swapped[j] = swapped.get(i, i)
+            yield numbers
@@ -0,0 +1,185 @@
+import os
+import time
+import weakref
+import threading
+import multiprocessing
+import numpy as np
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from concurrent.futures import Future, ProcessPoolExecutor
+from stego import StegoTranscoder
+from arrangementcache import get_arrangement_cache, DEFAULT_BUDGET_BYTES
+from metrics import callback_metric
+
+# Covers kept in shared memory at once. Covers in use by queued jobs are never released
+MAX_SHARED_COVERS = 32
+
+# Pools not yet shut down, whose workers the metrics below report
+_pools = weakref.WeakSet()
+
+
+# Worker side. Spawned workers start from fresh modules, so the arrangement cache budget
+# configured in the parent is applied again here
+def _init_worker(arrangement_cache_bytes: int):
+    get_arrangement_cache().set_budget(arrangement_cache_bytes)
+
+# Pixel and image buffers arrive as shared memory block names instead of pickled copies;
+# only the payload, the transcoder settings and the result cross the pipe
+def _encode_job(shm_name: str, shape: tuple, payload: bytes, settings: tuple, prepared: bool):
+    start = time.perf_counter()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        cover = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        transcoder = StegoTranscoder(*settings)
+        if prepared:
+            encoded_img = transcoder.finish_cover(cover, payload)
+        else:
+            encoded_img = transcoder.encode_buffer(payload, cover)
+        del cover
+    finally:
+        shm.close()
+    return encoded_img, os.getpid(), time.perf_counter() - start
+
+def _decode_job(shm_name: str, size: int, settings: tuple):
+    start = time.perf_counter()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        message = StegoTranscoder(*settings).decode(bytes(shm.buf[:size]))
+    finally:
+        shm.close()
+    return message, os.getpid(), time.perf_counter() - start
+
+
+# Pool of worker processes running stego encode/decode jobs off the GIL. Results come back
+# as futures; callers that wait on each job before submitting the next (as StegoSession
+# does) keep their messages in order
+class StegoWorkerPool:
+    # arrangement_cache_bytes is each worker's arrangement cache budget
+    def __init__(self, workers: int, arrangement_cache_bytes: int = DEFAULT_BUDGET_BYTES):
+        # Workers are spawned rather than forked since the relay forks from busy threads
+        self._executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_worker, initargs=(arrangement_cache_bytes,))
+        self._workers = workers
+        self._lock = threading.Lock()
+        self._covers = OrderedDict()
+        self._started = time.perf_counter()
+        self._worker_stats = {}
+        _pools.add(self)
+
+    # Encodes payload into cover, a pixel array such as one from the cover cache
+    def encode(self, transcoder: StegoTranscoder, payload: bytes, cover: np.ndarray) -> Future:
+        shm = self._share_cover(cover)
+        future = self._executor.submit(_encode_job, shm.name, cover.shape, payload, self._settings(transcoder), False)
+        future.add_done_callback(lambda _: self._release_cover(cover))
+        return self._track(future)
+
+    # Finishes a cover from StegoTranscoder.prepare_cover for each (transcoder, payload) job,
+    # sharing one copy of the prepared pixels between all of them
+    def finish_many(self, prepared: np.ndarray, jobs: list[tuple]) -> list[Future]:
+        shm = self._copy_to_shared(prepared)
+        futures = [self._executor.submit(_encode_job, shm.name, prepared.shape, payload, self._settings(transcoder), True)
+                   for transcoder, payload in jobs]
+        self._unlink_when_done(shm, futures)
+        return [self._track(future) for future in futures]
+
+    def decode(self, transcoder: StegoTranscoder, encoded_img) -> Future:
+        shm = self._copy_to_shared(np.frombuffer(encoded_img, dtype=np.uint8))
+        future = self._executor.submit(_decode_job, shm.name, len(encoded_img), self._settings(transcoder))
+        self._unlink_when_done(shm, [future])
+        return self._track(future)
+
+    # Per worker process: jobs run, seconds spent in jobs, and that time as a fraction of
+    # the pool's lifetime
+    def utilization(self) -> dict:
+        elapsed = time.perf_counter() - self._started
+        with self._lock:
+            return {pid: {"jobs": jobs, "busy_s": busy, "utilization": busy / elapsed}
+                    for pid, (jobs, busy) in self._worker_stats.items()}
+
+    def shutdown(self):
+        _pools.discard(self)
+        self._executor.shutdown()
+        with self._lock:
+            for shm, _, _ in self._covers.values():
+                shm.close()
+                shm.unlink()
+            self._covers.clear()
+
+    def _settings(self, transcoder: StegoTranscoder) -> tuple:
+        return (transcoder._chan_density, transcoder._key, transcoder._arrangement_version, transcoder._codec,
+                transcoder._cache_arrangements, transcoder._signal_density)
+
+    # Unwraps worker results, recording which worker ran the job and for how long
+    def _track(self, future: Future) -> Future:
+        result = Future()
+
+        def done(f: Future):
+            if f.exception() is not None:
+                result.set_exception(f.exception())
+                return
+            value, pid, busy = f.result()
+            with self._lock:
+                jobs, total = self._worker_stats.get(pid, (0, 0.0))
+                self._worker_stats[pid] = (jobs + 1, total + busy)
+            result.set_result(value)
+
+        future.add_done_callback(done)
+        return result
+
+    # Returns the shared memory block holding cover, copying it in on first use. Each cover
+    # is pinned until every job using it finishes
+    def _share_cover(self, cover: np.ndarray) -> shared_memory.SharedMemory:
+        with self._lock:
+            entry = self._covers.get(id(cover))
+            if entry is None:
+                entry = [self._copy_to_shared(cover), cover, 0]
+                self._covers[id(cover)] = entry
+            entry[2] += 1
+            self._covers.move_to_end(id(cover))
+
+            # Release the least recently used idle covers
+            for key in list(self._covers.keys()):
+                if len(self._covers) <= MAX_SHARED_COVERS:
+                    break
+                shm, _, users = self._covers[key]
+                if users == 0:
+                    shm.close()
+                    shm.unlink()
+                    del self._covers[key]
+            return entry[0]
+
+    def _release_cover(self, cover: np.ndarray):
+        with self._lock:
+            entry = self._covers.get(id(cover))
+            if entry is not None:
+                entry[2] -= 1
+
+    def _copy_to_shared(self, data: np.ndarray) -> shared_memory.SharedMemory:
+        shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        np.ndarray(data.shape, dtype=np.uint8, buffer=shm.buf)[...] = data
+        return shm
+
+    def _unlink_when_done(self, shm: shared_memory.SharedMemory, futures: list[Future]):
+        remaining = [len(futures)]
+
+        def done(_):
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            shm.close()
+            shm.unlink()
+
+        for future in futures:
+            future.add_done_callback(done)
+
+# One utilization statistic of every worker of every live pool, by worker pid
+def _stat_by_worker(name: str) -> dict:
+    return {(str(pid),): stats[name] for pool in list(_pools) for pid, stats in pool.utilization().items()}
+
+callback_metric("stego_pool_worker_jobs_total", "Stego jobs completed by each worker process", "counter",
+                lambda: _stat_by_worker("jobs"), ("pid",))
+callback_metric("stego_pool_worker_busy_seconds_total", "Time each worker process spent running stego jobs", "counter",
+                lambda: _stat_by_worker("busy_s"), ("pid",))
+callback_metric("stego_pool_worker_utilization", "Fraction of the pool's lifetime each worker spent busy", "gauge",
+                lambda: _stat_by_worker("utilization"), ("pid",))
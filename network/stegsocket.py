@@ -1,146 +1,484 @@
 import os
+import json
+import time
 import socket
 import select
-import tempfile
-from stego import StegoTranscoder
+import threading
+import itertools
+from stego import (StegoTranscoder, ARRANGEMENT_PROBING, ARRANGEMENT_VERSION, DEFAULT_CODEC, DENSITIES, DEFAULT_DENSITY,
+                   available_codecs)
+from covercache import get_cover_cache
+from coverindex import get_cover_index
+from stegopool import StegoWorkerPool
+from stats import LatencyRecorder
+from metrics import counter, histogram, timed
+from tickets import TicketCache, SessionTicket
+from frameparser import FrameParser, MAX_FRAME_SIZE
+from compression import PayloadCompressor, available_compression
+from aead import AeadChannel, CIPHERS, CIPHER_CBC, AEAD_CIPHERS, OVERHEAD as AEAD_OVERHEAD
+from framing import (MessageBatcher, pack_messages, iter_messages, iter_chunks, pack_stream_chunk, parse_stream_chunk,
+                     KIND_MESSAGES, KIND_STREAM, STREAM_HEADER_SIZE, STREAM_FINAL, STREAM_ABORT, STREAM_ID_SIZE,
+                     DEFAULT_LINGER_S, DEFAULT_BATCH_BYTES, FRAME_LENGTH_SIZE, WIDE_FRAME_LENGTH_SIZE)
 
 from cryptography.hazmat.primitives import hashes, serialization, padding
-from cryptography.hazmat.primitives.asymmetric import dh
+from cryptography.hazmat.primitives.asymmetric import dh, x25519
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 IV_SIZE = 16
 HEADER_SIZE = 4
 AES_BLOCK_SIZE = 128
 AES_KEY_LENGTH = 32
 BYTE_ORDER = 'little'
-BUFFER_SIZE = 4096
+BUFFER_SIZE = 65536
 POLL_TIME_MS = 5000
 
-class StegoSocket:
-    def __init__(self, image_repo: str, sock: socket.socket, encryption: bool = False, is_server: bool = False):
-        self._sock = sock 
-        self._poller = select.poll() 
-        self._poller.register(self._sock, select.POLLIN)
+# Handshake capability fields
+HELLO_ENCODING = 'utf-8'
+HELLO_ARRANGEMENT = "arrangement"
+HELLO_KEX = "kex"
+HELLO_RESUMPTION = "resumption"
+HELLO_NONCE = "nonce"
+HELLO_TICKET = "ticket"
+HELLO_FRAMING = "framing"
+FRAMING_VERSION = 1
+HELLO_STREAMING = "streaming"
+HELLO_CODECS = "codecs"
+HELLO_DENSITIES = "densities"
+HELLO_COMPRESSION = "compression"
+HELLO_CIPHERS = "ciphers"
+STREAMING_VERSION = 1
+
+# Baseline servers send no hello; their first message is the PEM encoded DH parameters
+LEGACY_DH_PREFIX = b'-----BEGIN DH PARAMETERS'
+
+# Types of the hello fields whose values are used, and of the items of the list fields
+HELLO_FIELD_TYPES = {HELLO_ARRANGEMENT: int, HELLO_NONCE: str, HELLO_TICKET: str}
+HELLO_LIST_TYPES = {HELLO_KEX: str, HELLO_CODECS: str, HELLO_DENSITIES: int, HELLO_COMPRESSION: str, HELLO_CIPHERS: str}
+
+# Session resumption
+RESUMPTION_VERSION = 1
+RESUME_NONCE_SIZE = 16
+RESUME_ACCEPTED = b'\x01'
+RESUME_REJECTED = b'\x00'
+TICKET_NONCE_SIZE = 12
+
+# Key exchange methods, in order of preference. The server's order decides
+KEX_X25519 = "x25519"
+KEX_DH = "dh"
+KEY_EXCHANGES = [KEX_X25519, KEX_DH]
+
+# RFC 7919 ffdhe2048 group, usable instead of generated DH parameters
+FFDHE2048 = "ffdhe2048"
+FFDHE2048_P = int(
+    "FFFFFFFFFFFFFFFFADF85458A2BB4A9AAFDC5620273D3CF1D8B9C583CE2D3695"
+    "A9E13641146433FBCC939DCE249B3EF97D2FE363630C75D8F681B202AEC4617A"
+    "D3DF1ED5D5FD65612433F51F5F066ED0856365553DED1AF3B557135E7F57C935"
+    "984F0C70E0E68B77E2A689DAF3EFE8721DF158A136ADE73530ACCA4F483A797A"
+    "BC0AB182B324FB61D108A94BB2C8E3FBB96ADAB760D7F4681D4F42A3DE394DF4"
+    "AE56EDE76372BB190B07A7C8EE0A6D709E02FCE1CDF7E2ECC03404CD28342F61"
+    "9172FE9CE98583FF8E4F1232EEF28183C3FE3B1B4C6FAD733BB5FCBC2EC22005"
+    "C58EF1837D1683B2C6F34A26C1B2EFFA886B423861285C97FFFFFFFFFFFFFFFF", 16)
+
+# Wall-clock time of completed handshakes in this process
+handshake_latency = LatencyRecorder()
+
+# Loads DH parameters from a PEM file, generating and saving them first if the file does not
+# exist, so the expensive safe-prime search happens once per deployment rather than per
+# connection. Passing "ffdhe2048" selects the fixed RFC 7919 group instead
+def load_dh_parameters(path: str, key_size: int = 2048) -> dh.DHParameters:
+    if path == FFDHE2048:
+        return dh.DHParameterNumbers(FFDHE2048_P, 2).parameters()
+
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            return serialization.load_pem_parameters(f.read())
 
-        self._image_repo = [os.path.join(image_repo, f) for f in os.listdir(image_repo) if os.path.isfile(os.path.join(image_repo, f))]
-        self._img_idx = 0
+    parameters = dh.generate_parameters(generator=2, key_size=key_size)
+    with open(path, "wb") as f:
+        f.write(parameters.parameter_bytes(serialization.Encoding.PEM, serialization.ParameterFormat.PKCS3))
+    return parameters
+
+SEND_SECONDS = histogram("stego_socket_send_seconds", "Time to encrypt, encode and transmit one payload")
+RECV_SECONDS = histogram("stego_socket_recv_seconds", "Time to decode one fully received frame")
+HANDSHAKE_SECONDS = histogram("stego_handshake_seconds", "Handshake duration, resumed or full")
+ENCRYPT_SECONDS = histogram("stego_encrypt_seconds", "Encryption time per payload")
+DECRYPT_SECONDS = histogram("stego_decrypt_seconds", "Decryption time per payload")
+REJECTED_PAYLOADS = counter("stego_rejected_payloads_total", "Received payloads failing authentication or replaying a counter")
+COMPRESS_SECONDS = histogram("stego_compress_seconds", "Time to compress one payload before encryption")
+COMPRESSION_SAVED = counter("stego_compression_saved_bytes_total", "Plaintext bytes saved by compression, net of flag bytes")
+BYTES_SENT = counter("stego_bytes_sent_total", "Bytes written to peers, including frame headers")
+BYTES_RECEIVED = counter("stego_bytes_received_total", "Bytes read from peers, including frame headers")
+
+# Handshake step asking the driver for the peer's next size-prefixed message
+RECV = None
+
+# Returns peer_hello if it is an object whose known fields have the types this side uses them
+# as. Raises socket.error otherwise, like any other hello the handshake cannot continue from
+def _check_hello(peer_hello) -> dict:
+    if not isinstance(peer_hello, dict):
+        raise socket.error("malformed hello")
+    for field, field_type in HELLO_FIELD_TYPES.items():
+        if field in peer_hello and not isinstance(peer_hello[field], field_type):
+            raise socket.error(f"malformed hello field {field}")
+    for field, item_type in HELLO_LIST_TYPES.items():
+        if field in peer_hello and not (isinstance(peer_hello[field], list) and
+                                        all(isinstance(item, item_type) for item in peer_hello[field])):
+            raise socket.error(f"malformed hello field {field}")
+    return peer_hello
+
+# Transport-independent half of a stego connection: key agreement, encryption and
+# steganographic encoding. Subclasses move the encoded images over an actual transport
+class StegoSession:
+    def __init__(self, image_repo: str, encryption: bool = False, pool: StegoWorkerPool | None = None,
+                 dh_parameters: dh.DHParameters | None = None, key_exchanges: list[str] = KEY_EXCHANGES,
+                 ticket_cache: TicketCache | None = None, session: SessionTicket | None = None,
+                 codecs: list[str] | None = None, max_frame_size: int = MAX_FRAME_SIZE,
+                 densities: list[int] | None = None, compression: list[str] | tuple = (),
+                 ciphers: list[str] = CIPHERS, streaming: bool = True):
+        self._cover_index = get_cover_index(image_repo)
+        self._covers = get_cover_cache(image_repo)
 
         self._transcoder = StegoTranscoder()
         self._use_encryption = encryption
-        if self._use_encryption:
-            self._key_exchange(is_server)
-            self._transcoder = StegoTranscoder(rearrange_key=self._rearrange_key)
+        self._pool = pool
+        self._dh_parameters = dh_parameters
+        self._key_exchanges = key_exchanges
+        self._codecs = codecs if codecs is not None else available_codecs()
+        self._codec = DEFAULT_CODEC
 
-    def send(self, message: bytes) -> bool:
-        # Encrypt message if encryption mode is enabled 
-        if self._use_encryption:
-            # Generate IV and create cipher
-            iv = os.urandom(IV_SIZE)
-            cipher = Cipher(algorithms.AES(self._derived_key), modes.CBC(iv))
+        # Channel densities offered to the peer. If both sides offer some, every image carries
+        # its density and each payload gets the density and cover putting fewest bytes on the
+        # wire. Otherwise everything is encoded at DEFAULT_DENSITY
+        self._offered_densities = sorted(densities if densities is not None else DENSITIES)
+        self._densities = [DEFAULT_DENSITY]
 
-            # Pad data to standard AES block size
-            padder = padding.PKCS7(AES_BLOCK_SIZE).padder()
-            message = padder.update(message) + padder.finalize()
+        # Frames announcing more than this are refused before anything is allocated for them,
+        # and compressed payloads may not expand beyond it either
+        self._max_frame_size = max_frame_size
 
-            # Encrypt data
-            encryptor = cipher.encryptor()
-            message = iv + encryptor.update(message) + encryptor.finalize()
+        # Compression methods offered to the peer, skipping any this process lacks. Payloads are
+        # compressed before encryption only if both sides offer a common method. None are
+        # offered by default, since compressed sizes reveal how alike messages sharing a cover are
+        supported = available_compression()
+        self._compression_methods = [method for method in compression if method in supported]
+        self._compressor = None
 
-        # Pick appropriate image medium file 
-        medium_in_file = self._image_repo[self._img_idx]
-        self._img_idx = (self._img_idx + 1) % len(self._image_repo)
-        medium_out_file = tempfile.NamedTemporaryFile().name + ".png"
+        # Payload ciphers offered to the peer. With an AEAD cipher agreed, self._aead seals
+        # and opens payloads; otherwise they use AES-CBC
+        self._ciphers = ciphers
+        self._aead = None
 
-        # Perform steganographic encoding
-        if not self._transcoder.encode(message, medium_in_file, medium_out_file):
-            return False
-        
-        # Send fixed-length size header to peer
-        img_size = os.path.getsize(medium_out_file)
-        header = img_size.to_bytes(HEADER_SIZE, BYTE_ORDER, signed=False)
-        self._sock.sendall(header)
-
-        # Send encoded image file to peer
-        with open(medium_out_file, "rb") as f:
-            while True:
-                bytes_read = f.read(BUFFER_SIZE)
-                if not bytes_read:
-                    break
-                self._sock.sendall(bytes_read)
-        os.remove(medium_out_file)
+        # Servers issue tickets from ticket_cache. Clients offer session, and after a
+        # handshake expose the ticket for their next connection as self.session
+        self._ticket_cache = ticket_cache
+        self.session = session
+        self.resumed = False
 
-        return True
+        # Whether payloads carry length-prefixed message batches, and whether they start with
+        # a kind byte so stream chunks can be told apart. Both are settled by the hello, and
+        # streaming is only offered if this side consumes stream chunks (recv_stream)
+        self._framing = False
+        self._offer_streaming = streaming
+        self._streaming = False
+
+    # Wraps a single message for the wire format agreed with the peer
+    def _frame(self, message: bytes) -> bytes:
+        return self._frame_batch([message]) if self._framing else message
+
+    def _frame_batch(self, messages: list[bytes]) -> bytes:
+        batch = pack_messages(messages, self._frame_length_size())
+        return bytes([KIND_MESSAGES]) + batch if self._streaming else batch
+
+    # Returns an iterator over the messages in a received payload
+    def _unframe(self, payload: bytes):
+        if not self._framing:
+            return iter((payload,))
+        if self._streaming:
+            if payload[0] != KIND_MESSAGES:
+                raise socket.error("unexpected stream data")
+            payload = memoryview(payload)[1:]
+        return iter_messages(payload, self._frame_length_size())
+
+    # Compressed batches may unpack to more than a cover holds, so their lengths are wider
+    def _frame_length_size(self) -> int:
+        return WIDE_FRAME_LENGTH_SIZE if self._compressor is not None else FRAME_LENGTH_SIZE
+
+    def _is_stream_chunk(self, payload: bytes) -> bool:
+        return self._streaming and len(payload) > 0 and payload[0] == KIND_STREAM
+
+    # Largest plaintext that still fits the largest cover once encrypted, even if it does
+    # not compress at all
+    def _max_plaintext(self) -> int:
+        signal_density = self._transcoder._signal_density
+        capacity = max(self._cover_index.largest_capacity(density, signal_density) for density in self._densities)
+        if self._use_encryption and self._aead is not None:
+            capacity -= AEAD_OVERHEAD
+        elif self._use_encryption:
+            block_bytes = AES_BLOCK_SIZE // 8
+            capacity = (capacity - IV_SIZE) // block_bytes * block_bytes - 1
+        return capacity - 1 if self._compressor is not None else capacity
 
-    def recv(self) -> bytes | None:
-        # Check if any data is on the pipe 
-        header = None
-        events = self._poller.poll(POLL_TIME_MS)
-        for sock, event in events:
-            if event and select.POLLIN:
-                if sock == self._sock.fileno():
-                    header = self._sock.recv(HEADER_SIZE)
-        
-        if header is None:
-            return None 
-
-        # Receive encoded image
-        img_size = int.from_bytes(header, BYTE_ORDER, signed=False)
-        read_bytes = 0
-        medium_out_file = tempfile.NamedTemporaryFile().name + ".png" 
-        with open(medium_out_file, "wb") as f:
-            while read_bytes < img_size:
-                buf_size = BUFFER_SIZE
-                if buf_size > img_size - read_bytes:
-                    buf_size = img_size - read_bytes
-
-                bytes_read = self._sock.recv(BUFFER_SIZE)
-                if not bytes_read:
-                    break
-                read_bytes += len(bytes_read)
-                f.write(bytes_read)
-        
+    # Compresses, encrypts and encodes message into the smallest cover that fits. Returns the
+    # encoded image, or None if no cover is large enough
+    def _seal(self, message: bytes) -> bytes | None:
+        # Encrypt message if encryption mode is enabled
+        message = self._encrypt(self._compress(message))
+
+        transcoder, cover = self._choose_cover(len(message))
+        if cover is None:
+            return None
+
+        # Perform steganographic encoding
+        if self._pool is not None:
+            return self._pool.encode(transcoder, message, cover).result()
+        return transcoder.encode_buffer(message, cover)
+
+    # Decodes and decrypts an encoded image received from the peer
+    def _open(self, encoded_img) -> bytes:
         # Attempt steganographic decoding
         try:
-            message = self._transcoder.decode(medium_out_file)
+            if self._pool is not None:
+                message = self._pool.decode(self._transcoder, encoded_img).result()
+            else:
+                message = self._transcoder.decode(encoded_img)
         except:
             raise socket.error
 
-        # Cleanup intermediary image file
-        os.remove(medium_out_file)
-        
         # Decrypt if encryption mode is enabled
-        if self._use_encryption:
-            # Extract IV
-            iv = message[:IV_SIZE] 
-            message = message[IV_SIZE:]
+        return self._decompress(self._decrypt(message))
 
-            # Create cipher for decoding
-            cipher = Cipher(algorithms.AES(self._derived_key), modes.CBC(iv))
-            decryptor = cipher.decryptor()
+    # Encodes the same message for every session, sharing all work that does not depend on a
+    # peer's keys: framing, compression, cover selection and decoding, size header embedding,
+    # and for peers without a rearrangement key, the whole encoded image. Returns (session,
+    # encoded image) pairs, with None as the image for sessions whose cover was too small or
+    # whose framing cannot hold the message
+    @staticmethod
+    def _seal_broadcast(sessions: list, message: bytes) -> list[tuple]:
+        # Framing and compressing depend only on negotiated settings, so are done once for
+        # all peers sharing them
+        plaintexts, session_settings = {}, []
+        for session in sessions:
+            settings = (session._framing, session._streaming, session._compressor.method if session._compressor else None)
+            if settings not in plaintexts:
+                try:
+                    plaintexts[settings] = session._compress(session._frame(message))
+                except ValueError:
+                    plaintexts[settings] = None
+            session_settings.append(settings)
 
-            # Decrypt and unpad
-            unpadder = padding.PKCS7(AES_BLOCK_SIZE).unpadder()
-            message = decryptor.update(message) + decryptor.finalize()
-            message = unpadder.update(message) + unpadder.finalize() 
+        # Group peers whose prepared covers are interchangeable: the same densities to choose
+        # from lead to the same density and cover for the same payload length
+        sealed = []
+        groups = {}
+        for session, settings in zip(sessions, session_settings):
+            if plaintexts[settings] is None:
+                sealed.append((session, None))
+                continue
+            payload = session._encrypt(plaintexts[settings])
+            profile = (tuple(session._densities), session._transcoder._signal_density, len(payload))
+            groups.setdefault(profile, []).append((session, payload))
 
-        return message
-    
-    def _key_exchange(self, server: bool):
+        for members in groups.values():
+            lead, payload = members[0]
+            lead_transcoder, cover = lead._choose_cover(len(payload))
+            prepared = lead_transcoder.prepare_cover(cover, len(payload)) if cover is not None else None
+            if prepared is None:
+                sealed.extend((session, None) for session, _ in members)
+                continue
+
+            # One finish job per distinct (key, payload), run in parallel when a pool is set
+            density = lead_transcoder._chan_density
+            jobs = {}
+            for session, payload in members:
+                transcoder = session._transcoder.at_density(density)
+                key = (transcoder._key, transcoder._arrangement_version, transcoder._codec, payload)
+                jobs.setdefault(key, (transcoder, payload))
+
+            if lead._pool is not None:
+                futures = lead._pool.finish_many(prepared, list(jobs.values()))
+                encoded_imgs = {key: future.result() for key, future in zip(jobs.keys(), futures)}
+            else:
+                encoded_imgs = {key: transcoder.finish_cover(prepared, payload) for key, (transcoder, payload) in jobs.items()}
+
+            for session, payload in members:
+                key = (session._transcoder._key, session._transcoder._arrangement_version, session._transcoder._codec, payload)
+                sealed.append((session, encoded_imgs[key]))
+        return sealed
+
+    @timed(COMPRESS_SECONDS)
+    def _compress(self, message: bytes) -> bytes:
+        if self._compressor is None:
+            return message
+        compressed = self._compressor.compress(message)
+        COMPRESSION_SAVED.inc(len(message) - len(compressed))
+        return compressed
+
+    def _decompress(self, message: bytes) -> bytes:
+        if self._compressor is None:
+            return message
+        try:
+            return self._compressor.decompress(message)
+        except ValueError as e:
+            raise socket.error(str(e))
+
+    @timed(ENCRYPT_SECONDS)
+    def _encrypt(self, message: bytes) -> bytes:
+        if not self._use_encryption:
+            return message
+        if self._aead is not None:
+            return self._aead.seal(message)
+
+        # Generate IV and create cipher
+        iv = os.urandom(IV_SIZE)
+        cipher = Cipher(algorithms.AES(self._derived_key), modes.CBC(iv))
+
+        # Pad data to standard AES block size
+        padder = padding.PKCS7(AES_BLOCK_SIZE).padder()
+        message = padder.update(message) + padder.finalize()
+
+        # Encrypt data
+        encryptor = cipher.encryptor()
+        return iv + encryptor.update(message) + encryptor.finalize()
+
+    @timed(DECRYPT_SECONDS)
+    def _decrypt(self, message: bytes) -> bytes:
+        if not self._use_encryption:
+            return message
+        if self._aead is not None:
+            try:
+                return self._aead.open(message)
+            except ValueError as e:
+                REJECTED_PAYLOADS.inc()
+                raise socket.error(str(e))
+
+        # Extract IV
+        iv = message[:IV_SIZE]
+        message = message[IV_SIZE:]
+
+        # Create cipher for decoding
+        cipher = Cipher(algorithms.AES(self._derived_key), modes.CBC(iv))
+        decryptor = cipher.decryptor()
+
+        # Decrypt and unpad
+        unpadder = padding.PKCS7(AES_BLOCK_SIZE).unpadder()
+        message = decryptor.update(message) + decryptor.finalize()
+        return unpadder.update(message) + unpadder.finalize()
+
+    # Picks the density and cover for a payload_len byte payload, returning the transcoder for
+    # that density and the cover's pixels (None if nothing fits). The smallest cover that fits
+    # at any agreed density wins, since the encoded image grows with the cover far more than
+    # with the density. Among densities fitting the same cover the lowest is used: it changes
+    # the fewest bits, which leaves the image most compressible and least disturbed
+    def _choose_cover(self, payload_len: int) -> tuple:
+        signal_density = self._transcoder._signal_density
+        best = None
+        for density in self._densities:
+            path = self._cover_index.smallest_fitting(payload_len, density, signal_density)
+            if path is None:
+                continue
+            size = self._cover_index.cover_size(path)
+            if best is None or size < best[0]:
+                best = (size, density, path)
+
+        if best is None:
+            return self._transcoder, None
+        _, density, path = best
+        return self._transcoder.at_density(density), self._covers.get(path)
+
+    # Key exchange written without any I/O so blocking and asyncio transports can share it.
+    # Yields bytes to send to the peer, or RECV to be resumed with the peer's next message
+    def _handshake(self, server: bool):
+        start = time.perf_counter()
+
+        # Agree on protocol features before any keyed data is exchanged
+        legacy_parameters = yield from self._negotiate(server)
+
+        # Skip the key exchange if the server accepts the client's ticket
+        secret = None
+        if self._resume_offered:
+            if server:
+                secret = self._ticket_cache.redeem(self._peer_ticket)
+                yield RESUME_ACCEPTED if secret is not None else RESUME_REJECTED
+            elif (yield RECV) == RESUME_ACCEPTED:
+                secret = self.session.secret
+
+        salt = None
+        if secret is not None:
+            # Fresh nonces from both sides keep resumed keys distinct from earlier sessions
+            salt = self._client_nonce + self._server_nonce
+            self.resumed = True
+        elif self._kex == KEX_X25519:
+            priv_key = x25519.X25519PrivateKey.generate()
+            yield priv_key.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+            peer_pub_key = x25519.X25519PublicKey.from_public_bytes((yield RECV))
+            secret = priv_key.exchange(peer_pub_key)
+        else:
+            priv_key, peer_pub_key = yield from self._dh_exchange(server, legacy_parameters)
+            secret = priv_key.exchange(peer_pub_key)
+
+        # Derive two symmetric keys. One for encryption
+        # and one for steganographic pixel diffusion
+        self._shared_key = secret
+        master_key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=AES_KEY_LENGTH * 2,
+            salt=salt,
+            info=b'handshake'
+        ).derive(self._shared_key)
+        self._derived_key = master_key[:AES_KEY_LENGTH]
+        self._rearrange_key = master_key[AES_KEY_LENGTH:]
+        self._transcoder = StegoTranscoder(DEFAULT_DENSITY, self._rearrange_key, self._arrangement_version, self._codec,
+                                           cache_arrangements=True, signal_density=self._signal_density)
+        if self._cipher in AEAD_CIPHERS:
+            self._aead = AeadChannel(self._cipher, self._derived_key, server)
+
+        if self._resumption:
+            yield from self._exchange_ticket(server, salt)
+
+        self._handshake_seconds = time.perf_counter() - start
+        handshake_latency.record(self._handshake_seconds)
+        HANDSHAKE_SECONDS.observe(self._handshake_seconds)
+
+    # The server stores a secret for the next connection and sends its ticket encrypted
+    # under this session's key. Both sides derive the secret, so it never crosses the wire
+    def _exchange_ticket(self, server: bool, salt: bytes | None):
+        resumption_secret = HKDF(
+            algorithm=hashes.SHA256(),
+            length=AES_KEY_LENGTH,
+            salt=salt,
+            info=b'resumption'
+        ).derive(self._shared_key)
+
+        cipher = AESGCM(self._derived_key)
+        if server:
+            ticket = self._ticket_cache.issue(resumption_secret)
+            lifetime = int(self._ticket_cache.ttl_s).to_bytes(HEADER_SIZE, BYTE_ORDER, signed=False)
+            nonce = os.urandom(TICKET_NONCE_SIZE)
+            yield nonce + cipher.encrypt(nonce, ticket + lifetime, b'ticket')
+        else:
+            sealed = yield RECV
+            plain = cipher.decrypt(sealed[:TICKET_NONCE_SIZE], sealed[TICKET_NONCE_SIZE:], b'ticket')
+            ticket, lifetime = plain[:-HEADER_SIZE], int.from_bytes(plain[-HEADER_SIZE:], BYTE_ORDER, signed=False)
+            self.session = SessionTicket(ticket, resumption_secret, time.time() + lifetime)
+
+    # Finite field DH. The server sends its group, generating one only if none was configured.
+    # Clients of a baseline server pass the group it opened with
+    def _dh_exchange(self, server: bool, parameter_bytes: bytes | None = None):
         # Generate/receive DH parameters
         if server:
-            parameters = dh.generate_parameters(generator=2, key_size=2048)
+            parameters = self._dh_parameters
+            if parameters is None:
+                parameters = dh.generate_parameters(generator=2, key_size=2048)
             parameter_bytes = parameters.parameter_bytes(
                                             serialization.Encoding.PEM,
                                             serialization.ParameterFormat.PKCS3,
                                         )
-            parameter_header_size = len(parameter_bytes).to_bytes(HEADER_SIZE, BYTE_ORDER, signed=False)
-            self._sock.sendall(parameter_header_size)
-            self._sock.sendall(parameter_bytes)
+            yield parameter_bytes
         else:
-            parameter_header_size = self._sock.recv(HEADER_SIZE)
-            parameter_header_size = int.from_bytes(parameter_header_size, BYTE_ORDER, signed=False)
-            parameter_bytes = self._recv_n_bytes(parameter_header_size)
+            if parameter_bytes is None:
+                parameter_bytes = yield RECV
             parameters = serialization.load_pem_parameters(parameter_bytes)
 
         # Generate private key
@@ -148,41 +486,363 @@ class StegoSocket:
 
         # Send public key
         my_pkey_bytes = priv_key.public_key().public_bytes(
-                                                serialization.Encoding.PEM, 
+                                                serialization.Encoding.PEM,
                                                 serialization.PublicFormat.SubjectPublicKeyInfo
                                             )
-        send_size_header = len(my_pkey_bytes).to_bytes(HEADER_SIZE, BYTE_ORDER, signed=False)
-        self._sock.sendall(send_size_header)
-        self._sock.sendall(my_pkey_bytes)
+        yield my_pkey_bytes
 
         # Receive peer public key
-        recv_header_raw = self._sock.recv(HEADER_SIZE)
-        recv_size_header = int.from_bytes(recv_header_raw, BYTE_ORDER, signed=False)
-        peer_pub_key_raw = self._recv_n_bytes(recv_size_header) 
-        peer_pub_key = serialization.load_pem_public_key(bytes(peer_pub_key_raw)) 
+        peer_pub_key_raw = yield RECV
+        peer_pub_key = serialization.load_pem_public_key(peer_pub_key_raw)
+        return priv_key, peer_pub_key
+
+    # Exchanges supported feature versions with the peer. Each feature settles on the
+    # highest version both sides implement. Peers that omit a field get version 1. The
+    # server's hello goes first, so a client can tell a baseline server, which opens with its
+    # DH parameters instead, and treat it as a peer whose hello lists nothing. Returns those
+    # parameters for the key exchange, or None. Baseline clients wait for DH parameters
+    # without sending anything, so they cannot connect to servers sending a hello
+    def _negotiate(self, server: bool):
+        nonce = os.urandom(RESUME_NONCE_SIZE)
+        hello = {HELLO_ARRANGEMENT: ARRANGEMENT_VERSION, HELLO_KEX: self._key_exchanges, HELLO_NONCE: nonce.hex(),
+                 HELLO_FRAMING: FRAMING_VERSION, HELLO_CODECS: self._codecs,
+                 HELLO_DENSITIES: self._offered_densities, HELLO_COMPRESSION: self._compression_methods,
+                 HELLO_CIPHERS: self._ciphers}
+
+        if self._offer_streaming:
+            hello[HELLO_STREAMING] = STREAMING_VERSION
+
+        # Only servers holding a ticket cache offer resumption. Clients offer an unexpired ticket
+        if not server or self._ticket_cache is not None:
+            hello[HELLO_RESUMPTION] = RESUMPTION_VERSION
+        if not server and self.session is not None and self.session.expires_at > time.time():
+            hello[HELLO_TICKET] = self.session.ticket.hex()
+
+        legacy_parameters = None
+        if server:
+            yield json.dumps(hello).encode(HELLO_ENCODING)
+            peer_hello = _check_hello(json.loads((yield RECV).decode(HELLO_ENCODING)))
+        else:
+            first_message = yield RECV
+            if first_message.startswith(LEGACY_DH_PREFIX):
+                legacy_parameters, peer_hello = first_message, {}
+            else:
+                peer_hello = _check_hello(json.loads(first_message.decode(HELLO_ENCODING)))
+                yield json.dumps(hello).encode(HELLO_ENCODING)
+
+        self._arrangement_version = min(ARRANGEMENT_VERSION, int(peer_hello.get(HELLO_ARRANGEMENT, ARRANGEMENT_PROBING)))
+
+        # Key exchange is the server's most preferred method that the client also supports
+        peer_kex = peer_hello.get(HELLO_KEX, [KEX_DH])
+        server_kex, client_kex = (self._key_exchanges, peer_kex) if server else (peer_kex, self._key_exchanges)
+        common = [kex for kex in server_kex if kex in client_kex]
+        if not common:
+            raise socket.error("no common key exchange method")
+        self._kex = common[0]
+
+        # Output codec is picked the same way. Peers without the field only write PNG
+        peer_codecs = peer_hello.get(HELLO_CODECS, [DEFAULT_CODEC])
+        server_codecs, client_codecs = (self._codecs, peer_codecs) if server else (peer_codecs, self._codecs)
+        common = [codec for codec in server_codecs if codec in client_codecs]
+        if not common:
+            raise socket.error("no common output codec")
+        self._codec = common[0]
+
+        # Density signalling needs both sides to support it. Each side then picks any
+        # density the other also offered, per image
+        self._signal_density = HELLO_DENSITIES in peer_hello
+        if self._signal_density:
+            peer_densities = [int(density) for density in peer_hello[HELLO_DENSITIES]]
+            self._densities = [density for density in self._offered_densities if density in peer_densities]
+            if not self._densities:
+                raise socket.error("no common channel density")
+
+        # Payload cipher too. Peers without the field only know AES-CBC
+        peer_ciphers = peer_hello.get(HELLO_CIPHERS, [CIPHER_CBC])
+        server_ciphers, client_ciphers = (self._ciphers, peer_ciphers) if server else (peer_ciphers, self._ciphers)
+        common = [cipher for cipher in server_ciphers if cipher in client_ciphers]
+        if not common:
+            raise socket.error("no common payload cipher")
+        self._cipher = common[0]
+
+        # Compression is picked like the codec, but peers without a common method (or the
+        # field) simply send payloads uncompressed and without the flag byte
+        peer_methods = peer_hello.get(HELLO_COMPRESSION, [])
+        server_methods, client_methods = (self._compression_methods, peer_methods) if server else (peer_methods, self._compression_methods)
+        common = [method for method in server_methods if method in client_methods]
+        self._compressor = PayloadCompressor(common[0], self._max_frame_size) if common else None
+
+        self._framing = HELLO_FRAMING in peer_hello
+        self._streaming = self._framing and self._offer_streaming and HELLO_STREAMING in peer_hello
+
+        # Resumption needs both sides to support it, and the client to present a ticket
+        self._resumption = HELLO_RESUMPTION in hello and HELLO_RESUMPTION in peer_hello
+        peer_nonce = bytes.fromhex(peer_hello.get(HELLO_NONCE, ""))
+        self._client_nonce, self._server_nonce = (peer_nonce, nonce) if server else (nonce, peer_nonce)
+        client_hello = peer_hello if server else hello
+        self._resume_offered = self._resumption and HELLO_TICKET in client_hello
+        if server and self._resume_offered:
+            self._peer_ticket = bytes.fromhex(peer_hello[HELLO_TICKET])
+        return legacy_parameters
+
+
+class StegoSocket(StegoSession):
+    # With framing negotiated, sends are held for up to linger_s (or until batch_bytes are
+    # queued) so that bursts of small messages share one cover
+    def __init__(self, image_repo: str, sock: socket.socket, encryption: bool = False, is_server: bool = False,
+                 linger_s: float = DEFAULT_LINGER_S, batch_bytes: int = DEFAULT_BATCH_BYTES,
+                 recv_buffer_size: int = BUFFER_SIZE, on_send_failure=None, **options):
+        super().__init__(image_repo, encryption, **options)
+        self._sock = sock
+
+        # Handshake frames are read straight into one reusable buffer, grown to the largest
+        # frame seen. recv_buffer_size caps how much a single recv_into call asks the kernel for
+        self._recv_chunk = recv_buffer_size
+        self._recv_buf = bytearray(recv_buffer_size)
+        self._header_buf = bytearray(HEADER_SIZE)
+
+        # Once the handshake is done, frames are parsed incrementally from whatever has
+        # arrived, so a partly sent frame never blocks the reader
+        self._parser = FrameParser(HEADER_SIZE, BYTE_ORDER, self._max_frame_size, recv_buffer_size)
+        self._poller = select.poll()
+        self._poller.register(self._sock, select.POLLIN)
+        self._write_poller = select.poll()
+        self._write_poller.register(self._sock, select.POLLOUT)
+        self._pending = iter(())
+        self._send_lock = threading.Lock()
+
+        # The timeout sock was given bounds every wait for the peer. Once the handshake is done
+        # the socket itself is made non-blocking: CPython waits out a socket timeout instead of
+        # reporting that nothing is available, even with MSG_DONTWAIT
+        self._timeout = sock.gettimeout()
+        if self._use_encryption:
+            self._key_exchange(is_server)
+        self._sock.setblocking(False)
+        self._batcher = MessageBatcher(self._send_batch, linger_s, batch_bytes, on_send_failure) if self._framing else None
+
+    # Returns False if the message could not be encoded. When batching, the message may
+    # still be queued on return; if a deferred send fails, the messages it lost are passed to
+    # on_send_failure
+    def send(self, message: bytes) -> bool:
+        if self._batcher is not None:
+            return self._batcher.add(message)
+        return self._send_payload(self._frame(message))
+
+    # Sends any batched messages immediately
+    def flush(self) -> bool:
+        return self._batcher is None or self._batcher.flush()
+
+    # Streams source across as many covers as needed. source may be bytes, a binary file
+    # object or an iterable of bytes, and is read one chunk at a time. Returns False if the
+    # stream was aborted because a chunk did not fit any cover; the receiver then gets an
+    # error from recv_stream
+    def send_stream(self, source, chunk_size: int | None = None) -> bool:
+        if not self._streaming:
+            raise socket.error("peer does not support streaming")
+        chunk_size = chunk_size or self._max_plaintext() - STREAM_HEADER_SIZE
+        if chunk_size <= 0:
+            return False
+
+        # Keep messages sent before the stream ahead of it
+        self.flush()
+
+        stream_id = int.from_bytes(os.urandom(STREAM_ID_SIZE), BYTE_ORDER)
+        chunks = iter_chunks(source, chunk_size)
+        chunk = next(chunks, b'')
+        for seq in itertools.count():
+            # Look one chunk ahead to know which is the last
+            following = next(chunks, None)
+            flags = STREAM_FINAL if following is None else 0
+            if not self._send_encoded(self._seal(pack_stream_chunk(stream_id, seq, flags, chunk)), stream_id, seq):
+                return False
+
+            if following is None:
+                return True
+            chunk = following
+
+    # Receives a stream sent with send_stream, yielding its data chunk by chunk as each cover
+    # arrives. Messages received meanwhile are kept for recv()
+    def recv_stream(self):
+        stream_id, expected_seq = None, 0
+        while True:
+            payload = self._open_frame(self._wait_frame())
+            if not self._is_stream_chunk(payload):
+                self._pending = itertools.chain(self._pending, self._unframe(payload))
+                continue
+
+            chunk = parse_stream_chunk(payload)
+            if stream_id is None:
+                stream_id = chunk.stream_id
+            if chunk.flags & STREAM_ABORT:
+                raise socket.error("stream aborted by peer")
+            if chunk.stream_id != stream_id or chunk.seq != expected_seq:
+                raise socket.error("stream chunk out of sequence")
+
+            yield chunk.data
+            if chunk.flags & STREAM_FINAL:
+                return
+            expected_seq += 1
+
+    # Sends an encoded stream chunk, or tells the peer the stream is aborted if it is None
+    def _send_encoded(self, encoded_img: bytes | None, stream_id: int, seq: int) -> bool:
+        if encoded_img is None:
+            self._send_payload(pack_stream_chunk(stream_id, seq, STREAM_ABORT, b''))
+            return False
+        self._send_sized(encoded_img)
+        return True
+
+    def _send_batch(self, messages: list[bytes]) -> bool:
+        return self._send_payload(self._frame_batch(messages))
+
+    @timed(SEND_SECONDS)
+    def _send_payload(self, payload: bytes) -> bool:
+        encoded_img = self._seal(payload)
+        if encoded_img is None:
+            return False
+
+        # Send size header and encoded image to peer
+        self._send_sized(encoded_img)
+        return True
+
+    # Sends the same message to every socket, sharing per-message work between them (see
+    # StegoSession._seal_broadcast). Returns the sockets that failed to send
+    @staticmethod
+    def broadcast(stego_socks: list, message: bytes) -> list:
+        failed = []
+        for stego_sock, encoded_img in StegoSession._seal_broadcast(stego_socks, message):
+            # Cover too small, same outcome as send() returning False
+            if encoded_img is None:
+                continue
+            try:
+                stego_sock._send_sized(encoded_img)
+            except socket.error:
+                failed.append(stego_sock)
+        return failed
+
+    # Returns the next message, or None if none arrived whole within timeout_ms. A frame
+    # still arriving at the deadline is kept and completed by later calls
+    def recv(self, timeout_ms: int = POLL_TIME_MS) -> bytes | None:
+        # Hand out the rest of the last batch before reading another image
+        message = next(self._pending, None)
+        if message is not None:
+            return message
+
+        deadline = time.monotonic() + timeout_ms / 1000
+        while not self._parser.frames:
+            remaining_ms = max(0, (deadline - time.monotonic()) * 1000)
+            if not self._poller.poll(remaining_ms):
+                return None
+            self._read_available()
+
+        self._pending = self._decode(self._parser.frames.popleft())
+        return next(self._pending, None)
+
+    # Reads whatever the socket has available without blocking and returns every message
+    # completed so far, possibly none. For callers that poll the socket themselves
+    def recv_ready(self) -> list[bytes]:
+        self._read_available()
+        messages = list(self._pending)
+        self._pending = iter(())
+        while self._parser.frames:
+            messages.extend(self._decode(self._parser.frames.popleft()))
+        return messages
+
+    def _decode(self, frame: memoryview):
+        start = time.perf_counter()
+        messages = self._unframe(self._open_frame(frame))
+        RECV_SECONDS.observe(time.perf_counter() - start)
+        return messages
+
+    # Decoding copies the image out of the frame, so its buffer goes back to the parser after
+    def _open_frame(self, frame: memoryview) -> bytes:
+        try:
+            return self._open(frame)
+        finally:
+            self._parser.release(frame)
+
+    def _read_available(self):
+        BYTES_RECEIVED.inc(self._parser.read_from(self._sock))
+
+    # Blocks until a whole frame has been parsed, for at most the socket timeout per read
+    def _wait_frame(self) -> memoryview:
+        while not self._parser.frames:
+            if not self._poller.poll(None if self._timeout is None else self._timeout * 1000):
+                raise socket.timeout("timed out")
+            self._read_available()
+        return self._parser.frames.popleft()
+
+    # Runs the handshake over the blocking socket
+    def _key_exchange(self, server: bool):
+        steps = self._handshake(server)
+        request = next(steps)
+        try:
+            while True:
+                if request is RECV:
+                    request = steps.send(self._recv_sized())
+                else:
+                    self._send_sized(request)
+                    request = next(steps)
+        except StopIteration:
+            pass
+
+    # Sends data prefixed by its fixed-length size header. Serialized so deferred batch
+    # flushes and streams never interleave their bytes
+    def _send_sized(self, data: bytes):
+        with self._send_lock:
+            self._send_all(len(data).to_bytes(HEADER_SIZE, BYTE_ORDER, signed=False))
+            self._send_all(data)
+        BYTES_SENT.inc(HEADER_SIZE + len(data))
+
+    # sendall that also works once the socket is non-blocking, waiting up to the socket
+    # timeout at a time for the peer to make room. Callers hold self._send_lock
+    def _send_all(self, data: bytes):
+        view = memoryview(data)
+        while len(view) > 0:
+            try:
+                view = view[self._sock.send(view):]
+            except (BlockingIOError, InterruptedError):
+                if not self._write_poller.poll(None if self._timeout is None else self._timeout * 1000):
+                    raise socket.timeout("timed out")
+
+    def _recv_sized(self) -> bytes:
+        return bytes(self._recv_frame())
+
+    # Receives one size-prefixed frame. The returned view is only valid until the next receive
+    def _recv_frame(self) -> memoryview:
+        return self._recv_n_bytes(self._recv_header())
+
+    def _recv_header(self) -> int:
+        self._recv_exact(memoryview(self._header_buf))
+        size = int.from_bytes(self._header_buf, BYTE_ORDER, signed=False)
+        if size > self._max_frame_size:
+            raise ValueError(f"frame of {size} bytes exceeds the {self._max_frame_size} byte limit")
+        return size
+
+    # Reads exactly n bytes into the receive buffer and returns a view of them
+    def _recv_n_bytes(self, n: int) -> memoryview:
+        if n > len(self._recv_buf):
+            self._recv_buf = bytearray(n)
+        view = memoryview(self._recv_buf)[:n]
+        self._recv_exact(view)
+        return view
+
+    # Works whether or not the socket is non-blocking yet, waiting up to the socket timeout
+    # at a time for more data
+    def _recv_exact(self, view: memoryview):
+        received = 0
+        while received < len(view):
+            try:
+                count = self._sock.recv_into(view[received:received + self._recv_chunk])
+            except (BlockingIOError, InterruptedError):
+                if not self._poller.poll(None if self._timeout is None else self._timeout * 1000):
+                    raise socket.timeout("timed out")
+                continue
+            if count == 0:
+                raise socket.error("connection closed by peer")
+            received += count
+        BYTES_RECEIVED.inc(received)
 
-        # Derive two symmetric keys. One for encryption
-        # and one for steganographic pixel diffusion
-        self._shared_key = priv_key.exchange(peer_pub_key) 
-        master_key = HKDF(
-            algorithm=hashes.SHA256(),
-            length=AES_KEY_LENGTH * 2,
-            salt=None,
-            info=b'handshake'
-        ).derive(self._shared_key)
-        self._derived_key = master_key[:AES_KEY_LENGTH]
-        self._rearrange_key = master_key[AES_KEY_LENGTH:]
-    
-    def _recv_n_bytes(self, n: int):
-        byte_buf = bytearray()
-        while len(byte_buf) < n:
-            to_read = BUFFER_SIZE
-            if to_read > n - len(byte_buf):
-                to_read = n - len(byte_buf)
-            data = self._sock.recv(to_read)
-            byte_buf.extend(data)
-        return bytes(byte_buf)
-
-    
     def close(self):
-        self._sock.close()
\ No newline at end of file
+        if self._batcher is not None:
+            self._batcher.flush()
+        self._sock.close()
@@ -0,0 +1,54 @@
+import os
+import time
+import threading
+from collections import OrderedDict, namedtuple
+
+TICKET_SIZE = 16
+DEFAULT_TICKET_TTL_S = 3600
+DEFAULT_MAX_TICKETS = 10000
+
+# Client-side record of a resumable session: the ticket to present, the secret it unlocks
+# and when the server will have forgotten it
+SessionTicket = namedtuple("SessionTicket", ["ticket", "secret", "expires_at"])
+
+# Server-side store of resumption secrets. Tickets are single use, expire after ttl_s and
+# the oldest are dropped once max_entries is reached
+class TicketCache:
+    def __init__(self, ttl_s: float = DEFAULT_TICKET_TTL_S, max_entries: int = DEFAULT_MAX_TICKETS):
+        self.ttl_s = ttl_s
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Stores secret and returns the new ticket identifying it
+    def issue(self, secret: bytes) -> bytes:
+        ticket = os.urandom(TICKET_SIZE)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._entries[ticket] = (secret, now + self.ttl_s)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return ticket
+
+    # Returns the secret for ticket and forgets it, or None if unknown or expired
+    def redeem(self, ticket: bytes) -> bytes | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.pop(ticket, None)
+        if entry is None or entry[1] < now:
+            return None
+        return entry[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    # Entries are in issue order and share one TTL, so expired ones are always at the front.
+    # Callers must hold self._lock
+    def _expire(self, now: float):
+        while self._entries:
+            ticket, (_, expires_at) = next(iter(self._entries.items()))
+            if expires_at >= now:
+                break
+            del self._entries[ticket]
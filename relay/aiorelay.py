@@ -0,0 +1,123 @@
+import time
+import json
+import socket
+import asyncio
+import constants
+from concurrent.futures import Executor
+from aiostegsocket import AsyncStegoSocket
+from stegsocket import handshake_latency
+from metrics import counter, gauge, histogram
+
+QUEUED_SOCKETS_LIMIT = 10
+HANDSHAKE_REPORT_EVERY = 100
+# Messages a channel holds for its next routing round. Once full, members' reader tasks wait,
+# so a channel that cannot keep up slows its talkers down instead of growing without bound
+CHANNEL_QUEUE_LIMIT = 1000
+
+# Shared with the threaded relay in threadrelay.py
+ROUTE_SECONDS = histogram("relay_route_round_seconds", "Time to encode and deliver one routing round to a channel")
+RELAYED_MESSAGES = counter("relay_messages_total", "Client messages relayed", ("channel",))
+QUEUE_DEPTH = gauge("relay_queue_depth", "Client messages waiting for the next routing round", ("channel",))
+
+# Members of one channel plus the queue of messages waiting to be relayed to them
+class Channel:
+    def __init__(self, name: str):
+        self.name = name
+        self.members = set()
+        self.queue = asyncio.Queue(CHANNEL_QUEUE_LIMIT)
+        self.task = None
+
+# Relay built on asyncio. Every connection gets its own reader task and every channel its own
+# broadcast task, so accepting, receiving and relaying never wait on unrelated connections.
+# Handshakes and stego/crypto work are pushed to the executor
+class AsyncRelay:
+    # socket_options are passed through to every AsyncStegoSocket
+    def __init__(self, image_repo: str, executor: Executor | None = None, socket_options: dict | None = None):
+        self._image_repo = image_repo
+        self._executor = executor
+        self._socket_options = socket_options or {}
+        self._channels = {}
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self._handle_client, host, port, backlog=QUEUED_SOCKETS_LIMIT)
+        async with server:
+            await server.serve_forever()
+
+    # Per-connection task: handshake, channel join, then queue every received message
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        stego_sock = None
+        channel = None
+        try:
+            stego_sock = await AsyncStegoSocket.create(self._image_repo, reader, writer, encryption=True,
+                                                       is_server=True, executor=self._executor,
+                                                       timeout=constants.SOCK_TIMEOUT, **self._socket_options)
+            if handshake_latency.count % HANDSHAKE_REPORT_EVERY == 0:
+                print("Handshake latency: " + handshake_latency.summary())
+
+            raw_message = await asyncio.wait_for(stego_sock.recv(), constants.SOCK_TIMEOUT)
+            message = json.loads(raw_message.decode(constants.CHAR_ENCODING))
+            channel = self._join(message[constants.CHANNEL_PARAM], stego_sock)
+
+            while True:
+                message = await stego_sock.recv()
+                await channel.queue.put(message.decode(constants.CHAR_ENCODING))
+                QUEUE_DEPTH.set(channel.queue.qsize(), channel.name)
+        except (ConnectionError, socket.error, asyncio.TimeoutError, ValueError, KeyError):
+            pass
+        finally:
+            if channel is not None:
+                self._leave(channel, stego_sock)
+            if stego_sock is not None:
+                await stego_sock.close()
+            else:
+                writer.close()
+
+    def _join(self, name: str, stego_sock: AsyncStegoSocket) -> Channel:
+        channel = self._channels.get(name)
+        if channel is None:
+            print("Creating Channel: " + name)
+            channel = Channel(name)
+            channel.task = asyncio.create_task(self._route(channel))
+            self._channels[name] = channel
+        channel.members.add(stego_sock)
+        return channel
+
+    def _leave(self, channel: Channel, stego_sock: AsyncStegoSocket):
+        channel.members.discard(stego_sock)
+        if len(channel.members) == 0 and self._channels.get(channel.name) is channel:
+            print("Deleting Channel: " + channel.name)
+            channel.task.cancel()
+            del self._channels[channel.name]
+            QUEUE_DEPTH.remove(channel.name)
+
+    # Per-channel task: batches whatever messages are queued and relays them to every member
+    async def _route(self, channel: Channel):
+        while True:
+            messages = [await channel.queue.get()]
+            while not channel.queue.empty():
+                messages.append(channel.queue.get_nowait())
+            QUEUE_DEPTH.set(0, channel.name)
+            RELAYED_MESSAGES.inc(len(messages), channel.name)
+
+            # One failed round must not end the task, or the channel goes silent
+            try:
+                await self._relay(channel, messages)
+            except Exception as e:
+                print("Routing round failed for channel " + channel.name + ": " + repr(e))
+
+    async def _relay(self, channel: Channel, messages: list[str]):
+        start = time.perf_counter()
+        master_message = json.dumps({constants.MESSAGES_PARAM: messages}).encode(constants.CHAR_ENCODING)
+        sealed = await AsyncStegoSocket.seal_broadcast(list(channel.members), master_message, self._executor)
+        sends = [stego_sock.send_encoded(encoded_img) for stego_sock, encoded_img in sealed if encoded_img is not None]
+        results = await asyncio.gather(*sends, return_exceptions=True)
+
+        # A member that did not take its image within the timeout is dropped like a broken
+        # one, so it cannot hold up the rest of the channel on the next round
+        receivers = [stego_sock for stego_sock, encoded_img in sealed if encoded_img is not None]
+        for stego_sock, result in zip(receivers, results):
+            if isinstance(result, Exception):
+                print("Problem. Cleaning up")
+                self._leave(channel, stego_sock)
+                stego_sock.abort()
+        ROUTE_SECONDS.observe(time.perf_counter() - start)
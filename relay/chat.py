@@ -8,16 +8,22 @@ import socket
 import select
 import constants
 import threading
-from network.stegsocket import StegoSocket
+from stegsocket import StegoSocket
 
 host = sys.argv[1]
 port = int(sys.argv[2])
 channel = sys.argv[3]
 
+# Lines typed in quick succession (e.g. a paste) are batched into one cover
+SEND_LINGER_S = 0.05
+
 username = str(input("Enter alias> "))
 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 sock.connect((host, port))
-stego_sock = StegoSocket("../images/", sock, encryption=True)
+def report_lost(messages):
+    print("[ERROR] Failed to send " + str(len(messages)) + " message(s)")
+
+stego_sock = StegoSocket("../images/", sock, encryption=True, linger_s=SEND_LINGER_S, on_send_failure=report_lost)
 
 handshake_msg = json.dumps({constants.CHANNEL_PARAM: channel}).encode(constants.CHAR_ENCODING)
 stego_sock.send(handshake_msg)
@@ -3,93 +3,15 @@ sys.path.append("../network")
 sys.path.append("..")
 
 import os
-import json
-import select
-import socket
-import constants
-import threading
-from network.stegsocket import StegoSocket
+import asyncio
+from aiorelay import AsyncRelay
+from threadrelay import ThreadedRelay
+from stegsocket import StegoWorkerPool, get_cover_cache, get_cover_index, load_dh_parameters, TicketCache, KEX_DH
+from arrangementcache import get_arrangement_cache
+from stego import DENSITIES, available_codecs
 from configparser import ConfigParser
-
-# Constants
-QUEUED_SOCKETS_LIMIT = 10 
-POLL_PERIOD_MS = 5000
-
-# Shared Memory
-sockets_mutex = threading.Lock()
-pollers_mutex = threading.Lock()
-sockets = {}
-pollers = {}
-
-# Handle initial connections being placed in the right resource stores
-def client_ingestion_daemon(host, port, image_repo):
-    sock = socket.socket() 
-    sock.bind((host, port))
-    sock.listen(QUEUED_SOCKETS_LIMIT)
-
-    while True:
-        client_sock, _ = sock.accept()
-        client_sock.settimeout(constants.SOCK_TIMEOUT)
-        stego_sock = StegoSocket(image_repo, client_sock, encryption=True, is_server=True)
-
-        raw_message = stego_sock.recv().decode(constants.CHAR_ENCODING) 
-        message = json.loads(raw_message)
-        channel = message[constants.CHANNEL_PARAM]
-
-        pollers_mutex.acquire()
-        sockets_mutex.acquire()
-        if channel not in pollers:
-            print("Creating Channel: " + channel)
-            pollers[channel] = select.poll()
-            sockets[channel] = {} 
-        pollers[channel].register(stego_sock._sock, select.POLLIN)
-        sockets[channel][stego_sock._sock.fileno()] = stego_sock
-        sockets_mutex.release()
-        pollers_mutex.release()
-
-# Handle removal of dead connections and resources
-def cleanup_resource(channel_id, sock_id):
-    pollers[channel_id].unregister(sock_id)
-    del sockets[channel_id][sock_id]
-
-    if len(sockets[channel_id]) == 0:
-        print("deleteing channel: " + channel_id)
-        del pollers[channel_id]
-        del sockets[channel_id]
-
-# Handle routing of messages between connections in channels
-def routing_daemon():
-    while True:
-        for channel in list(pollers.keys()):
-            # Accumulate messages in channel
-            pollers_mutex.acquire()
-            sockets_mutex.acquire()
-            messages = []
-            events = pollers[channel].poll(POLL_PERIOD_MS)
-            for sock_id, event in events:
-                if event and select.POLLIN:
-                    stego_sock = sockets[channel][sock_id]
-                    try:
-                        message = stego_sock.recv().decode(constants.CHAR_ENCODING)
-                        messages.append(message)
-                    except:
-                        cleanup_resource(channel, sock_id)
-            sockets_mutex.release()
-            pollers_mutex.release()
-            
-            # Relay messages
-            sockets_mutex.acquire()
-            if len(messages) != 0:
-                master_message = json.dumps({constants.MESSAGES_PARAM: messages}).encode(constants.CHAR_ENCODING)
-                for sock_id in list(sockets[channel].keys()):
-                    stego_sock = sockets[channel][sock_id]
-                    try:
-                        stego_sock.send(master_message)
-                    except:
-                        print("Problem. Cleaning up")
-                        cleanup_resource(channel, sock_id)
-            sockets_mutex.release()
-
+from concurrent.futures import ThreadPoolExecutor
+from metrics import REGISTRY, serve_metrics, start_log_dump
 
 if __name__ == "__main__":
     # Read configuration file
@@ -102,15 +24,75 @@ if __name__ == "__main__":
 
     host = parser.get('network', 'host')
     port = int(parser.get('network', 'port'))
+    mode = parser.get('network', 'mode', fallback='asyncio')
     image_repo = parser.get('security', 'image_repository')
-
-    # Start threads
-    ingestion_thread = threading.Thread(target=client_ingestion_daemon, args=(host, port, image_repo), daemon=True)
-    routing_thread = threading.Thread(target=routing_daemon, daemon=True)
-
-    ingestion_thread.start()
-    routing_thread.start()
-
-    # Hang indefinitely
-    ingestion_thread.join()
-    routing_thread.join()
+    dh_parameters_path = parser.get('security', 'dh_parameters', fallback='dh_params.pem')
+    key_exchanges = [kex.strip() for kex in parser.get('security', 'key_exchange', fallback='x25519, dh').split(',')]
+    ciphers = [cipher.strip() for cipher in parser.get('security', 'ciphers', fallback='aes-256-gcm, chacha20-poly1305, aes-256-cbc').split(',')]
+    ticket_ttl_s = parser.getint('security', 'ticket_ttl_s', fallback=3600)
+    max_tickets = parser.getint('security', 'max_tickets', fallback=10000)
+    max_frame_mb = parser.getint('security', 'max_frame_mb', fallback=64)
+    cover_cache_mb = parser.getint('performance', 'cover_cache_mb', fallback=256)
+    arrangement_cache_mb = parser.getint('performance', 'arrangement_cache_mb', fallback=16)
+    executor_threads = parser.getint('performance', 'executor_threads', fallback=os.cpu_count())
+    routing_workers = parser.getint('performance', 'routing_workers', fallback=1)
+    stego_workers = parser.getint('performance', 'stego_workers', fallback=0)
+    codecs = [codec.strip() for codec in parser.get('performance', 'codecs', fallback='png').split(',')]
+    densities = [int(density) for density in parser.get('performance', 'densities', fallback='1, 2, 3, 4').split(',')]
+    compression = [method.strip() for method in parser.get('performance', 'compression', fallback='').split(',') if method.strip()]
+    metrics_enabled = parser.getboolean('metrics', 'enabled', fallback=False)
+    metrics_host = parser.get('metrics', 'host', fallback='127.0.0.1')
+    metrics_port = parser.getint('metrics', 'port', fallback=0)
+    metrics_log_interval_s = parser.getfloat('metrics', 'log_interval_s', fallback=0)
+
+    # Offering a codec this build cannot write, or a density the 2-bit marker cannot record,
+    # would only fail once a peer agrees to it
+    unsupported_codecs = [codec for codec in codecs if codec not in available_codecs()]
+    if unsupported_codecs:
+        print("[Error] Unsupported codecs: " + ", ".join(unsupported_codecs))
+        sys.exit(1)
+    unsupported_densities = [density for density in densities if density not in DENSITIES]
+    if unsupported_densities:
+        print("[Error] Unsupported densities: " + ", ".join(map(str, unsupported_densities)))
+        sys.exit(1)
+
+    # Instrumentation records nothing unless enabled
+    REGISTRY.enabled = metrics_enabled
+    if metrics_enabled and metrics_port > 0:
+        serve_metrics(metrics_host, metrics_port)
+    if metrics_enabled and metrics_log_interval_s > 0:
+        start_log_dump(metrics_log_interval_s)
+
+    # Size the decoded cover cache shared by every client socket
+    get_cover_cache(image_repo, cover_cache_mb * 2**20)
+
+    # Keyed pixel arrangements kept for reuse between messages of equal length
+    get_arrangement_cache().set_budget(arrangement_cache_mb * 2**20)
+
+    # Index cover sizes up front rather than on the first message
+    get_cover_index(image_repo)
+
+    # Stego encoding/decoding runs in worker processes when enabled, each with its own
+    # arrangement cache of the same size
+    pool = StegoWorkerPool(stego_workers, arrangement_cache_mb * 2**20) if stego_workers > 0 else None
+
+    # Load or generate the DH group once instead of per connection, if DH is offered at all
+    socket_options = {
+        'pool': pool,
+        'dh_parameters': load_dh_parameters(dh_parameters_path) if KEX_DH in key_exchanges else None,
+        'key_exchanges': key_exchanges,
+        'ciphers': ciphers,
+        'codecs': codecs,
+        'densities': densities,
+        'compression': compression,
+        'ticket_cache': TicketCache(ticket_ttl_s, max_tickets) if ticket_ttl_s > 0 else None,
+        'max_frame_size': max_frame_mb * 2**20,
+    }
+
+    if mode == 'asyncio':
+        relay = AsyncRelay(image_repo, ThreadPoolExecutor(executor_threads), socket_options)
+        asyncio.run(relay.serve(host, port))
+        sys.exit(0)
+
+    relay = ThreadedRelay(image_repo, routing_workers, ThreadPoolExecutor(executor_threads), socket_options)
+    relay.serve(host, port)
@@ -0,0 +1,204 @@
+import json
+import time
+import queue
+import selectors
+import socket
+import threading
+import constants
+from concurrent.futures import Executor
+from stegsocket import StegoSocket, handshake_latency
+from aiorelay import QUEUED_SOCKETS_LIMIT, HANDSHAKE_REPORT_EVERY, ROUTE_SECONDS, RELAYED_MESSAGES, QUEUE_DEPTH
+
+from metrics import histogram, acquire_timed
+
+LOCK_WAIT_SECONDS = histogram("relay_lock_wait_seconds", "Time spent waiting to acquire relay locks", ("lock",))
+
+# Members of one channel. Everything here is guarded by the channel's own lock, so routing
+# one channel never holds up joins to, or routing of, any other
+class ChannelState:
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.sockets = {}
+        self.closed = False
+
+# Relay built on threads. One selector watches every client socket and hands each readable
+# one straight to the routing worker its channel is hashed to, so how soon a message is
+# relayed does not depend on how many channels there are. Connections are admitted
+# (handshake and join) on the executor
+class ThreadedRelay:
+    # socket_options are passed through to every StegoSocket
+    def __init__(self, image_repo: str, routing_workers: int = 1, executor: Executor | None = None,
+                 socket_options: dict | None = None):
+        self._image_repo = image_repo
+        self._executor = executor
+        self._socket_options = socket_options or {}
+
+        # Guards only the channel directory, never held while doing I/O
+        self._channels_lock = threading.Lock()
+        self._channels = {}
+
+        # A socket is registered while idle and unregistered from the moment it is handed
+        # to a worker until that worker is done with it, so it is never read by two threads
+        # and a socket being read does not keep waking the selector
+        self._selector = selectors.DefaultSelector()
+        self._ready = [queue.SimpleQueue() for _ in range(max(1, routing_workers))]
+
+    def serve(self, host: str, port: int):
+        for ready in self._ready:
+            threading.Thread(target=self._route, args=(ready,), daemon=True).start()
+        threading.Thread(target=self._watch, daemon=True).start()
+
+        server = socket.socket()
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, port))
+        server.listen(QUEUED_SOCKETS_LIMIT)
+        while True:
+            client_sock, _ = server.accept()
+            if self._executor is not None:
+                self._executor.submit(self._admit, client_sock)
+            else:
+                self._admit(client_sock)
+
+    # Handshake and channel join for one new connection. Whatever goes wrong before the join,
+    # the connection is closed
+    def _admit(self, client_sock: socket.socket):
+        client_sock.settimeout(constants.SOCK_TIMEOUT)
+        joined = False
+        try:
+            # The relay does not forward streams, so it does not offer streaming
+            stego_sock = StegoSocket(self._image_repo, client_sock, encryption=True, is_server=True, streaming=False,
+                                     **self._socket_options)
+            if handshake_latency.count % HANDSHAKE_REPORT_EVERY == 0:
+                print("Handshake latency: " + handshake_latency.summary())
+
+            raw_message = stego_sock.recv(constants.SOCK_TIMEOUT * 1000)
+            message = json.loads(raw_message.decode(constants.CHAR_ENCODING))
+            self._join(message[constants.CHANNEL_PARAM], stego_sock)
+            joined = True
+        except (socket.error, AttributeError, ValueError, KeyError, TypeError):
+            pass
+        finally:
+            if not joined:
+                client_sock.close()
+
+    def _join(self, name: str, stego_sock: StegoSocket):
+        while True:
+            with self._channels_lock:
+                channel = self._channels.get(name)
+                if channel is None:
+                    print("Creating Channel: " + name)
+                    channel = ChannelState(name)
+                    self._channels[name] = channel
+
+            acquire_timed(channel.lock, LOCK_WAIT_SECONDS, "channel")
+            try:
+                # The channel may have emptied and been deleted in between, if so start over
+                if channel.closed:
+                    continue
+                channel.sockets[stego_sock._sock.fileno()] = stego_sock
+            finally:
+                channel.lock.release()
+
+            # Messages batched with the join message are already decoded and waiting, so
+            # the worker reads the socket once now rather than when it next becomes readable
+            self._dispatch(channel, stego_sock)
+            return
+
+    # Removes a dead connection, deleting the channel once empty. Callers hold channel.lock
+    # and the socket is not registered with the selector
+    def _leave(self, channel: ChannelState, stego_sock: StegoSocket):
+        if channel.sockets.pop(stego_sock._sock.fileno(), None) is None:
+            return
+        stego_sock.close()
+
+        if len(channel.sockets) == 0:
+            print("Deleting Channel: " + channel.name)
+            channel.closed = True
+            with self._channels_lock:
+                if self._channels.get(channel.name) is channel:
+                    del self._channels[channel.name]
+            QUEUE_DEPTH.remove(channel.name)
+
+    # Readiness loop: dispatches every readable client socket to its channel's worker
+    def _watch(self):
+        while True:
+            for key, _ in self._selector.select():
+                channel, stego_sock = key.data
+                self._selector.unregister(key.fileobj)
+                self._dispatch(channel, stego_sock)
+
+    # Hands an unregistered member to its channel's worker, which registers it again when done
+    def _dispatch(self, channel: ChannelState, stego_sock: StegoSocket):
+        self._ready[hash(channel.name) % len(self._ready)].put((channel, stego_sock))
+
+    # Takes an idle member out of the selector. Members already dispatched to a worker are
+    # not registered, their worker finds them gone
+    def _unwatch(self, stego_sock: StegoSocket):
+        try:
+            self._selector.unregister(stego_sock._sock)
+        except KeyError:
+            pass
+
+    # Routing worker: reads the sockets dispatched to it and relays what they sent. Whatever
+    # else is already waiting is taken along, so busy channels get one broadcast per round
+    def _route(self, ready: queue.SimpleQueue):
+        while True:
+            by_channel = {}
+            item = ready.get()
+            while item is not None:
+                channel, stego_sock = item
+                by_channel.setdefault(channel, []).append(stego_sock)
+                try:
+                    item = ready.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            # One failed round must not stop this worker, or every channel hashed to it
+            for channel, stego_socks in by_channel.items():
+                try:
+                    self._relay(channel, stego_socks)
+                except Exception as e:
+                    print("Routing round failed for channel " + channel.name + ": " + repr(e))
+
+    # Reads what each of stego_socks has sent and relays the messages to all of channel
+    def _relay(self, channel: ChannelState, stego_socks: list):
+        # Accumulate messages in channel. Dispatched sockets belong to this worker alone, so
+        # they are read without the channel lock. Reads never block: whatever part of a frame
+        # has arrived is kept by the socket's parser until the rest makes it readable again
+        messages = []
+        alive = []
+        dead = []
+        for stego_sock in stego_socks:
+            try:
+                messages.extend(m.decode(constants.CHAR_ENCODING) for m in stego_sock.recv_ready())
+                alive.append(stego_sock)
+            except (socket.error, ValueError):
+                dead.append(stego_sock)
+        QUEUE_DEPTH.set(len(messages), channel.name)
+
+        acquire_timed(channel.lock, LOCK_WAIT_SECONDS, "channel")
+        try:
+            for stego_sock in dead:
+                self._leave(channel, stego_sock)
+
+            # Relay messages
+            if messages and not channel.closed:
+                RELAYED_MESSAGES.inc(len(messages), channel.name)
+                start = time.perf_counter()
+                master_message = json.dumps({constants.MESSAGES_PARAM: messages}).encode(constants.CHAR_ENCODING)
+                failed = StegoSocket.broadcast(list(channel.sockets.values()), master_message)
+                for stego_sock in failed:
+                    print("Problem. Cleaning up")
+                    if stego_sock in alive:
+                        alive.remove(stego_sock)
+                    else:
+                        self._unwatch(stego_sock)
+                    self._leave(channel, stego_sock)
+                ROUTE_SECONDS.observe(time.perf_counter() - start)
+        finally:
+            channel.lock.release()
+
+            # Back to the selector once done reading, for the next frame, even if relaying failed
+            for stego_sock in alive:
+                self._selector.register(stego_sock._sock, selectors.EVENT_READ, (channel, stego_sock))
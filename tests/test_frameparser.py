@@ -0,0 +1,48 @@
+import os
+import sys
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "network"))
+
+from frameparser import FrameParser, POOLED_BUFFERS
+
+HEADER_SIZE = 4
+BYTE_ORDER = 'big'
+
+def sized(body: bytes) -> bytes:
+    return len(body).to_bytes(HEADER_SIZE, BYTE_ORDER, signed=False) + body
+
+# Released body buffers must be reused for later frames, never handed out while still in use
+class BufferReuseTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = FrameParser(HEADER_SIZE, BYTE_ORDER)
+
+    def test_released_buffer_is_reused(self):
+        self.parser.feed(sized(b'a' * 1000))
+        first = self.parser.frames.popleft()
+        buffer = first.obj
+        self.parser.release(first)
+
+        self.parser.feed(sized(b'b' * 600))
+        second = self.parser.frames.popleft()
+        self.assertIs(second.obj, buffer)
+        self.assertEqual(bytes(second), b'b' * 600)
+
+    def test_unreleased_frames_keep_their_data(self):
+        self.parser.feed(sized(b'a' * 100) + sized(b'b' * 100))
+        first, second = self.parser.frames
+        self.assertIsNot(first.obj, second.obj)
+        self.assertEqual(bytes(first), b'a' * 100)
+        self.assertEqual(bytes(second), b'b' * 100)
+
+    def test_pool_keeps_largest_buffers(self):
+        for size in range(1, POOLED_BUFFERS + 2):
+            self.parser.feed(sized(bytes(size * 100)))
+        for frame in list(self.parser.frames):
+            self.parser.release(frame)
+        self.assertEqual(sorted(len(buffer) for buffer in self.parser._free),
+                         [size * 100 for size in range(2, POOLED_BUFFERS + 2)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,22 @@
+import os
+import sys
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "network"))
+
+from framing import pack_messages, iter_messages, WIDE_FRAME_LENGTH_SIZE
+
+# Messages of 64 KB or more only frame with the wide lengths used under compression
+class FrameLengthTest(unittest.TestCase):
+    def test_narrow_lengths_refuse_large_messages(self):
+        with self.assertRaises(ValueError):
+            pack_messages([bytes(2**16)])
+
+    def test_wide_lengths_round_trip(self):
+        messages = [b'before', bytes(2**17), b'after']
+        payload = pack_messages(messages, WIDE_FRAME_LENGTH_SIZE)
+        self.assertEqual(list(iter_messages(payload, WIDE_FRAME_LENGTH_SIZE)), messages)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "network"))
+
+from stego import StegoTranscoder, available_codecs
+
+# Cover shapes of every image mode a repository may hold
+COVER_SHAPES = {"L": (64, 64), "LA": (64, 64, 2), "RGB": (64, 64, 3), "RGBA": (64, 64, 4)}
+
+# Every codec must hand back the message for covers of every mode, whatever it writes them as
+class CodecRoundTripTest(unittest.TestCase):
+    def test_every_codec_and_mode_round_trips(self):
+        rng = np.random.default_rng(0)
+        message = bytes(rng.integers(0, 256, 300, dtype=np.uint8))
+        for codec in available_codecs():
+            transcoder = StegoTranscoder(rearrange_key=os.urandom(32), codec=codec)
+            for mode, shape in COVER_SHAPES.items():
+                with self.subTest(codec=codec, mode=mode):
+                    cover = rng.integers(0, 256, shape, dtype=np.uint8)
+                    self.assertEqual(transcoder.decode(transcoder.encode_buffer(message, cover)), message)
+
+if __name__ == "__main__":
+    unittest.main()
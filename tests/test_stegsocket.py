@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import socket
+import threading
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_DIR = os.path.join(ROOT_DIR, "images")
+sys.path.append(os.path.join(ROOT_DIR, "network"))
+
+from stegsocket import StegoSocket, HEADER_SIZE, BYTE_ORDER, _check_hello
+
+# Timeout of the receiving socket, as the threaded relay sets on every client
+SOCK_TIMEOUT_S = 3
+
+# Reading a partly arrived frame from a socket with a timeout must return at once, keeping
+# the partial frame, rather than waiting out the timeout
+class PartialFrameTest(unittest.TestCase):
+    def setUp(self):
+        self.receiver_end, self.sender_end = socket.socketpair()
+        self.receiver_end.settimeout(SOCK_TIMEOUT_S)
+        self.receiver = StegoSocket(IMAGE_DIR, self.receiver_end)
+        self.sender = StegoSocket(IMAGE_DIR, self.sender_end)
+        self.encoded_img = self.sender._seal(b'partial frame')
+        self.frame = len(self.encoded_img).to_bytes(HEADER_SIZE, BYTE_ORDER, signed=False) + self.encoded_img
+
+    def tearDown(self):
+        self.receiver.close()
+        self.sender.close()
+
+    def send_raw(self, data: bytes):
+        with self.sender._send_lock:
+            self.sender._send_all(data)
+
+    # The rest of the image is larger than the socket buffers, so it is sent while receiving
+    def finish_frame(self) -> bytes:
+        sender = threading.Thread(target=self.send_raw, args=(self.frame[HEADER_SIZE + 10:],))
+        sender.start()
+        message = self.receiver.recv(SOCK_TIMEOUT_S * 1000)
+        sender.join()
+        return message
+
+    def test_recv_ready_returns_partial_frame_without_blocking(self):
+        self.send_raw(self.frame[:HEADER_SIZE + 10])
+        start = time.monotonic()
+        self.assertEqual(self.receiver.recv_ready(), [])
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertTrue(self.receiver._parser.partial())
+
+        self.assertEqual(self.finish_frame(), b'partial frame')
+
+    def test_recv_keeps_its_deadline(self):
+        self.send_raw(self.frame[:HEADER_SIZE + 10])
+        start = time.monotonic()
+        self.assertIsNone(self.receiver.recv(200))
+        self.assertLess(time.monotonic() - start, 1)
+
+        self.assertEqual(self.finish_frame(), b'partial frame')
+
+    # Sends on the now non-blocking socket still wait for the peer to make room
+    def test_large_send_waits_for_room(self):
+        data = os.urandom(8 * 2**20)
+        received = bytearray()
+
+        # Read the raw socket directly, as a plain blocking peer would
+        def read_slowly():
+            self.receiver_end.settimeout(SOCK_TIMEOUT_S)
+            time.sleep(0.2)
+            while len(received) < HEADER_SIZE + len(data):
+                received.extend(self.receiver_end.recv(65536))
+
+        reader = threading.Thread(target=read_slowly)
+        reader.start()
+        self.sender._send_sized(data)
+        reader.join()
+        self.assertEqual(bytes(received[HEADER_SIZE:]), data)
+
+# Hellos with fields of the wrong type must fail the handshake like any other bad hello
+class HelloCheckTest(unittest.TestCase):
+    def test_malformed_hellos_are_refused(self):
+        for hello in [[], {"arrangement": []}, {"kex": "x25519"}, {"densities": ["2"]}, {"nonce": 5}]:
+            with self.assertRaises(socket.error):
+                _check_hello(hello)
+
+    def test_well_formed_hello_passes(self):
+        hello = {"arrangement": 2, "kex": ["x25519"], "densities": [1, 2], "nonce": "00", "framing": 1}
+        self.assertIs(_check_hello(hello), hello)
+
+if __name__ == "__main__":
+    unittest.main()